@@ -1,18 +1,23 @@
 import os
 import json
+import datetime
 import logging
 import argparse
-from typing import List, Dict, Any, Optional
-import google.generativeai as genai
-import httpx
-from PIL import Image
+from typing import Callable, List, Dict, Any, Optional
 import io
+from image_select import select_images
+from models import InferenceResult, json_schema
+from prompt_cache import CachedPrefix, TokenUsage, is_cache_error
+from resilience import Deadline, get_breaker, retry_call
+from structured_output import StructuredResult, parse_stream, repair, strip_schema_keys
+
+MODEL_NAME = "gemini-2.5-flash"
+# Upper bound for a single vision model call; the product deadline may cut it shorter
+MODEL_TIMEOUT = 60.0
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Agent B System Prompt
+# Agent B System Prompt: static for every product, sent once as a cached prefix
 SYSTEM_PROMPT = """You are Agent B: Vision & Search Query Generator in a product-matching pipeline.
 Your job is to analyze wholesale product records from QiQiYG (text + images) and produce:
 - a best-guess brand,
@@ -63,65 +68,178 @@ How to reason:
 
 Output MUST be ONLY a JSON object."""
 
+def _chunk_text(chunk) -> str:
+    # Chunks without text parts (e.g. the final finish-reason chunk) raise on .text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def input_payload(product_data: Dict[str, Any]) -> str:
+    return f"Input JSON:\n{json.dumps(product_data)}"
+
+
+def batch_request(product_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    The same call as process_product(), as a batch-API request body. The selected
+    images are fetched now and sent inline, so the request file is self-contained.
+    """
+    import base64
+    import mimetypes
+    from media_store import guess_extension
+
+    parts = [{"text": input_payload(product_data)}]
+    for image in select_images(product_data.get("image_urls", []), deadline=deadline, probe=False,
+                               product_id=product_data.get("product_internal_id")):
+        mime_type = mimetypes.types_map.get(guess_extension(image.content, None), "image/jpeg")
+        parts.append({"inline_data": {"mime_type": mime_type, "data": base64.b64encode(image.content).decode("ascii")}})
+    return {
+        "contents": [{"role": "user", "parts": parts}],
+        "system_instruction": {"parts": [{"text": SYSTEM_PROMPT}]},
+        "generation_config": {
+            "response_mime_type": "application/json",
+            "response_schema": json_schema(InferenceResult),
+        },
+    }
+
+
+def finish_inference(parsed: StructuredResult, product_data: Dict[str, Any],
+                     repair_call: Optional[Callable[[str, Dict[str, Any]], str]] = None) -> Dict[str, Any]:
+    """Turns a parsed response into the inference record, repairing broken fields when `repair_call` is given."""
+    if parsed.broken and repair_call is not None:
+        parsed = repair(parsed, input_payload(product_data), repair_call)
+    if parsed.broken:
+        logger.warning(f"Agent B fields left at defaults: {', '.join(parsed.broken)}")
+    result = parsed.record()
+    result["product_internal_id"] = product_data.get("product_internal_id")
+    return result
+
+
 class AgentB:
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("Google API Key not found. Set GOOGLE_API_KEY environment variable.")
         
+        # Imported on first use so CLI startup doesn't pay for the SDK
+        import google.generativeai as genai
         genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-
-    def _fetch_image(self, url: str) -> Optional[Image.Image]:
-        try:
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(url)
-                response.raise_for_status()
-                return Image.open(io.BytesIO(response.content))
-        except Exception as e:
-            logger.error(f"Error fetching image {url}: {e}")
-            return None
-
-    def process_product(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
+        self.model = genai.GenerativeModel(MODEL_NAME, system_instruction=SYSTEM_PROMPT)
+        self.usage = TokenUsage()
+        self.prompt_cache = CachedPrefix(
+            "agent-b-system-prompt",
+            create_fn=self._create_cache,
+            refresh_fn=lambda cache, ttl: cache.update(ttl=datetime.timedelta(seconds=ttl)),
+            delete_fn=lambda cache: cache.delete(),
+            # Counted on a model without the system instruction, which would be counted again
+            count_fn=lambda: genai.GenerativeModel(MODEL_NAME).count_tokens(SYSTEM_PROMPT).total_tokens,
+        )
+        self._cached_models: Dict[str, Any] = {}
+
+    def _create_cache(self, ttl: int):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=f"models/{MODEL_NAME}",
+            display_name="automatch-agent-b",
+            system_instruction=SYSTEM_PROMPT,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+
+    def _model_for(self, cache) -> Any:
+        """The model to call: bound to the cached prefix when there is one."""
+        if cache is None:
+            return self.model
+        if cache.name not in self._cached_models:
+            import google.generativeai as genai
+            self._cached_models = {cache.name: genai.GenerativeModel.from_cached_content(cached_content=cache)}
+        return self._cached_models[cache.name]
+
+    def _generation_config(self, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "response_mime_type": "application/json",
+            "response_schema": strip_schema_keys(schema or json_schema(InferenceResult)),
+        }
+
+    def _repair_call(self, prompt: str, schema: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
+        """One schema-constrained, text-only call returning just the requested fields."""
+        def call_model():
+            timeout = deadline.timeout(MODEL_TIMEOUT) if deadline else MODEL_TIMEOUT
+            return self.model.generate_content(
+                prompt, generation_config=self._generation_config(schema),
+                request_options={"timeout": timeout}
+            )
+
+        response = retry_call(call_model, deadline, breaker=get_breaker("gemini"), what="Agent B repair call")
+        self.usage.record(response)
+        return response.text
+
+    def close(self) -> None:
+        """Releases the cached prompt prefix at the end of a run."""
+        self.prompt_cache.release()
+
+    def process_product(self, product_data: Dict[str, Any], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Processes a single product record through Agent B.
+        Image fetches and the model call are retried within `deadline` when one is given.
+        Failed calls (deadline, open circuit, exhausted retries) raise, so callers can
+        retry the product instead of storing an empty record.
         """
         logger.info(f"Processing product ID: {product_data.get('product_internal_id')}")
         
-        # Prepare content for Gemini
-        content = [SYSTEM_PROMPT, f"Input JSON:\n{json.dumps(product_data)}"]
-        
-        # Add images (limit to first 3 to avoid context bloat)
-        images = []
-        for url in product_data.get("image_urls", [])[:3]:
-            img = self._fetch_image(url)
-            if img:
-                images.append(img)
+        # Prepare content for Gemini; the system prompt is the model's (cached) prefix
+        content = [input_payload(product_data)]
         
-        content.extend(images)
+        # Add the most informative distinct images (logos, banners and near-duplicates skipped)
+        from PIL import Image
+        # The scraper already probed and ranked the stored URLs, so their order is trusted
+        for image in select_images(product_data.get("image_urls", []), deadline=deadline, probe=False,
+                                   product_id=product_data.get("product_internal_id")):
+            content.append(Image.open(io.BytesIO(image.content)))
         
-        try:
-            response = self.model.generate_content(content)
-            # Remove markdown formatting if present
-            text = response.text.replace("```json", "").replace("```", "").strip()
-            return json.loads(text)
-        except Exception as e:
-            logger.error(f"Error calling Gemini: {e}")
-            return {
-                "product_internal_id": product_data.get("product_internal_id"),
-                "inferred_brand": None,
-                "inferred_category": None,
-                "inferred_product_name": None,
-                "search_queries": [],
-                "notes": f"Error during processing: {str(e)}"
-            }
+        def generate(model):
+            timeout = deadline.timeout(MODEL_TIMEOUT) if deadline else MODEL_TIMEOUT
+            # Schema-constrained JSON, streamed so fields are validated as they arrive
+            response = model.generate_content(
+                content, stream=True, generation_config=self._generation_config(),
+                request_options={"timeout": timeout}
+            )
+            parsed = parse_stream((_chunk_text(chunk) for chunk in response), InferenceResult,
+                                  known={"product_internal_id": product_data.get("product_internal_id")})
+            self.usage.record(response)
+            return parsed
+
+        def call_model():
+            cache = self.prompt_cache.get()
+            try:
+                return generate(self._model_for(cache))
+            except Exception as e:
+                if cache is None or not is_cache_error(e):
+                    raise
+                logger.warning(f"Cached prefix unavailable ({e}); retrying inline")
+                self.prompt_cache.invalidate()
+                return generate(self.model)
+
+        parsed = retry_call(call_model, deadline, breaker=get_breaker("gemini"), what="Agent B model call")
+        return finish_inference(parsed, product_data,
+                                lambda prompt, schema: self._repair_call(prompt, schema, deadline))
 
 def main():
+    from logging_setup import setup_logging
+    setup_logging()
     parser = argparse.ArgumentParser(description="Agent B: Vision & Search Query Generator")
     parser.add_argument("--input", help="Path to input JSON file from Agent A")
     parser.add_argument("--test", action="store_true", help="Run a test with sample data")
+    parser.add_argument("--batch", action="store_true", help="Submit --input as an offline batch job instead (see batch_jobs.py)")
     args = parser.parse_args()
 
+    if args.batch and args.input:
+        from batch_jobs import prepare_infer_job, submit
+        with open(args.input, "r") as f:
+            data = json.load(f)
+        job = submit(prepare_infer_job(data if isinstance(data, list) else [data]))
+        print(f"Batch job {job.job_id}: {job.state}")
+        return
+
     # Sample data for testing
     sample_data = {
       "source": "qiqiyg",
@@ -1,30 +1,29 @@
 import os
 import json
 import logging
-from typing import List, Dict, Any, Optional
-from google import genai
-from google.genai import types
-import httpx
+from typing import Callable, List, Dict, Any, Optional
 from bs4 import BeautifulSoup
+from fetcher import fetch
+from models import OfficialMatchResult
+from prompt_cache import CachedPrefix, TokenUsage, is_cache_error
+from resilience import Deadline, get_breaker, retry_call
+from structured_output import StructuredResult, check_grounded, parse_stream, repair
+
+MODEL_NAME = "gemini-2.5-flash"
+# Upper bound for a single grounded model call; the product deadline may cut it shorter
+MODEL_TIMEOUT = 60.0
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-MATCH_PROMPT = """You are Agent C: Official Match Finder in a product-matching pipeline.
+# Static instructions, identical for every product: sent once as a cached prefix
+MATCH_INSTRUCTIONS = """You are Agent C: Official Match Finder in a product-matching pipeline.
 
-Given the wholesale product data and inference data below, your job is to:
+Given the wholesale product data and inference data in the request, your job is to:
 1. Search the web for the official/authentic product page that matches this wholesale item.
 2. Use the search queries provided in the inference data as a starting point.
 3. Find the OFFICIAL product page (brand.com, major department stores like Nordstrom, Saks, Bloomingdale's, Farfetch, Net-a-Porter). Avoid replica or wholesale sites.
 4. Extract the official product details from the page you find.
 
-Wholesale Data:
-{wholesale_data}
-
-Inference Data:
-{inference_data}
-
 IMPORTANT MATCHING RULES:
 - Compare brand, shape, color, logo pattern, hardware details.
 - The official product MUST be from the same brand as inferred.
@@ -44,8 +43,8 @@ CRITICAL - IMAGE URL EXTRACTION:
 - Do NOT set official_main_image_url to null if you found a match. Search more if needed.
 
 Return ONLY a JSON object with exactly these fields:
-{{
-  "product_internal_id": "{product_id}",
+{
+  "product_internal_id": "string - copy from the wholesale data",
   "match_found": true/false,
   "match_confidence": 0.0 to 1.0,
   "official_page_url": "string or null",
@@ -56,7 +55,7 @@ Return ONLY a JSON object with exactly these fields:
   "official_currency": "string or null",
   "official_main_image_url": "string or null - MUST be a direct image URL",
   "notes": "string explaining your matching reasoning"
-}}
+}
 
 Confidence interpretation:
 - 0.80-1.00: strong match (highly likely same product)
@@ -64,157 +63,260 @@ Confidence interpretation:
 - Below 0.60: no match found
 """
 
+# Per-product payload sent with each call
+MATCH_PAYLOAD = """Wholesale Data:
+{wholesale_data}
+
+Inference Data:
+{inference_data}
+
+Return the JSON object for product_internal_id "{product_id}".
+"""
+
+
+def match_prompt(raw_data: Dict[str, Any], inference_data: Dict[str, Any]) -> str:
+    """The per-product payload sent after the static instructions."""
+    return MATCH_PAYLOAD.format(
+        wholesale_data=json.dumps(raw_data, indent=2),
+        inference_data=json.dumps(inference_data, indent=2),
+        product_id=raw_data.get("product_internal_id", "unknown")
+    )
+
+
+def batch_request(raw_data: Dict[str, Any], inference_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The same grounded call as find_match(), as a batch-API request body."""
+    return {
+        "contents": [{"role": "user", "parts": [{"text": match_prompt(raw_data, inference_data)}]}],
+        "system_instruction": {"parts": [{"text": MATCH_INSTRUCTIONS}]},
+        "tools": [{"google_search": {}}],
+        "generation_config": {"temperature": 0.1},
+    }
+
+
+def finish_match(parsed: StructuredResult, product_id: str, prompt: str,
+                 repair_call: Optional[Callable[[str, Dict[str, Any]], str]] = None,
+                 deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Turns a parsed response into the match record: repairs broken fields when
+    `repair_call` is given, then checks the image URL, falling back to og:image.
+    A missing or invalid verdict raises ValueError so the product is retried.
+    """
+    check_grounded(parsed)
+    # Fix only the missing/invalid fields with one schema-constrained call
+    if parsed.repairable and repair_call is not None:
+        parsed = repair(parsed, prompt, repair_call)
+    if parsed.broken:
+        logger.warning(f"Agent C fields left at defaults for {product_id}: {', '.join(parsed.broken)}")
+    result = parsed.record()
+
+    # Ensure product_internal_id is set
+    result["product_internal_id"] = product_id
+    
+    # Post-process: Validate image URL and fall back to og:image scraping if needed
+    if result.get("match_found") and result.get("official_page_url"):
+        image_url = result.get("official_main_image_url")
+        
+        # Validate image URL if provided (model may hallucinate CDN URLs)
+        if image_url:
+            if not validate_image_url(image_url, deadline):
+                logger.warning(f"Model-provided image URL is invalid (404/unreachable): {image_url}")
+                image_url = None
+        
+        # Fall back to og:image scraping
+        if not image_url:
+            image_url = scrape_og_image(result["official_page_url"], deadline)
+        
+        result["official_main_image_url"] = image_url
+    
+    logger.info(f"Match found: {result.get('match_found')}, "
+               f"Confidence: {result.get('match_confidence')}, "
+               f"Brand: {result.get('official_brand')}, "
+               f"Image: {'YES' if result.get('official_main_image_url') else 'NO'}")
+    
+    return result
+
 
 class AgentC:
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("Google API Key not found.")
+        # Imported on first use so CLI startup doesn't pay for the SDK
+        from google import genai
         self.client = genai.Client(api_key=self.api_key)
+        self.usage = TokenUsage()
+        self.prompt_cache = CachedPrefix(
+            "agent-c-instructions",
+            create_fn=self._create_cache,
+            refresh_fn=self._refresh_cache,
+            delete_fn=lambda name: self.client.caches.delete(name=name),
+            count_fn=lambda: self.client.models.count_tokens(model=MODEL_NAME, contents=MATCH_INSTRUCTIONS).total_tokens,
+        )
+
+    def _tools(self):
+        from google.genai import types
+        return [types.Tool(google_search=types.GoogleSearch())]
 
-    def find_match(self, raw_data: Dict[str, Any], inference_data: Dict[str, Any], search_results: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _create_cache(self, ttl: int) -> str:
+        from google.genai import types
+        # Tools must live in the cache too: a request using cached_content can't add them
+        cache = self.client.caches.create(
+            model=MODEL_NAME,
+            config=types.CreateCachedContentConfig(
+                display_name="automatch-agent-c",
+                system_instruction=MATCH_INSTRUCTIONS,
+                tools=self._tools(),
+                ttl=f"{ttl}s",
+            )
+        )
+        return cache.name
+
+    def _refresh_cache(self, name: str, ttl: int) -> None:
+        from google.genai import types
+        self.client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl}s"))
+
+    def close(self) -> None:
+        """Releases the cached prompt prefix at the end of a run."""
+        self.prompt_cache.release()
+
+    def find_match(self, raw_data: Dict[str, Any], inference_data: Dict[str, Any], search_results: List[Dict[str, Any]] = None,
+                   deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Uses Gemini with Google Search grounding to find official product matches.
+        Model calls and image checks are retried within `deadline` when one is given.
+        Failed calls (deadline, open circuit, exhausted retries) raise, so callers can
+        retry the product instead of storing a no-match.
         """
+        from google.genai import types
         product_id = raw_data.get("product_internal_id", "unknown")
         
-        prompt = MATCH_PROMPT.format(
-            wholesale_data=json.dumps(raw_data, indent=2),
-            inference_data=json.dumps(inference_data, indent=2),
-            product_id=product_id
-        )
+        prompt = match_prompt(raw_data, inference_data)
+
+        # Use google_search tool for grounded web search. The API can't combine tools
+        # with a response schema, so the stream is parsed and validated field by field
+        def generate(cache_name: Optional[str]) -> StructuredResult:
+            timeout = deadline.timeout(MODEL_TIMEOUT) if deadline else MODEL_TIMEOUT
+            http_options = types.HttpOptions(timeout=int(timeout * 1000))
+            if cache_name:
+                config = types.GenerateContentConfig(
+                    cached_content=cache_name, temperature=0.1, http_options=http_options
+                )
+            else:
+                # Inline fallback with the same static prefix
+                config = types.GenerateContentConfig(
+                    system_instruction=MATCH_INSTRUCTIONS, tools=self._tools(),
+                    temperature=0.1, http_options=http_options
+                )
+            last_chunk = None
+
+            def texts():
+                nonlocal last_chunk
+                for chunk in self.client.models.generate_content_stream(
+                        model=MODEL_NAME, contents=prompt, config=config):
+                    last_chunk = chunk
+                    yield chunk.text or ""
+
+            parsed = parse_stream(texts(), OfficialMatchResult, known={"product_internal_id": product_id})
+            self.usage.record(last_chunk)
+            if not parsed.text:
+                raise ValueError("Empty response from Gemini")
+            return parsed
+
+        def call_model() -> StructuredResult:
+            cache_name = self.prompt_cache.get()
+            try:
+                return generate(cache_name)
+            except Exception as e:
+                if not cache_name or not is_cache_error(e):
+                    raise
+                logger.warning(f"Cached prefix unavailable ({e}); retrying inline")
+                self.prompt_cache.invalidate()
+                return generate(None)
 
-        try:
-            # Use google_search tool for grounded web search
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
+        parsed = retry_call(call_model, deadline, breaker=get_breaker("gemini"), what="Agent C model call")
+        logger.info(f"Agent C raw response length: {len(parsed.text)} chars")
+
+        return finish_match(parsed, product_id, prompt,
+                            lambda repair_prompt, schema: self._repair_call(repair_prompt, schema, deadline),
+                            deadline)
+
+    def _repair_call(self, prompt: str, schema: Dict[str, Any], deadline: Optional[Deadline] = None) -> str:
+        """One schema-constrained call (no tools) returning just the requested fields."""
+        from google.genai import types
+
+        def call_model():
+            timeout = deadline.timeout(MODEL_TIMEOUT) if deadline else MODEL_TIMEOUT
+            return self.client.models.generate_content(
+                model=MODEL_NAME,
                 contents=prompt,
                 config=types.GenerateContentConfig(
-                    tools=[types.Tool(google_search=types.GoogleSearch())],
-                    temperature=0.1,
+                    response_mime_type="application/json",
+                    response_schema=schema,
+                    temperature=0.0,
+                    http_options=types.HttpOptions(timeout=int(timeout * 1000)),
                 )
             )
-            
-            text = response.text
-            
-            # Fallback: extract from candidate parts if text is None
-            if not text and response.candidates:
-                parts = response.candidates[0].content.parts
-                text = "".join(p.text for p in parts if hasattr(p, 'text') and p.text) if parts else ""
-            
-            if not text:
-                raise ValueError("Empty response from Gemini")
-            
-            logger.info(f"Agent C raw response length: {len(text)} chars")
-            
-            # Extract JSON from response (handle markdown fences and extra text)
-            text = text.replace("```json", "").replace("```", "").strip()
-            
-            # Find JSON object in the response
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', text)
-            if json_match:
-                text = json_match.group(0)
-            
-            result = json.loads(text)
-            
-            # Ensure product_internal_id is set
-            result["product_internal_id"] = product_id
-            
-            # Post-process: Validate image URL and fall back to og:image scraping if needed
-            if result.get("match_found") and result.get("official_page_url"):
-                image_url = result.get("official_main_image_url")
-                
-                # Validate image URL if provided (model may hallucinate CDN URLs)
-                if image_url:
-                    if not self._validate_image_url(image_url):
-                        logger.warning(f"Model-provided image URL is invalid (404/unreachable): {image_url}")
-                        image_url = None
-                
-                # Fall back to og:image scraping
-                if not image_url:
-                    image_url = self._scrape_og_image(result["official_page_url"])
-                
-                result["official_main_image_url"] = image_url
-            
-            logger.info(f"Match found: {result.get('match_found')}, "
-                       f"Confidence: {result.get('match_confidence')}, "
-                       f"Brand: {result.get('official_brand')}, "
-                       f"Image: {'YES' if result.get('official_main_image_url') else 'NO'}")
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error calling Gemini in Agent C: {e}")
-            return {
-                "product_internal_id": product_id,
-                "match_found": False,
-                "match_confidence": 0.0,
-                "official_page_url": None,
-                "official_brand": None,
-                "official_product_name": None,
-                "official_sku": None,
-                "official_price": None,
-                "official_currency": None,
-                "official_main_image_url": None,
-                "notes": f"Error during matching: {str(e)}"
-            }
-
-    def _validate_image_url(self, url: str) -> bool:
-        """HEAD-checks an image URL to verify it actually exists."""
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            with httpx.Client(timeout=5.0, follow_redirects=True) as client:
-                resp = client.head(url, headers=headers)
-                is_valid = resp.status_code == 200
-                logger.info(f"Image URL validation: {url} -> {resp.status_code} ({'VALID' if is_valid else 'INVALID'})")
-                return is_valid
-        except Exception as e:
-            logger.warning(f"Image URL validation failed for {url}: {e}")
-            return False
-
-    def _scrape_og_image(self, url: str) -> Optional[str]:
-        """Fetches a page and extracts og:image or similar meta tag."""
-        try:
-            logger.info(f"Scraping og:image from: {url}")
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            with httpx.Client(timeout=10.0, follow_redirects=True) as client:
-                resp = client.get(url, headers=headers)
-                resp.raise_for_status()
-            
-            soup = BeautifulSoup(resp.text, "html.parser")
-            
-            # Try og:image first (most common for e-commerce)
-            og_img = soup.find("meta", property="og:image")
-            if og_img and og_img.get("content"):
-                logger.info(f"Found og:image: {og_img['content']}")
-                return og_img["content"]
-            
-            # Try twitter:image
-            tw_img = soup.find("meta", attrs={"name": "twitter:image"})
-            if tw_img and tw_img.get("content"):
-                logger.info(f"Found twitter:image: {tw_img['content']}")
-                return tw_img["content"]
-            
-            # Try first large product image
-            for img in soup.find_all("img"):
-                src = img.get("src", "")
-                if any(kw in src.lower() for kw in ["/product", "/media", "cdn"]) and src.startswith("http"):
-                    logger.info(f"Found product image: {src}")
-                    return src
-            
-            logger.warning(f"No og:image found at {url}")
-            return None
-        except Exception as e:
-            logger.warning(f"Failed to scrape og:image from {url}: {e}")
-            return None
+
+        response = retry_call(call_model, deadline, breaker=get_breaker("gemini"), what="Agent C repair call")
+        self.usage.record(response)
+        return response.text or ""
+
+
+def validate_image_url(url: str, deadline: Optional[Deadline] = None) -> bool:
+    """HEAD-checks an image URL to verify it actually exists."""
+    try:
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        }
+        resp = fetch(url, method="HEAD", headers=headers, timeout=5.0, follow_redirects=True, deadline=deadline)
+        is_valid = resp.status_code == 200
+        logger.info(f"Image URL validation: {url} -> {resp.status_code} ({'VALID' if is_valid else 'INVALID'})")
+        return is_valid
+    except Exception as e:
+        logger.warning(f"Image URL validation failed for {url}: {e}")
+        return False
+
+def scrape_og_image(url: str, deadline: Optional[Deadline] = None) -> Optional[str]:
+    """Fetches a page and extracts og:image or similar meta tag."""
+    try:
+        logger.info(f"Scraping og:image from: {url}")
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        }
+        resp = fetch(url, headers=headers, timeout=10.0, follow_redirects=True, deadline=deadline)
+        resp.raise_for_status()
+
+        soup = BeautifulSoup(resp.text, "html.parser")
+
+        # Try og:image first (most common for e-commerce)
+        og_img = soup.find("meta", property="og:image")
+        if og_img and og_img.get("content"):
+            logger.info(f"Found og:image: {og_img['content']}")
+            return og_img["content"]
+
+        # Try twitter:image
+        tw_img = soup.find("meta", attrs={"name": "twitter:image"})
+        if tw_img and tw_img.get("content"):
+            logger.info(f"Found twitter:image: {tw_img['content']}")
+            return tw_img["content"]
+
+        # Try first large product image
+        for img in soup.find_all("img"):
+            src = img.get("src", "")
+            if any(kw in src.lower() for kw in ["/product", "/media", "cdn"]) and src.startswith("http"):
+                logger.info(f"Found product image: {src}")
+                return src
+
+        logger.warning(f"No og:image found at {url}")
+        return None
+    except Exception as e:
+        logger.warning(f"Failed to scrape og:image from {url}: {e}")
+        return None
 
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     # Quick test
     print("Agent C module loaded. Using Gemini with Google Search grounding.")
     agent = AgentC()
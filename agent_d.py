@@ -1,14 +1,41 @@
 import csv
+import hashlib
+import json
 import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import TYPE_CHECKING, Optional, Dict, Any, Iterable, Iterator, List
+
+# Advisory file locks: fcntl on POSIX, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+if TYPE_CHECKING:
+    from media_store import MediaStore
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 CSV_PATH = Path("inventory_export.csv")
 
+# Delta exports: per-run change files plus the state needed to compute them
+EXPORTS_DIR = Path("exports")
+EXPORT_STATE_FILE = "export_state.json"
+MANIFEST_FILE = "manifest.csv"
+SNAPSHOT_FILE = "snapshot.csv"
+MANIFEST_HEADERS = ["run_id", "created_at", "delta_file", "added", "changed", "removed", "unchanged"]
+
+# Export rules (shared with the vectorized re-export in bulk_export.py)
+REVIEW_CONFIDENCE_THRESHOLD = 0.8
+GALLERY_SIZE = 9
+PRICE_STRIP_CHARS = ["$", "€", "£", ","]
+# Image verification outcomes (image_verify.py) that settle a match without human review
+AUTO_DECIDED_VERIFICATIONS = ("accepted", "rejected")
+
 HEADERS = [
     "category_id",
     "product_internal_id",
@@ -34,28 +61,69 @@ HEADERS = [
     "needs_review"  # Added review signal
 ]
 
-def ensure_csv_headers() -> None:
-    if not CSV_PATH.exists() or CSV_PATH.stat().st_size == 0:
-        with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    Holds an exclusive lock on `path` (created if missing), so workers sharing a
+    directory take turns at read-modify-write sections of shared export files.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _lock_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.lock")
+
+def ensure_csv_headers(csv_path: Path = CSV_PATH) -> None:
+    # Locked so two workers can't both see an empty file and the second truncate the first's rows
+    with file_lock(_lock_path(csv_path)):
+        if csv_path.exists() and csv_path.stat().st_size > 0:
+            return
+        with csv_path.open("w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(HEADERS)
 
 def normalize_price_text(price_text: Optional[str]) -> str:
     if not price_text:
         return ""
-    # Strip common currency symbols and whitespace
-    cleaned = str(price_text).replace("$", "").replace("€", "").replace("£", "")
-    cleaned = cleaned.replace(",", "").strip()
-    return cleaned
+    # Strip common currency symbols, thousands separators and whitespace
+    cleaned = str(price_text)
+    for char in PRICE_STRIP_CHARS:
+        cleaned = cleaned.replace(char, "")
+    return cleaned.strip()
 
-def append_product_row(
+def needs_review_flag(match: Dict[str, Any]) -> str:
+    if match.get("verification") in AUTO_DECIDED_VERIFICATIONS:
+        return "NO"
+    match_found = match.get("match_found", False)
+    match_confidence = match.get("match_confidence") or 0.0
+    return "YES" if (not match_found or match_confidence < REVIEW_CONFIDENCE_THRESHOLD) else "NO"
+
+def build_product_row(
     raw: Dict[str, Any],
     match: Dict[str, Any],
     inference: Optional[Dict[str, Any]] = None,
     supplier_name: str = "QiQiYG",
-) -> str:
-    ensure_csv_headers()
-
+    media_store: Optional["MediaStore"] = None,
+) -> List[Any]:
+    """Derives the export row (in HEADERS order) for one product."""
     images: List[str] = raw.get("image_urls") or []
     
     # Pick a better main image by skipping logos if possible
@@ -65,9 +133,19 @@ def append_product_row(
     
     # Filter gallery to exclude the selected main image
     gallery_pool = [img for img in images if img != main_image]
-    gallery = gallery_pool[:9]
-    if len(gallery) < 9:
-        gallery += [""] * (9 - len(gallery))
+    gallery = gallery_pool[:GALLERY_SIZE]
+
+    # Mirror images locally and export stable local URLs instead of remote ones
+    if media_store is not None:
+        main_image = (media_store.mirror(main_image) or main_image) if main_image else ""
+        gallery = [media_store.mirror(img) or img for img in gallery]
+        if match.get("official_main_image_url"):
+            # Also cache the official image under its page URL for the dashboard's og:image route
+            aliases = [match["official_page_url"]] if match.get("official_page_url") else []
+            media_store.mirror(match["official_main_image_url"], aliases=aliases)
+
+    if len(gallery) < GALLERY_SIZE:
+        gallery += [""] * (GALLERY_SIZE - len(gallery))
 
     inferred_brand = None
     if inference is not None:
@@ -94,9 +172,7 @@ def append_product_row(
     product_price = product_cost_price
 
     # Review Signal
-    match_found = match.get("match_found", False)
-    match_confidence = match.get("match_confidence", 0.0)
-    needs_review = "YES" if (not match_found or match_confidence < 0.8) else "NO"
+    needs_review = needs_review_flag(match)
 
     row = [
         raw.get("category_id", ""),
@@ -114,12 +190,166 @@ def append_product_row(
         *gallery,
         needs_review
     ]
+    return row
+
+def append_product_row(
+    raw: Dict[str, Any],
+    match: Dict[str, Any],
+    inference: Optional[Dict[str, Any]] = None,
+    supplier_name: str = "QiQiYG",
+    media_store: Optional["MediaStore"] = None,
+    delta: Optional["DeltaExport"] = None,
+    csv_path: Path = CSV_PATH,
+) -> str:
+    row = build_product_row(raw, match, inference, supplier_name, media_store)
+    return write_product_row(row, delta, csv_path)
+
+def write_product_row(row: List[Any], delta: Optional["DeltaExport"] = None, csv_path: Path = CSV_PATH) -> str:
+    """Appends a built row to the export (and the run's delta); returns its review flag."""
+    ensure_csv_headers(csv_path)
+    needs_review = row[-1]
+    if delta is not None:
+        delta.record(row)
 
-    with CSV_PATH.open("a", newline="", encoding="utf-8") as f:
+    with csv_path.open("a", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(row)
-    logger.info(f"Appended row for {raw.get('product_internal_id')} (Review: {needs_review})")
+    logger.info(f"Appended row for {row[HEADERS.index('product_internal_id')]} (Review: {needs_review})")
     return needs_review
 
+def row_hash(row: List[Any]) -> str:
+    return hashlib.sha1(json.dumps(["" if v is None else str(v) for v in row]).encode("utf-8")).hexdigest()
+
+class DeltaExport:
+    """
+    Tracks a content hash per exported product and writes, per run, only the rows
+    that were added, changed or removed since the previous run:
+
+        exports/delta_<run_id>.csv   change_type + HEADERS
+        exports/manifest.csv         one line per delta, keyed by runs_log.csv run_id
+        exports/export_state.json    product_internal_id -> row hash
+    """
+
+    def __init__(self, run_id: str, exports_dir: Path = EXPORTS_DIR):
+        self.run_id = run_id
+        self.exports_dir = Path(exports_dir)
+        self.state_path = self.exports_dir / EXPORT_STATE_FILE
+        self.state: Dict[str, str] = {}
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        self.rows: Dict[str, List[str]] = {}
+        self.recorded: Dict[str, str] = {}
+        self.counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+
+    def record(self, row: List[Any]) -> str:
+        """Registers an exported row; returns its change type."""
+        product_id = str(row[HEADERS.index("product_internal_id")])
+        digest = row_hash(row)
+        previous = self.state.get(product_id)
+        if previous == digest:
+            change = "unchanged"
+        else:
+            change = "added" if previous is None else "changed"
+            self.rows[product_id] = [change, *row]
+        self.state[product_id] = digest
+        self.recorded[product_id] = digest
+        self.counts[change] += 1
+        return change
+
+    def finish(self, catalog_ids: Optional[Iterable[str]] = None) -> Optional[Path]:
+        """
+        Writes the delta file and manifest entry and saves the hash state. Products
+        in the previous state but missing from `catalog_ids` are emitted as removed;
+        without `catalog_ids` nothing is treated as removed.
+        """
+        # Concurrent workers share the state file and manifest: under the lock, merge this
+        # run's rows into the latest saved state instead of the copy loaded at start
+        with file_lock(_lock_path(self.state_path)):
+            return self._finish(catalog_ids)
+
+    def _finish(self, catalog_ids: Optional[Iterable[str]]) -> Path:
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            self.state.update(self.recorded)
+        if catalog_ids is not None:
+            catalog = {str(i) for i in catalog_ids}
+            for product_id in [p for p in self.state if p not in catalog]:
+                removed = [""] * len(HEADERS)
+                removed[HEADERS.index("product_internal_id")] = product_id
+                self.rows[product_id] = ["removed", *removed]
+                del self.state[product_id]
+                self.counts["removed"] += 1
+
+        self.exports_dir.mkdir(parents=True, exist_ok=True)
+        delta_path = self.exports_dir / f"delta_{self.run_id}.csv"
+        with delta_path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["change_type", *HEADERS])
+            writer.writerows(self.rows.values())
+
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+        manifest_path = self.exports_dir / MANIFEST_FILE
+        new_manifest = not manifest_path.exists() or manifest_path.stat().st_size == 0
+        with manifest_path.open("a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new_manifest:
+                writer.writerow(MANIFEST_HEADERS)
+            writer.writerow([
+                self.run_id,
+                datetime.now(timezone.utc).isoformat(),
+                delta_path.name,
+                self.counts["added"],
+                self.counts["changed"],
+                self.counts["removed"],
+                self.counts["unchanged"],
+            ])
+        logger.info(f"Delta {delta_path.name}: {self.counts}")
+        return delta_path
+
+def compact_deltas(exports_dir: Path = EXPORTS_DIR, output: Optional[Path] = None) -> int:
+    """Replays every delta in manifest order into a full snapshot CSV. Returns its row count."""
+    exports_dir = Path(exports_dir)
+    output = Path(output) if output else exports_dir / SNAPSHOT_FILE
+    rows: Dict[str, List[str]] = {}
+    with (exports_dir / MANIFEST_FILE).open("r", newline="", encoding="utf-8") as f:
+        entries = list(csv.DictReader(f))
+
+    id_col = HEADERS.index("product_internal_id")
+    for entry in entries:
+        with (exports_dir / entry["delta_file"]).open("r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for change_type, *row in reader:
+                if change_type == "removed":
+                    rows.pop(row[id_col], None)
+                else:
+                    rows[row[id_col]] = row
+
+    tmp = output.with_suffix(".tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(rows.values())
+    tmp.replace(output)
+    logger.info(f"Compacted {len(entries)} deltas into {output} ({len(rows)} rows)")
+    return len(rows)
+
 if __name__ == "__main__":
-    print("Agent D module loaded.")
+    import argparse
+    from logging_setup import setup_logging
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Agent D: Export Engineer")
+    sub = parser.add_subparsers(dest="command")
+    compact = sub.add_parser("compact", help="Rebuild a full snapshot from the delta exports")
+    compact.add_argument("--exports-dir", default=str(EXPORTS_DIR))
+    compact.add_argument("--output", help=f"Snapshot path (default: <exports-dir>/{SNAPSHOT_FILE})")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact_deltas(Path(args.exports_dir), Path(args.output) if args.output else None)
+    else:
+        print("Agent D module loaded.")
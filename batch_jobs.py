@@ -0,0 +1,551 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import codec
+from models import InferenceResult, OfficialMatchResult, json_schema
+from prompt_cache import TokenUsage, merge_usage
+from structured_output import parse_stream
+
+logger = logging.getLogger(__name__)
+
+# One directory per job: job.json, requests.jsonl, sources.jsonl, results.jsonl, collected.txt
+# (and output/ for fake jobs)
+BATCH_DIR = Path("batch_jobs")
+MODEL_NAME = "gemini-2.5-flash"
+POLL_INTERVAL = float(os.environ.get("AUTOMATCH_BATCH_POLL_INTERVAL", "60"))
+# Concurrent image fetches while writing Agent B requests
+REQUEST_WORKERS = 8
+
+STAGES = ["infer", "match"]
+BACKENDS = ["gemini", "fake"]
+
+# prepared -> submitted -> running -> succeeded -> collected, or failed/cancelled/expired
+TERMINAL_STATES = ("succeeded", "failed", "cancelled", "expired", "collected")
+GEMINI_STATES = {
+    "JOB_STATE_PENDING": "submitted",
+    "JOB_STATE_QUEUED": "submitted",
+    "JOB_STATE_RUNNING": "running",
+    "JOB_STATE_SUCCEEDED": "succeeded",
+    "JOB_STATE_PARTIALLY_SUCCEEDED": "succeeded",
+    "JOB_STATE_FAILED": "failed",
+    "JOB_STATE_CANCELLED": "cancelled",
+    "JOB_STATE_EXPIRED": "expired",
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class BatchJob:
+    """Local record of one provider batch job, saved to batch_jobs/<job_id>/job.json after every change."""
+    job_id: str
+    stage: str
+    backend: str
+    model: str = MODEL_NAME
+    state: str = "prepared"
+    provider_name: Optional[str] = None
+    request_count: int = 0
+    run_id: Optional[str] = None
+    discover_limit: Optional[int] = None
+    created_at: str = ""
+    updated_at: str = ""
+    error: Optional[str] = None
+
+    @property
+    def dir(self) -> Path:
+        return BATCH_DIR / self.job_id
+
+    @property
+    def requests_path(self) -> Path:
+        return self.dir / "requests.jsonl"
+
+    @property
+    def sources_path(self) -> Path:
+        return self.dir / "sources.jsonl"
+
+    @property
+    def results_path(self) -> Path:
+        return self.dir / "results.jsonl"
+
+    @property
+    def collected_path(self) -> Path:
+        return self.dir / "collected.txt"
+
+    @property
+    def collected_rows_path(self) -> Path:
+        return self.dir / "collected_rows.jsonl"
+
+    @property
+    def output_dir(self) -> Path:
+        """
+        Where collect writes checkpoints, matches, the export, deltas and run stats:
+        the working directory, except for fake jobs, whose placeholder answers must
+        never overwrite real results.
+        """
+        return self.dir / "output" if self.backend == "fake" else Path(".")
+
+    def save(self) -> None:
+        self.updated_at = _now()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / "job.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, job_id: str) -> "BatchJob":
+        return cls(**json.loads((BATCH_DIR / job_id / "job.json").read_text(encoding="utf-8")))
+
+
+def list_jobs() -> List[BatchJob]:
+    return [BatchJob.load(Path(p).parent.name) for p in sorted(glob.glob(str(BATCH_DIR / "*" / "job.json")))]
+
+
+class GeminiBatchBackend:
+    """Gemini Batch API: the request file is uploaded, and results come back as a JSON-lines file."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        api_key = api_key or os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("Google API Key not found.")
+        # Imported on first use so CLI startup doesn't pay for the SDK
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    def submit(self, model: str, requests_path: Path, display_name: str) -> str:
+        from google.genai import types
+        uploaded = self.client.files.upload(
+            file=str(requests_path),
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"),
+        )
+        job = self.client.batches.create(model=model, src=uploaded.name, config={"display_name": display_name})
+        return job.name
+
+    def status(self, name: str) -> str:
+        job = self.client.batches.get(name=name)
+        state = getattr(job.state, "name", str(job.state))
+        return GEMINI_STATES.get(state, "running")
+
+    def download_results(self, name: str, path: Path) -> None:
+        job = self.client.batches.get(name=name)
+        path.write_bytes(self.client.files.download(file=job.dest.file_name))
+
+
+def _example_value(schema: Dict[str, Any]) -> Any:
+    if schema.get("nullable"):
+        return None
+    kind = schema.get("type")
+    if kind == "OBJECT":
+        return {name: _example_value(prop) for name, prop in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [_example_value(schema.get("items", {}))] * max(1, schema.get("min_items", 0))
+    if kind == "BOOLEAN":
+        return False
+    if kind in ("NUMBER", "INTEGER"):
+        return schema.get("minimum", 0)
+    return ""
+
+
+def example_response(request: Dict[str, Any]) -> Dict[str, Any]:
+    """A schema-valid placeholder answer. Grounded Agent C requests carry no schema, so they get a no-match."""
+    schema = request.get("generation_config", {}).get("response_schema") or json_schema(OfficialMatchResult)
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": json.dumps(_example_value(schema))}]}}],
+        "usageMetadata": {"promptTokenCount": 0},
+    }
+
+
+class FakeBatchBackend:
+    """
+    Local stand-in for the batch API, for dry runs without an API key. Jobs complete
+    after `polls_to_complete` status checks; each request is answered by `respond`
+    (default: a schema-valid placeholder) in the provider's result-file format.
+    """
+
+    def __init__(self, root: Path = BATCH_DIR / "_fake", polls_to_complete: int = 1,
+                 respond: Callable[[Dict[str, Any]], Dict[str, Any]] = example_response):
+        self.root = Path(root)
+        self.polls_to_complete = polls_to_complete
+        self.respond = respond
+
+    def _state_path(self, name: str) -> Path:
+        return self.root / f"{name.split('/')[-1]}.json"
+
+    def submit(self, model: str, requests_path: Path, display_name: str) -> str:
+        name = f"fake-batches/{uuid.uuid4().hex[:12]}"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._state_path(name).write_text(json.dumps({"requests": str(requests_path), "polls": 0}), encoding="utf-8")
+        return name
+
+    def status(self, name: str) -> str:
+        path = self._state_path(name)
+        state = json.loads(path.read_text(encoding="utf-8"))
+        state["polls"] += 1
+        path.write_text(json.dumps(state), encoding="utf-8")
+        return "succeeded" if state["polls"] >= self.polls_to_complete else "running"
+
+    def download_results(self, name: str, path: Path) -> None:
+        state = json.loads(self._state_path(name).read_text(encoding="utf-8"))
+        codec.write_jsonl(path, (
+            {"key": line["key"], "response": self.respond(line["request"])}
+            for line in codec.iter_jsonl(state["requests"])
+        ))
+
+
+def open_backend(name: str):
+    if name == "fake":
+        return FakeBatchBackend()
+    return GeminiBatchBackend()
+
+
+def response_text(response: Dict[str, Any]) -> str:
+    """Text of the first candidate in a JSON GenerateContentResponse, skipping thought parts."""
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts if not p.get("thought"))
+
+
+def _new_job(stage: str, backend: str, **fields) -> BatchJob:
+    started_at = datetime.now(timezone.utc)
+    job_id = started_at.strftime(f"{stage}-%Y%m%dT%H%M%S-{uuid.uuid4().hex[:6]}")
+    return BatchJob(job_id=job_id, stage=stage, backend=backend, created_at=started_at.isoformat(), **fields)
+
+
+def _write_job_files(job: BatchJob, entries: Iterable[Dict[str, Any]]) -> BatchJob:
+    """Writes requests.jsonl (what the provider sees) and sources.jsonl (what collect needs)."""
+    job.dir.mkdir(parents=True, exist_ok=True)
+    with codec.JsonlWriter(job.requests_path) as requests, codec.JsonlWriter(job.sources_path) as sources:
+        for entry in entries:
+            requests.write({"key": entry["key"], "request": entry.pop("request")})
+            sources.write(entry)
+    job.request_count = requests.count
+    job.save()
+    logger.info(f"Prepared batch job {job.job_id} with {job.request_count} requests in {job.dir}")
+    return job
+
+
+def prepare_infer_job(records: Iterable[Dict[str, Any]], backend: str = "gemini",
+                      skip_existing: bool = True) -> BatchJob:
+    """An Agent B job for scraped records; collect writes checkpoint_<id>.json like pipeline.py."""
+    from agent_b import batch_request
+
+    raws = []
+    for raw in records:
+        raw = dict(raw)
+        raw["product_internal_id"] = raw.get("product_internal_id") or raw.get("internal_id")
+        if not raw["product_internal_id"]:
+            continue
+        if skip_existing and Path(f"checkpoint_{raw['product_internal_id']}.json").exists():
+            continue
+        raws.append(raw)
+
+    def entry(raw: Dict[str, Any]) -> Dict[str, Any]:
+        return {"key": str(raw["product_internal_id"]), "raw": raw, "request": batch_request(raw)}
+
+    with ThreadPoolExecutor(max_workers=REQUEST_WORKERS) as pool:
+        return _write_job_files(_new_job("infer", backend), pool.map(entry, raws))
+
+
+def prepare_match_job(backend: str = "gemini", max_requests: Optional[int] = None,
+                      priority_config=None, discover_limit: Optional[int] = None) -> Optional[BatchJob]:
+    """An Agent C job for the checkpoints, highest priority first when capped by `max_requests`."""
+    from agent_c import batch_request
+    from priority import PriorityConfig, candidate_from_checkpoint, rank
+    from process_batch import make_run_id
+
+    checkpoints = {}
+    for cp_file in glob.glob("checkpoint_*.json"):
+        try:
+            checkpoints[cp_file] = codec.load_file(cp_file)
+        except Exception as e:
+            logger.error(f"Error reading {cp_file}: {e}")
+    if not checkpoints:
+        logger.info("No checkpoints found.")
+        return None
+    ranked = rank((candidate_from_checkpoint(cp, data["raw"]) for cp, data in checkpoints.items()),
+                  priority_config or PriorityConfig.load())
+    if max_requests is not None:
+        ranked = ranked[:max_requests]
+
+    def entries():
+        for candidate in ranked:
+            data = checkpoints[candidate.key]
+            raw, inference = data["raw"], data["inference"]
+            yield {"key": str(raw["product_internal_id"]), "raw": raw, "inference": inference,
+                   "request": batch_request(raw, inference)}
+
+    job = _new_job("match", backend, discover_limit=discover_limit,
+                   run_id=make_run_id(datetime.now(timezone.utc), discover_limit) + "-batch")
+    return _write_job_files(job, entries())
+
+
+def submit(job: BatchJob, backend=None) -> BatchJob:
+    """Submits a prepared job; a failed submit leaves it prepared for poll() to retry."""
+    backend = backend or open_backend(job.backend)
+    try:
+        job.provider_name = backend.submit(job.model, job.requests_path, f"automatch-{job.job_id}")
+    except Exception as e:
+        job.error = str(e)
+        job.save()
+        logger.error(f"Could not submit batch job {job.job_id}: {e}")
+        return job
+    job.state, job.error = "submitted", None
+    job.save()
+    logger.info(f"Submitted batch job {job.job_id} as {job.provider_name}")
+    return job
+
+
+def poll(job: BatchJob, backend=None) -> BatchJob:
+    backend = backend or open_backend(job.backend)
+    if job.state == "prepared":
+        return submit(job, backend)
+    if job.state in TERMINAL_STATES:
+        return job
+    try:
+        state = backend.status(job.provider_name)
+    except Exception as e:
+        logger.warning(f"Could not poll batch job {job.job_id}: {e}")
+        return job
+    if state != job.state:
+        logger.info(f"Batch job {job.job_id}: {job.state} -> {state}")
+        job.state = state
+        job.save()
+    return job
+
+
+def wait(job: BatchJob, backend=None, interval: float = POLL_INTERVAL) -> BatchJob:
+    backend = backend or open_backend(job.backend)
+    while True:
+        job = poll(job, backend)
+        if job.state in TERMINAL_STATES:
+            return job
+        time.sleep(interval)
+
+
+def _lazy_repair(factory: Callable[[], Any], agents: List[Any]) -> Callable[[str, Dict[str, Any]], str]:
+    """A repair call that creates its agent only if some response actually needs repair."""
+    def call(prompt: str, schema: Dict[str, Any]) -> str:
+        if not agents:
+            agents.append(factory())
+        return agents[0]._repair_call(prompt, schema)
+    return call
+
+
+def collect(job: BatchJob, backend=None, mirror_media: bool = False, verify_images: bool = False,
+            repair_fields: bool = True) -> BatchJob:
+    """
+    Streams a finished job's results into checkpoints (infer) or match files, export
+    rows and run stats (match), under job.output_dir. Keys are logged to collected.txt
+    as they are written, so an interrupted collect resumes without duplicating export rows;
+    match-stage export rows are saved to collected_rows.jsonl and replayed into the
+    resumed run's delta and stats.
+    """
+    if job.state == "collected":
+        return job
+    if job.state != "succeeded":
+        logger.info(f"Batch job {job.job_id} is {job.state}; nothing to collect")
+        return job
+    backend = backend or open_backend(job.backend)
+    if not job.results_path.exists():
+        backend.download_results(job.provider_name, job.results_path)
+    out = job.output_dir
+    out.mkdir(parents=True, exist_ok=True)
+    if out != Path("."):
+        logger.info(f"Writing results of {job.backend} batch job {job.job_id} to {out}")
+
+    sources = {entry["key"]: entry for entry in codec.iter_jsonl(job.sources_path)}
+    collected = set(job.collected_path.read_text(encoding="utf-8").split()) if job.collected_path.exists() else set()
+    usage = TokenUsage()
+    agents: List[Any] = []
+    started_at = datetime.now(timezone.utc)
+
+    if job.stage == "infer":
+        from agent_b import AgentB, finish_inference
+        repair_call = _lazy_repair(AgentB, agents) if repair_fields else None
+    else:
+        from agent_c import AgentC, finish_match, match_prompt
+        from agent_d import CSV_PATH, EXPORTS_DIR, DeltaExport, build_product_row, write_product_row
+        repair_call = _lazy_repair(AgentC, agents) if repair_fields else None
+        delta = DeltaExport(job.run_id, exports_dir=out / EXPORTS_DIR)
+        media_store = None
+        if mirror_media:
+            from media_store import MEDIA_ROOT, MediaStore
+            media_store = MediaStore(root=out / MEDIA_ROOT)
+        verify_match = None
+        if verify_images:
+            from image_verify import verify_match
+        results = []
+        # Products exported before an interruption still belong to this run's delta and stats
+        saved = {}
+        if job.collected_rows_path.exists():
+            saved = {entry["key"]: entry for entry in codec.iter_jsonl(job.collected_rows_path)}
+        for key, entry in saved.items():
+            if key in collected:
+                delta.record(entry["row"])
+                results.append(entry["result"])
+        if saved:
+            logger.info(f"Replayed {len(results)} rows collected before the last interruption")
+
+    rows_log = codec.JsonlWriter(job.collected_rows_path, append=True) if job.stage == "match" else nullcontext()
+    with job.collected_path.open("a", encoding="utf-8") as log, rows_log:
+        for line in codec.iter_jsonl(job.results_path):
+            key = str(line.get("key"))
+            source = sources.get(key)
+            if key in collected or source is None:
+                continue
+            response = line.get("response")
+            error = line.get("error") or (None if response else "empty response")
+            if response:
+                usage.record_json(response.get("usageMetadata") or response.get("usage_metadata"))
+            if error:
+                # Nothing is written, so the product goes into the next job like any other miss
+                logger.warning(f"Request {key} of batch job {job.job_id} failed: {error}")
+                continue
+            raw = source["raw"]
+            try:
+                if job.stage == "infer":
+                    parsed = parse_stream([response_text(response)], InferenceResult,
+                                          known={"product_internal_id": key})
+                    inference = finish_inference(parsed, raw, repair_call)
+                    codec.dump_file(out / f"checkpoint_{key}.json", {"raw": raw, "inference": inference})
+                else:
+                    inference = source["inference"]
+                    parsed = parse_stream([response_text(response)], OfficialMatchResult,
+                                          known={"product_internal_id": key})
+                    match_result = finish_match(parsed, key, match_prompt(raw, inference), repair_call)
+                    if verify_match is not None:
+                        match_result = verify_match(raw, match_result)
+                    codec.dump_file(out / f"match_{key}.json", match_result)
+                    row = build_product_row(raw, match_result, inference, media_store=media_store)
+                    review_flag = write_product_row(row, delta, csv_path=out / CSV_PATH)
+                    result = {
+                        "match_found": match_result.get("match_found", False),
+                        "match_confidence": match_result.get("match_confidence"),
+                        "needs_review": review_flag,
+                    }
+                    results.append(result)
+                    rows_log.write({"key": key, "row": row, "result": result})
+                    rows_log.flush()
+            except Exception as e:
+                logger.error(f"Error collecting {key} from batch job {job.job_id}: {e}")
+                continue
+            log.write(f"{key}\n")
+            log.flush()
+            collected.add(key)
+
+    for agent in agents:
+        agent.close()
+    missing = len(sources) - len(collected)
+    if missing:
+        logger.warning(f"{missing} requests of batch job {job.job_id} have no collected result; "
+                       f"submit a new job to retry them")
+
+    if job.stage == "match":
+        if media_store is not None:
+            logger.info(f"Media store: {media_store.stats}")
+        from process_batch import RUNS_LOG_PATH, write_run_stats
+        # Fake jobs read the working directory's checkpoints but write their own under out
+        checkpoints = glob.glob("checkpoint_*.json") + glob.glob(str(out / "checkpoint_*.json"))
+        delta.finish(catalog_ids=[Path(cp).stem[len("checkpoint_"):] for cp in checkpoints])
+        write_run_stats(
+            run_id=job.run_id,
+            started_at=started_at,
+            finished_at=datetime.now(timezone.utc),
+            supplier_name="QiQiYG",
+            results=results,
+            discover_limit=job.discover_limit,
+            token_usage=merge_usage(usage, *(agent.usage for agent in agents)),
+            runs_log_path=out / RUNS_LOG_PATH
+        )
+    else:
+        logger.info(f"Batch job {job.job_id} token usage: {merge_usage(usage, *(agent.usage for agent in agents))}")
+
+    job.state = "collected"
+    job.save()
+    logger.info(f"Collected batch job {job.job_id}: {len(collected)} of {len(sources)} results")
+    return job
+
+
+def _select_jobs(job_ids: List[str]) -> List[BatchJob]:
+    return [BatchJob.load(job_id) for job_id in job_ids] if job_ids else list_jobs()
+
+
+def print_status(jobs: List[BatchJob]) -> None:
+    if not jobs:
+        print("No batch jobs.")
+        return
+    print(f"{'job':<36} {'stage':<6} {'backend':<7} {'requests':>8}  {'state':<10} updated")
+    for job in jobs:
+        print(f"{job.job_id:<36} {job.stage:<6} {job.backend:<7} {job.request_count:>8}  {job.state:<10} {job.updated_at}")
+
+
+def main():
+    from logging_setup import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Offline Agent B/C runs through the provider's batch API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    infer = sub.add_parser("submit-infer", help="Submit an Agent B job for scraped records")
+    infer.add_argument("--input", required=True, help="Scraper output (.json list or .jsonl)")
+    infer.add_argument("--all", action="store_true", help="Include products that already have a checkpoint")
+    match = sub.add_parser("submit-match", help="Submit an Agent C job for the checkpoints")
+    match.add_argument("--max-requests", type=int, help="Only the highest-priority N checkpoints")
+    match.add_argument("--priority-config", help="JSON file of scheduling weights (default: priority.json if present)")
+    match.add_argument("--limit", type=int, help="Processing limit recorded in the run stats")
+    for p in (infer, match):
+        p.add_argument("--backend", choices=BACKENDS, default="gemini", help="fake answers locally, for dry runs")
+
+    sub.add_parser("status", help="List batch jobs")
+    poll_cmd = sub.add_parser("poll", help="Refresh job states (and retry failed submits)")
+    poll_cmd.add_argument("job_ids", nargs="*", help="Default: every job")
+    poll_cmd.add_argument("--wait", action="store_true", help="Keep polling until the jobs finish")
+    collect_cmd = sub.add_parser("collect", help="Write results of finished jobs into checkpoints/matches/export "
+                                                 "(fake jobs: under batch_jobs/<job_id>/output/)")
+    collect_cmd.add_argument("job_ids", nargs="*", help="Default: every finished, uncollected job")
+    collect_cmd.add_argument("--wait", action="store_true", help="Wait for unfinished jobs first")
+    collect_cmd.add_argument("--mirror-media", action="store_true", help="Mirror images into the local media store and export local URLs")
+    collect_cmd.add_argument("--verify-images", action="store_true", help="Compare official and supplier images to auto-accept/reject matches")
+    collect_cmd.add_argument("--no-repair", action="store_true", help="Leave broken fields at defaults instead of making repair calls")
+
+    args = parser.parse_args()
+
+    if args.command == "submit-infer":
+        records = codec.iter_jsonl(args.input) if args.input.endswith(".jsonl") else codec.load_file(args.input)
+        job = submit(prepare_infer_job(records, args.backend, skip_existing=not args.all))
+        print(f"Batch job {job.job_id}: {job.state}")
+    elif args.command == "submit-match":
+        from priority import PriorityConfig
+        job = prepare_match_job(args.backend, args.max_requests, PriorityConfig.load(args.priority_config), args.limit)
+        if job is not None:
+            job = submit(job)
+            print(f"Batch job {job.job_id}: {job.state}")
+    elif args.command == "status":
+        print_status(list_jobs())
+    elif args.command == "poll":
+        jobs = [wait(job) if args.wait else poll(job) for job in _select_jobs(args.job_ids)]
+        print_status(jobs)
+    elif args.command == "collect":
+        for job in _select_jobs(args.job_ids):
+            if args.wait:
+                job = wait(job)
+            collect(job, mirror_media=args.mirror_media, verify_images=args.verify_images,
+                    repair_fields=not args.no_repair)
+
+
+if __name__ == "__main__":
+    main()
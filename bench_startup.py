@@ -0,0 +1,96 @@
+import argparse
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Cumulative import-time budget per CLI module, in milliseconds
+BUDGETS_MS: Dict[str, float] = {
+    "scraper": 400.0,
+    "discover": 400.0,
+    "pipeline": 450.0,
+    "process_batch": 400.0,
+    "worker": 150.0,
+    "agent_b": 400.0,
+    "agent_c": 400.0,
+    "agent_d": 100.0,
+    "batch_jobs": 150.0,
+    "sweep": 400.0,
+    "bulk_export": 150.0,
+    "image_verify": 150.0,
+}
+
+# Modules that must only load on first use, never at CLI startup
+DEFERRED_MODULES = [
+    "playwright",
+    "asyncio",
+    "google.generativeai",
+    "google.genai",
+    "PIL",
+    "numpy",
+]
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)')
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """
+    Imports `module` in a fresh interpreter under -X importtime. Returns the
+    module's cumulative import time (ms) and every module name that was loaded.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+
+    cumulative_us = 0
+    loaded = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        loaded.append(match.group(3))
+        if match.group(3) == module:
+            cumulative_us = int(match.group(2))
+    return cumulative_us / 1000.0, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time guard for AutoMatch CLI entry points")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: all CLIs)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module; the fastest is reported")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply budgets (slow CI machines)")
+    args = parser.parse_args()
+
+    modules = args.modules or list(BUDGETS_MS)
+    failures = []
+    print(f"{'module':<16} {'import ms':>10} {'budget ms':>10}  status")
+    for module in modules:
+        try:
+            runs = [measure(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            failures.append(module)
+            print(f"{module:<16} {'-':>10} {'-':>10}  ERROR {e}")
+            continue
+
+        elapsed = min(ms for ms, _ in runs)
+        budget = BUDGETS_MS.get(module, 500.0) * args.scale
+        eager = sorted({m for m in runs[0][1] for d in DEFERRED_MODULES if m == d or m.startswith(d + ".")})
+        status = "ok"
+        if elapsed > budget:
+            status = "OVER BUDGET"
+        if eager:
+            status = f"EAGER IMPORT: {', '.join(eager[:5])}"
+        if status != "ok":
+            failures.append(module)
+        print(f"{module:<16} {elapsed:>10.1f} {budget:>10.1f}  {status}")
+
+    if failures:
+        print(f"\nStartup regressions in: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import csv
+import glob
+import logging
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import codec
+from agent_d import (AUTO_DECIDED_VERIFICATIONS, CSV_PATH, GALLERY_SIZE, HEADERS, PRICE_STRIP_CHARS,
+                     REVIEW_CONFIDENCE_THRESHOLD, DeltaExport)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from media_store import MediaStore
+
+logger = logging.getLogger(__name__)
+
+# Products per vectorized batch; bounds peak memory of the fixed-width string arrays
+CHUNK_SIZE = 50_000
+
+Record = Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]
+
+
+def iter_checkpoint_records(directory: str = ".") -> Iterator[Record]:
+    """Yields (raw, inference, match) for every checkpoint that has a match file."""
+    for cp_file in sorted(glob.glob(str(Path(directory) / "checkpoint_*.json"))):
+        product_id = Path(cp_file).stem[len("checkpoint_"):]
+        match_file = Path(directory) / f"match_{product_id}.json"
+        if not match_file.exists():
+            continue
+        data = codec.load_file(cp_file)
+        yield data.get("raw") or {}, data.get("inference") or {}, codec.load_file(match_file)
+
+
+def iter_jsonl_records(path: str) -> Iterator[Record]:
+    """Yields records from a JSON-lines file of {"raw", "inference", "match"} objects."""
+    for item in codec.iter_jsonl(path):
+        yield item.get("raw") or {}, item.get("inference") or {}, item.get("match") or {}
+
+
+def _text(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _str_array(values: List[str]) -> "np.ndarray":
+    import numpy as np
+    return np.array(values, dtype=str) if values else np.array([], dtype="<U1")
+
+
+def normalize_prices(prices: "np.ndarray") -> "np.ndarray":
+    """Vectorized agent_d.normalize_price_text."""
+    import numpy as np
+
+    for char in PRICE_STRIP_CHARS:
+        prices = np.char.replace(prices, char, "")
+    return np.char.strip(prices)
+
+
+def select_images(image_lists: List[List[str]]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Vectorized main-image/gallery selection: main is the first non-logo image (else
+    the first image); the gallery is the next GALLERY_SIZE images that differ from it.
+    Returns (main, gallery) with gallery shaped (n, GALLERY_SIZE).
+    """
+    import numpy as np
+
+    n = len(image_lists)
+    counts = np.fromiter((len(images) for images in image_lists), dtype=np.int64, count=n)
+    flat = _str_array([url for images in image_lists for url in images])
+    main = np.full(n, "", dtype=object)
+    gallery = np.full((n, GALLERY_SIZE), "", dtype=object)
+    if flat.size == 0:
+        return main, gallery
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_images = counts > 0
+    owner = np.repeat(np.arange(n), counts)
+    positions = np.arange(flat.size)
+
+    # First non-logo position per product, falling back to the product's first image
+    non_logo = np.char.find(np.char.lower(flat), "logo") < 0
+    candidate = np.where(non_logo, positions, flat.size)
+    first_non_logo = np.full(n, flat.size)
+    np.minimum.at(first_non_logo, owner, candidate)
+    main_pos = np.where(first_non_logo < flat.size, first_non_logo, starts)
+    main[has_images] = flat[main_pos[has_images]]
+
+    # Gallery: images != main, ranked within their product, first GALLERY_SIZE kept
+    keep = flat != flat[main_pos[owner]]
+    kept_before = np.cumsum(keep) - keep
+    rank = kept_before - kept_before[starts[owner]]
+    keep &= rank < GALLERY_SIZE
+    gallery[owner[keep], rank[keep]] = flat[keep]
+    return main, gallery
+
+
+def resolve_media(images: "np.ndarray", media_store: "MediaStore") -> "np.ndarray":
+    """
+    Swaps image URLs already mirrored into `media_store` for their local /media/
+    URLs, as build_product_row does during a run. Nothing is downloaded; URLs
+    that were never mirrored are kept.
+    """
+    import numpy as np
+
+    flat = images.ravel().tolist()
+    local = {url: media_store.lookup(url) or url for url in set(flat) if url}
+    resolved = np.empty(len(flat), dtype=object)
+    resolved[:] = [local.get(url, url) for url in flat]
+    return resolved.reshape(images.shape)
+
+
+def build_rows(records: List[Record], supplier_name: str = "QiQiYG",
+               media_store: Optional["MediaStore"] = None) -> List[Tuple[Any, ...]]:
+    """Applies agent_d's export derivations to a batch of records, column by column."""
+    import numpy as np
+
+    n = len(records)
+    raws = [r for r, _, _ in records]
+    inferences = [i for _, i, _ in records]
+    matches = [m for _, _, m in records]
+
+    def column(dicts: List[Dict[str, Any]], key: str, default: Any = "") -> "np.ndarray":
+        values = np.empty(n, dtype=object)
+        values[:] = [d.get(key, default) for d in dicts]
+        return values
+
+    official_brand = column(matches, "official_brand", None)
+    inferred_brand = column(inferences, "inferred_brand", None)
+    brand = np.where(official_brand.astype(bool), official_brand,
+                     np.where(inferred_brand.astype(bool), inferred_brand, ""))
+
+    raw_title = column(raws, "raw_title")
+    official_name = column(matches, "official_product_name", None)
+    product_name = np.where(official_name.astype(bool), official_name, raw_title)
+    official_sku = column(matches, "official_sku", None)
+    product_sku = np.where(official_sku.astype(bool), official_sku, "")
+
+    raw_description = column(raws, "raw_description_html", None)
+    product_description = np.where(raw_description.astype(bool), raw_description, raw_title)
+
+    cost_price = normalize_prices(_str_array([_text(r.get("raw_price_text")) for r in raws]))
+    compare_price = normalize_prices(_str_array([_text(m.get("official_price")) for m in matches]))
+
+    match_found = np.array([bool(m.get("match_found", False)) for m in matches], dtype=bool)
+    confidence = np.array([m.get("match_confidence") or 0.0 for m in matches], dtype=np.float64)
+    auto_decided = np.isin(column(matches, "verification", None), AUTO_DECIDED_VERIFICATIONS)
+    needs_review = np.where(~auto_decided & (~match_found | (confidence < REVIEW_CONFIDENCE_THRESHOLD)), "YES", "NO")
+
+    main_image, gallery = select_images([list(r.get("image_urls") or []) for r in raws])
+    if media_store is not None:
+        main_image = resolve_media(main_image, media_store)
+        gallery = resolve_media(gallery, media_store)
+
+    columns = [
+        column(raws, "category_id"),
+        column(raws, "product_internal_id"),
+        brand,
+        product_name,
+        product_sku,
+        product_description,
+        np.full(n, supplier_name, dtype=object),
+        column(raws, "product_page_url"),
+        cost_price,
+        compare_price,
+        cost_price,  # product_price mirrors cost for now
+        main_image,
+        *gallery.T,
+        needs_review,
+    ]
+    return list(zip(*(c.tolist() for c in columns)))
+
+
+def _chunks(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_export(records: Iterable[Record],
+                csv_path: Path = CSV_PATH,
+                jsonl_path: Optional[Path] = None,
+                supplier_name: str = "QiQiYG",
+                chunk_size: int = CHUNK_SIZE,
+                delta: Optional[DeltaExport] = None,
+                media_store: Optional["MediaStore"] = None) -> int:
+    """
+    Regenerates the export from stored records in one pass, replacing csv_path
+    (and jsonl_path, if given). Returns the number of rows written. With `delta`,
+    every row is recorded and the delta is finished against the exported products,
+    so anything no longer in the records is reported as removed. With `media_store`,
+    mirrored images keep their local URLs.
+    """
+    csv_path = Path(csv_path)
+    tmp_csv = csv_path.with_suffix(csv_path.suffix + ".tmp")
+    jsonl_writer = codec.JsonlWriter(Path(jsonl_path).with_suffix(".tmp")) if jsonl_path else None
+    total = 0
+    try:
+        with tmp_csv.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADERS)
+            for chunk in _chunks(records, chunk_size):
+                rows = build_rows(chunk, supplier_name, media_store)
+                writer.writerows(rows)
+                if delta is not None:
+                    for row in rows:
+                        delta.record(list(row))
+                if jsonl_writer:
+                    jsonl_writer.write_many(dict(zip(HEADERS, row)) for row in rows)
+                total += len(rows)
+                logger.info(f"Exported {total} rows...")
+    finally:
+        if jsonl_writer:
+            jsonl_writer.close()
+
+    tmp_csv.replace(csv_path)
+    if jsonl_path:
+        Path(jsonl_path).with_suffix(".tmp").replace(jsonl_path)
+    if delta is not None:
+        delta.finish(catalog_ids=delta.recorded)
+    return total
+
+
+def main():
+    from logging_setup import setup_logging
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Regenerate the inventory export from stored records")
+    parser.add_argument("--records", help="JSON-lines file of {raw, inference, match} records (default: checkpoint/match files)")
+    parser.add_argument("--dir", default=".", help="Directory holding checkpoint_*.json and match_*.json")
+    parser.add_argument("--output", default=str(CSV_PATH), help="CSV output path")
+    parser.add_argument("--jsonl", help="Also write the export as JSON lines to this path")
+    parser.add_argument("--supplier", default="QiQiYG", help="Supplier name column value")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Products per vectorized batch")
+    parser.add_argument("--no-delta", action="store_true", help="Skip writing exports/delta_<run_id>.csv")
+    parser.add_argument("--media-root", help="Media store of earlier --mirror-media runs (default: media/, if present)")
+    args = parser.parse_args()
+
+    records = iter_jsonl_records(args.records) if args.records else iter_checkpoint_records(args.dir)
+    delta = None if args.no_delta else DeltaExport(datetime.now(timezone.utc).strftime("bulk-%Y%m%dT%H%M%S"))
+    from media_store import MEDIA_ROOT, MediaStore
+    media_root = Path(args.media_root) if args.media_root else MEDIA_ROOT
+    media_store = MediaStore(root=media_root) if media_root.exists() else None
+    if media_store is None and args.media_root:
+        parser.error(f"No media store at {media_root}")
+    started = time.perf_counter()
+    total = bulk_export(records, Path(args.output), Path(args.jsonl) if args.jsonl else None,
+                        args.supplier, args.chunk_size, delta, media_store)
+    logger.info(f"Wrote {total} rows to {args.output} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
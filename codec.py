@@ -0,0 +1,142 @@
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Union
+
+logger = logging.getLogger(__name__)
+
+# Fastest available JSON backend: orjson, then msgspec, then the stdlib. msgspec is
+# imported on its own as well, since it also provides the MessagePack encoding
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+BACKEND = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
+
+PathLike = Union[str, Path]
+
+
+def _default(obj: Any) -> Any:
+    """Serializes model records and other objects exposing to_json()."""
+    if hasattr(obj, "to_json"):
+        return obj.to_json()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _escape_char(match: "re.Match") -> str:
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return f"\\u{0xD800 + (code >> 10):04x}\\u{0xDC00 + (code & 0x3FF):04x}"
+    return f"\\u{code:04x}"
+
+
+def _ensure_ascii(data: bytes) -> bytes:
+    # Non-ASCII can only occur inside JSON strings, so escaping it everywhere is safe
+    if data.isascii():
+        return data
+    return _NON_ASCII.sub(_escape_char, data.decode("utf-8")).encode("ascii")
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Encodes to ASCII JSON bytes with non-ASCII characters \\u-escaped, like the stdlib's
+    default ensure_ascii=True. indent=True produces JSON equivalent to
+    json.dump(..., indent=2) used by the checkpoint and match files (number spelling
+    can differ by backend, e.g. orjson's 1e16 for the stdlib's 1e+16).
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return _ensure_ascii(orjson.dumps(obj, default=_default, option=option | orjson.OPT_NON_STR_KEYS))
+    if msgspec is not None and not indent:
+        return _ensure_ascii(msgspec.json.encode(obj, enc_hook=_default))
+    return json.dumps(obj, default=_default, indent=2 if indent else None,
+                      separators=None if indent else (",", ":")).encode("ascii")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def dump_file(path: PathLike, obj: Any, indent: bool = True) -> None:
+    Path(path).write_bytes(dumps(obj, indent=indent))
+
+
+def load_file(path: PathLike) -> Any:
+    return loads(Path(path).read_bytes())
+
+
+def dumps_binary(obj: Any) -> bytes:
+    """Compact binary encoding (MessagePack via msgspec); falls back to compact JSON."""
+    if msgspec is not None:
+        return msgspec.msgpack.encode(obj, enc_hook=_default)
+    return dumps(obj)
+
+
+def loads_binary(data: bytes) -> Any:
+    if msgspec is not None:
+        return msgspec.msgpack.decode(data)
+    return loads(data)
+
+
+class JsonlWriter:
+    """Streams records to a JSON-lines file, one compact object per line."""
+
+    def __init__(self, path: PathLike, append: bool = False):
+        self.path = Path(path)
+        self._f = self.path.open("ab" if append else "wb")
+        self.count = 0
+
+    def write(self, record: Any) -> None:
+        self._f.write(dumps(record))
+        self._f.write(b"\n")
+        self.count += 1
+
+    def write_many(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.write(record)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_jsonl(path: PathLike) -> Iterator[Any]:
+    """Yields one decoded object per non-empty line without loading the whole file."""
+    with Path(path).open("rb") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except ValueError as e:
+                logger.error(f"Skipping malformed line {line_no} in {path}: {e}")
+
+
+def write_jsonl(path: PathLike, records: Iterable[Any], append: bool = False) -> int:
+    with JsonlWriter(path, append=append) as writer:
+        writer.write_many(records)
+        return writer.count
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import Deque, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Visited-set sizing: ~1.8 MB of bits for a million pages at a 0.1% false-positive rate
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.001
+# Frontier entries kept in RAM; the rest spill to a temporary file
+FRONTIER_MEMORY_ITEMS = 10_000
+SQLITE_COMMIT_EVERY = 1000
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Canonical crawl key: lowercase scheme and host, no default port or fragment,
+    query parameters sorted, so equivalent links dedupe to one entry.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def _key_hash(key: str) -> bytes:
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Fixed-size probabilistic visited set. add() may wrongly report a new key as seen
+    (at roughly `error_rate` once `capacity` keys are in), never the reverse, so a
+    false positive only skips a page.
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = _key_hash(key)
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: str) -> bool:
+        """Adds `key`; returns True if it was not (probably) present before."""
+        new = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+            if self.count == self.capacity + 1:
+                logger.warning(f"Bloom filter exceeded its capacity of {self.capacity}; "
+                               f"false positives will rise (use the SQLite visited set)")
+        return new
+
+
+class SQLiteVisitedSet:
+    """Exact on-disk visited set of 64-bit URL hashes, for crawls beyond the Bloom filter's capacity."""
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="crawl_visited_", suffix=".db")
+            os.close(fd)
+            self._temporary = True
+        else:
+            self._temporary = False
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS visited (key INTEGER PRIMARY KEY)")
+        self._pending = 0
+
+    def _key(self, key: str) -> int:
+        return int.from_bytes(_key_hash(key)[:8], "little", signed=True)
+
+    def __contains__(self, key: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM visited WHERE key = ?", (self._key(key),)).fetchone() is not None
+
+    def add(self, key: str) -> bool:
+        cursor = self.conn.execute("INSERT OR IGNORE INTO visited (key) VALUES (?)", (self._key(key),))
+        self._pending += 1
+        if self._pending >= SQLITE_COMMIT_EVERY:
+            self.conn.commit()
+            self._pending = 0
+        return cursor.rowcount == 1
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+        if self._temporary:
+            self.path.unlink(missing_ok=True)
+
+
+class ProductIdSet:
+    """Bitmap of seen integer product IDs: one bit per ID up to the largest seen."""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def __contains__(self, product_id: int) -> bool:
+        byte = product_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (product_id & 7)))
+
+    def add(self, product_id: int) -> bool:
+        """Adds `product_id`; returns True if it was new."""
+        byte = product_id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1, 2 * len(self.bits)) - len(self.bits)))
+        mask = 1 << (product_id & 7)
+        if self.bits[byte] & mask:
+            return False
+        self.bits[byte] |= mask
+        self.count += 1
+        return True
+
+
+class CrawlFrontier:
+    """
+    FIFO queue of (url, depth) with at most `memory_items` entries in RAM. Once full,
+    new entries spill to a temporary JSON-lines file and are read back in order.
+    """
+
+    def __init__(self, memory_items: int = FRONTIER_MEMORY_ITEMS):
+        self.memory_items = memory_items
+        self._memory: Deque[Tuple[str, int]] = deque()
+        self._spill = None
+        self._spilled = 0
+        self._read_offset = 0
+
+    def __len__(self) -> int:
+        return len(self._memory) + self._spilled
+
+    def push(self, url: str, depth: int) -> None:
+        # While anything is on disk, new entries must queue behind it to keep FIFO order
+        if self._spilled or len(self._memory) >= self.memory_items:
+            if self._spill is None:
+                self._spill = tempfile.TemporaryFile(mode="w+b", prefix="crawl_frontier_")
+            self._spill.seek(0, os.SEEK_END)
+            self._spill.write(json.dumps([url, depth]).encode("utf-8") + b"\n")
+            self._spilled += 1
+        else:
+            self._memory.append((url, depth))
+
+    def pop(self) -> Tuple[str, int]:
+        if not self._memory and self._spilled:
+            self._refill()
+        return self._memory.popleft()
+
+    def _refill(self) -> None:
+        self._spill.seek(self._read_offset)
+        while self._spilled and len(self._memory) < self.memory_items:
+            url, depth = json.loads(self._spill.readline())
+            self._memory.append((url, depth))
+            self._spilled -= 1
+        self._read_offset = self._spill.tell()
+        if not self._spilled:
+            # Drained: reuse the file from the start
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._read_offset = 0
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
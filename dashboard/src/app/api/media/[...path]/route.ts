@@ -0,0 +1,21 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { resolveMediaPath, serveMediaFile } from '@/lib/media';
+
+/**
+ * Serves mirrored images from the local media store.
+ *
+ * Usage: /api/media/objects/ab/<sha256>.png[?size=128|256|512]
+ */
+export async function GET(
+    request: NextRequest,
+    { params }: { params: Promise<{ path: string[] }> }
+) {
+    const { path: segments } = await params;
+    const size = parseInt(request.nextUrl.searchParams.get('size') || '', 10) || undefined;
+
+    const file = resolveMediaPath(segments.join('/'), size);
+    if (!file) {
+        return new NextResponse('Not found', { status: 404 });
+    }
+    return serveMediaFile(file);
+}
@@ -23,7 +23,7 @@ export async function GET(request: NextRequest) {
             needs_review: p.needs_review,
             match_found: p.match_found === 'TRUE' || p.match_found === true,
             match_confidence: parseFloat(p.match_confidence) || 0,
-            product_media_main_image_url: fixImageUrl(p.product_media_main_image_url),
+            product_media_main_image_url: fixImageUrl(p.product_media_main_image_url, 128),
             product_supplier_url: p.product_supplier_url,
             product_cost_price: p.product_cost_price,
             product_compare_to_price: p.product_compare_to_price,
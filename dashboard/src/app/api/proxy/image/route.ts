@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { lookupMirroredUrl, serveMediaFile } from '@/lib/media';
 
 export async function GET(request: NextRequest) {
     const url = request.nextUrl.searchParams.get('url');
@@ -7,6 +8,12 @@ export async function GET(request: NextRequest) {
         return new NextResponse('Missing URL', { status: 400 });
     }
 
+    // Serve mirrored bytes from the local media store when available
+    const mirrored = lookupMirroredUrl(url);
+    if (mirrored) {
+        return serveMediaFile(mirrored);
+    }
+
     try {
         const response = await fetch(url, {
             headers: {
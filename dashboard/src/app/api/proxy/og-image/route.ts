@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { lookupMirroredUrl, serveMediaFile } from '@/lib/media';
 
 /**
  * Proxy endpoint that fetches a product page and extracts the og:image meta tag.
@@ -13,6 +14,12 @@ export async function GET(request: NextRequest) {
         return NextResponse.json({ error: 'Missing url parameter' }, { status: 400 });
     }
 
+    // agent_d mirrors the official image under its page URL; skip both remote fetches
+    const mirrored = lookupMirroredUrl(pageUrl);
+    if (mirrored) {
+        return serveMediaFile(mirrored);
+    }
+
     try {
         // Step 1: Fetch the product page
         const pageResponse = await fetch(pageUrl, {
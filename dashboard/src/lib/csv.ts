@@ -53,8 +53,13 @@ export interface ProductResult {
  * Rewrites image URLs from the dead pic.qiqi2000.com CDN
  * to the working bags.qiqiyg.com mirror.
  * The path structure is identical on both domains.
+ * Local media-store URLs (/media/...) are served by /api/media, optionally
+ * as a thumbnail of the given size.
  */
-export function fixImageUrl(url: string | undefined | null): string {
+export function fixImageUrl(url: string | undefined | null, size?: number): string {
     if (!url) return '';
+    if (url.startsWith('/media/')) {
+        return `/api/media/${url.slice('/media/'.length)}${size ? `?size=${size}` : ''}`;
+    }
     return url.replace('https://pic.qiqi2000.com/', 'https://bags.qiqiyg.com/');
 }
@@ -0,0 +1,76 @@
+import fs from 'fs';
+import path from 'path';
+import crypto from 'crypto';
+
+const PROJECT_ROOT = path.resolve(process.cwd(), '..');
+export const MEDIA_ROOT = path.join(PROJECT_ROOT, 'media');
+export const THUMBNAIL_SIZES = [128, 256, 512];
+
+const CONTENT_TYPES: Record<string, string> = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+};
+
+export interface MediaFile {
+    filePath: string;
+    contentType: string;
+}
+
+export function contentTypeFor(filePath: string): string {
+    return CONTENT_TYPES[path.extname(filePath).toLowerCase()] || 'application/octet-stream';
+}
+
+/**
+ * Resolves a path under media/ (e.g. "objects/ab/<sha256>.png"), refusing
+ * anything that escapes the media root. With a size, the matching thumbnail
+ * is returned when one exists.
+ */
+export function resolveMediaPath(relativePath: string, size?: number): MediaFile | null {
+    let filePath = path.resolve(MEDIA_ROOT, relativePath);
+    if (!filePath.startsWith(MEDIA_ROOT + path.sep)) {
+        return null;
+    }
+    if (size && THUMBNAIL_SIZES.includes(size) && relativePath.startsWith('objects/')) {
+        const name = path.basename(filePath, path.extname(filePath));
+        const thumbPath = path.join(MEDIA_ROOT, 'thumbs', String(size), name.slice(0, 2), `${name}.jpg`);
+        if (fs.existsSync(thumbPath)) {
+            filePath = thumbPath;
+        }
+    }
+    if (!fs.existsSync(filePath)) {
+        return null;
+    }
+    return { filePath, contentType: contentTypeFor(filePath) };
+}
+
+/**
+ * Looks up a remote image (or official page) URL in the media store written by
+ * agent_d. Reference files are keyed by the SHA-1 of the source URL.
+ */
+export function lookupMirroredUrl(url: string): MediaFile | null {
+    const key = crypto.createHash('sha1').update(url, 'utf8').digest('hex');
+    const refPath = path.join(MEDIA_ROOT, 'urls', `${key}.json`);
+    if (!fs.existsSync(refPath)) {
+        return null;
+    }
+    try {
+        const ref = JSON.parse(fs.readFileSync(refPath, 'utf-8'));
+        return resolveMediaPath(`objects/${ref.object.slice(0, 2)}/${ref.object}`);
+    } catch {
+        return null;
+    }
+}
+
+export function serveMediaFile(file: MediaFile): Response {
+    return new Response(fs.readFileSync(file.filePath), {
+        headers: {
+            'Content-Type': file.contentType,
+            // Objects are content-addressed, so their bytes never change
+            'Cache-Control': 'public, max-age=31536000, immutable',
+        },
+    });
+}
@@ -2,22 +2,28 @@ import httpx
 from bs4 import BeautifulSoup
 import re
 import logging
-from typing import List
+from typing import Iterator, List, Optional, Union
+from crawl_state import BloomFilter, CrawlFrontier, ProductIdSet, SQLiteVisitedSet, canonical_url
+from fetcher import fetch
+from resilience import Deadline
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 BASE_URL = "https://bags.qiqiyg.com/"
 
-import asyncio
-from playwright.async_api import async_playwright
+MAX_CRAWL_DEPTH = 3
+PRODUCT_LINK_PATTERN = re.compile(r'productinfoen_(\d+)')
+SUB_LINK_PATTERN = re.compile(r'(categoryen|producten)_\d+.*path=0_')
+
+VisitedSet = Union[BloomFilter, SQLiteVisitedSet]
 
 async def fetch_soup_browser(url: str) -> BeautifulSoup:
     """
     Fallback browser fetch with strictly 15s timeout and specific wait logic.
     """
     logger.info(f"Fallback: Fetching {url} via Playwright")
+    # Imported lazily: Playwright is heavy and the browser path is rarely taken
+    from playwright.async_api import async_playwright
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(
@@ -42,92 +48,110 @@ async def fetch_soup_browser(url: str) -> BeautifulSoup:
         finally:
             await browser.close()
 
-def fetch_soup(url: str, use_browser: bool = False) -> BeautifulSoup:
+def fetch_soup(url: str, use_browser: bool = False, deadline: Optional[Deadline] = None) -> BeautifulSoup:
     if use_browser:
+        import asyncio
         return asyncio.run(fetch_soup_browser(url))
         
     try:
-        with httpx.Client(timeout=15.0, follow_redirects=True) as client:
-            response = client.get(url)
-            response.raise_for_status()
-            return BeautifulSoup(response.text, 'html.parser')
+        response = fetch(url, timeout=15.0, follow_redirects=True, deadline=deadline)
+        if response.status_code == 404:
+            # Missing pages are routine (delisted products, ID sweeps), not errors
+            logger.info(f"Not found: {url}")
+            return None
+        response.raise_for_status()
+        return BeautifulSoup(response.text, 'html.parser')
     except Exception as e:
         logger.error(f"Error fetching {url}: {e}")
         return None
 
-def discover_product_urls(limit_categories: int = None, start_category_url: str = None) -> List[str]:
+def discover_category_links(limit_categories: int = None) -> List[str]:
+    logger.info(f"Starting discovery from {BASE_URL}")
+    soup = fetch_soup(BASE_URL)
+    if not soup:
+        return []
+
+    category_pattern = re.compile(r'categoryen_\d+\.html\?path=0_\d+')
+    category_links = set()
+    for a in soup.find_all('a', href=True):
+        if category_pattern.search(a['href']):
+            category_links.add(str(httpx.URL(BASE_URL).join(a['href'])))
+
+    category_links = sorted(category_links)
+    if limit_categories:
+        category_links = category_links[:limit_categories]
+    return category_links
+
+def iter_product_urls(limit_categories: int = None, start_category_url: str = None,
+                      visited: Optional[VisitedSet] = None,
+                      frontier: Optional[CrawlFrontier] = None) -> Iterator[str]:
     """
-    Orchestrates discovery: Home -> Category -> Product List -> Product Info URLs.
+    Crawls Home -> Category -> Product List breadth-first and yields each product info
+    URL the first time its product ID is seen. Memory stays bounded: the frontier
+    spills to disk, visited pages live in a fixed-size Bloom filter (or pass a
+    SQLiteVisitedSet), and seen products are one bit per integer ID.
     """
     if start_category_url:
         category_links = [start_category_url]
     else:
-        logger.info(f"Starting discovery from {BASE_URL}")
-        soup = fetch_soup(BASE_URL)
-        if not soup:
-            return []
-
-        # 1. Discover Categories
-        category_pattern = re.compile(r'categoryen_\d+\.html\?path=0_\d+')
-        category_links = []
-        for a in soup.find_all('a', href=True):
-            if category_pattern.search(a['href']):
-                full_url = str(httpx.URL(BASE_URL).join(a['href']))
-                category_links.append(full_url)
-        
-        category_links = sorted(list(set(category_links)))
-        if limit_categories:
-            category_links = category_links[:limit_categories]
-    
+        category_links = discover_category_links(limit_categories)
     logger.info(f"Using {len(category_links)} category seeds.")
 
-    product_info_urls = []
-    visited_urls = set()
+    visited = visited if visited is not None else BloomFilter()
+    frontier = frontier if frontier is not None else CrawlFrontier()
+    seen_products = ProductIdSet()
 
-    def explore_page(url: str, depth: int = 0):
-        if depth > 3 or url in visited_urls:
-            return
-        visited_urls.add(url)
-        
-        logger.info(f"Exploring: {url} (Depth {depth})")
-        soup = fetch_soup(url)
-        
-        # Check if we found anything. If not, try browser fallback for depth 0 or 1
-        if soup:
-             info_links = soup.find_all('a', href=re.compile(r'productinfoen_'))
-             sub_links = soup.find_all('a', href=re.compile(r'(categoryen|producten)_\d+.*path=0_'))
-             
-             if not info_links and not sub_links and depth < 2:
-                 logger.info(f"No links found via httpx for {url}, retrying with browser...")
-                 soup = fetch_soup(url, use_browser=True)
-        else:
-            logger.info(f"Failed to fetch {url} via httpx, retrying with browser...")
-            soup = fetch_soup(url, use_browser=True)
-            
-        if not soup:
-            return
-        
-        # Look for product info links (the goal)
-        info_links = soup.find_all('a', href=re.compile(r'productinfoen_'))
-        if info_links:
-            for a in info_links:
-                full_url = str(httpx.URL(url).join(a['href']))
-                product_info_urls.append(full_url)
-        
-        # Look for more listing/category links to dive deeper
-        sub_links = soup.find_all('a', href=re.compile(r'(categoryen|producten)_\d+.*path=0_'))
-        for a in sub_links:
-            full_url = str(httpx.URL(url).join(a['href']))
-            explore_page(full_url, depth + 1)
-
-    for cat_url in category_links:
-        explore_page(cat_url)
-    
-    unique_product_urls = sorted(list(set(product_info_urls)))
-    logger.info(f"Total product info URLs discovered: {len(unique_product_urls)}")
-    return unique_product_urls
+    def enqueue(url: str, depth: int) -> None:
+        url = canonical_url(url)
+        if depth <= MAX_CRAWL_DEPTH and visited.add(url):
+            frontier.push(url, depth)
+
+    try:
+        for cat_url in category_links:
+            enqueue(cat_url, 0)
+
+        while frontier:
+            url, depth = frontier.pop()
+            logger.info(f"Exploring: {url} (Depth {depth}, frontier {len(frontier)})")
+            soup = fetch_soup(url)
+
+            # Check if we found anything. If not, try browser fallback for depth 0 or 1
+            if soup:
+                if not soup.find('a', href=PRODUCT_LINK_PATTERN) and not soup.find('a', href=SUB_LINK_PATTERN) and depth < 2:
+                    logger.info(f"No links found via httpx for {url}, retrying with browser...")
+                    soup = fetch_soup(url, use_browser=True)
+            else:
+                logger.info(f"Failed to fetch {url} via httpx, retrying with browser...")
+                soup = fetch_soup(url, use_browser=True)
+
+            if not soup:
+                continue
+
+            # Product info links (the goal), deduplicated by integer product ID
+            for a in soup.find_all('a', href=PRODUCT_LINK_PATTERN):
+                product_id = int(PRODUCT_LINK_PATTERN.search(a['href']).group(1))
+                if seen_products.add(product_id):
+                    yield canonical_url(str(httpx.URL(url).join(a['href'])))
+
+            # More listing/category links to dive deeper
+            for a in soup.find_all('a', href=SUB_LINK_PATTERN):
+                enqueue(str(httpx.URL(url).join(a['href'])), depth + 1)
+    finally:
+        frontier.close()
+        if isinstance(visited, SQLiteVisitedSet):
+            visited.close()
+        logger.info(f"Total product info URLs discovered: {seen_products.count}")
+
+def discover_product_urls(limit_categories: int = None, start_category_url: str = None) -> List[str]:
+    """
+    Orchestrates discovery: Home -> Category -> Product List -> Product Info URLs.
+    Returns a sorted list; use iter_product_urls to stream large catalogs.
+    """
+    return sorted(iter_product_urls(limit_categories, start_category_url))
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     # Test with a known active category
     urls = discover_product_urls(start_category_url="https://bags.qiqiyg.com/categoryen_37771.html?path=0_37771")
     for url in urls[:10]:
@@ -0,0 +1,266 @@
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, asdict
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import httpx
+from resilience import (
+    HEDGE_AFTER, RETRY_ATTEMPTS, TRANSIENT_STATUS_CODES,
+    Deadline, DeadlineExceeded, get_breaker, hedged_call, retry_call
+)
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+HOST_STATE_PATH = Path("host_state.json")
+
+# AIMD window bounds (concurrent requests per host)
+MIN_WINDOW = 1.0
+MAX_WINDOW = 16.0
+INITIAL_WINDOW = 2.0
+# Multiplicative decrease on 429/5xx/latency spikes
+BACKOFF_FACTOR = 0.5
+# A response slower than this multiple of the host's average latency counts as a spike
+LATENCY_SPIKE_FACTOR = 3.0
+# ...and is at least this many seconds slower, so jitter on fast hosts is ignored
+LATENCY_SPIKE_MIN = 1.0
+# Smoothing for the per-host latency average
+LATENCY_ALPHA = 0.2
+# Cap on how long a Retry-After header may block a host
+MAX_RETRY_AFTER = 600.0
+
+
+@dataclass
+class HostState:
+    window: float = INITIAL_WINDOW
+    avg_latency: Optional[float] = None
+    crawl_delay: float = 0.0
+    blocked_until: float = 0.0
+    robots_checked_at: float = 0.0
+    requests: int = 0
+    throttled: int = 0
+    # Runtime only, never persisted
+    in_flight: int = 0
+    last_start: float = 0.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Returns the Retry-After delay in seconds (delta-seconds or HTTP-date form)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_crawl_delay(robots_txt: str) -> Optional[float]:
+    """Crawl-delay for the `*` user-agent group (stdlib robotparser only accepts integers)."""
+    in_group = False
+    for line in robots_txt.splitlines():
+        key, _, value = line.split("#", 1)[0].partition(":")
+        key, value = key.strip().lower(), value.strip()
+        if key == "user-agent":
+            in_group = value == "*"
+        elif key == "crawl-delay" and in_group:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class HostScheduler:
+    """
+    Politeness scheduler for all outbound HTTP. Keeps an AIMD concurrency window
+    per host: it grows on fast 2xx responses and halves on 429/5xx or latency
+    spikes. Retry-After and robots.txt crawl-delay are honored, and host state
+    is persisted across runs.
+    """
+
+    def __init__(self, state_path: Path = HOST_STATE_PATH,
+                 min_window: float = MIN_WINDOW,
+                 max_window: float = MAX_WINDOW,
+                 respect_robots: bool = True,
+                 robots_ttl: float = 86400.0):
+        self.state_path = Path(state_path)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.respect_robots = respect_robots
+        self.robots_ttl = robots_ttl
+        self.hosts: Dict[str, HostState] = {}
+        self._cond = threading.Condition()
+        self._dirty = 0
+        self.client = httpx.Client(
+            timeout=15.0,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=int(max_window) * 8, max_keepalive_connections=32)
+        )
+        self._load()
+
+    def _load(self) -> None:
+        if not self.state_path.exists():
+            return
+        try:
+            data = json.loads(self.state_path.read_text(encoding="utf-8"))
+            for host, fields in data.items():
+                state = HostState(**{k: v for k, v in fields.items() if k in HostState.__dataclass_fields__})
+                state.window = min(max(state.window, self.min_window), self.max_window)
+                state.in_flight = 0
+                self.hosts[host] = state
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable host state {self.state_path}: {e}")
+
+    def save(self) -> None:
+        with self._cond:
+            data = {}
+            for host, state in self.hosts.items():
+                fields = asdict(state)
+                fields.pop("in_flight")
+                fields.pop("last_start")
+                data[host] = fields
+            self._dirty = 0
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def _check_robots(self, scheme: str, host: str, state: HostState) -> None:
+        """Reads crawl-delay from robots.txt (outside the lock, at most once per TTL)."""
+        try:
+            resp = self.client.get(f"{scheme}://{host}/robots.txt", timeout=5.0, follow_redirects=True)
+            if resp.status_code != 200:
+                return
+            delay = parse_crawl_delay(resp.text)
+            if delay:
+                with self._cond:
+                    state.crawl_delay = float(delay)
+                logger.info(f"{host}: robots.txt crawl-delay {delay}s")
+        except Exception as e:
+            logger.debug(f"robots.txt unavailable for {host}: {e}")
+
+    def _acquire(self, host: str, deadline: Optional[Deadline] = None) -> HostState:
+        with self._cond:
+            state = self.hosts.setdefault(host, HostState())
+            while True:
+                now = time.time()
+                wait = max(state.blocked_until - now, state.last_start + state.crawl_delay - now)
+                if state.in_flight < int(state.window) and wait <= 0:
+                    state.in_flight += 1
+                    state.last_start = now
+                    state.requests += 1
+                    return state
+                timeout = wait if wait > 0 else None
+                if deadline:
+                    if deadline.remaining() <= (wait if wait > 0 else 0):
+                        raise DeadlineExceeded(f"Deadline exceeded waiting for a {host} slot")
+                    timeout = min(timeout or deadline.remaining(), deadline.remaining())
+                self._cond.wait(timeout=timeout)
+
+    def _release(self, host: str, state: HostState, latency: float,
+                 response: Optional[httpx.Response]) -> None:
+        with self._cond:
+            state.in_flight -= 1
+            status = response.status_code if response is not None else None
+            retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+            spike = (state.avg_latency is not None
+                     and latency > LATENCY_SPIKE_FACTOR * state.avg_latency
+                     and latency - state.avg_latency > LATENCY_SPIKE_MIN)
+
+            if status is None or status == 429 or status >= 500 or spike:
+                state.window = max(self.min_window, state.window * BACKOFF_FACTOR)
+                state.throttled += 1
+                logger.info(f"{host}: backing off (status={status}, {latency:.2f}s) -> window {state.window:.2f}")
+            elif status < 300:
+                # Additive increase: about +1 slot per full window of fast responses
+                state.window = min(self.max_window, state.window + 1.0 / state.window)
+
+            if retry_after is not None and status in (429, 503):
+                state.blocked_until = max(state.blocked_until, time.time() + min(retry_after, MAX_RETRY_AFTER))
+                logger.info(f"{host}: Retry-After {retry_after:.0f}s")
+
+            if status is not None and status < 400:
+                state.avg_latency = latency if state.avg_latency is None else (
+                    LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * state.avg_latency)
+
+            self._dirty += 1
+            self._cond.notify_all()
+        if self._dirty >= 50:
+            self.save()
+
+    def request(self, method: str, url: str, deadline: Optional[Deadline] = None, **kwargs) -> httpx.Response:
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+        if self.respect_robots:
+            with self._cond:
+                state = self.hosts.setdefault(host, HostState())
+                stale = time.time() - state.robots_checked_at > self.robots_ttl
+                if stale:
+                    state.robots_checked_at = time.time()
+            if stale:
+                self._check_robots(parts.scheme or "https", host, state)
+
+        state = self._acquire(host, deadline)
+        started = time.time()
+        response = None
+        try:
+            response = self.client.request(method, url, **kwargs)
+            return response
+        finally:
+            self._release(host, state, time.time() - started, response)
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("HEAD", url, **kwargs)
+
+
+_scheduler: Optional[HostScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> HostScheduler:
+    """Process-wide scheduler shared by discovery, scraping and Agent B/C fetches."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            import atexit
+            _scheduler = HostScheduler()
+            atexit.register(_scheduler.save)
+        return _scheduler
+
+
+def fetch(url: str, method: str = "GET",
+          deadline: Optional[Deadline] = None,
+          retries: int = RETRY_ATTEMPTS,
+          hedge_after: Optional[float] = HEDGE_AFTER,
+          **kwargs) -> httpx.Response:
+    """
+    Scheduled fetch with jittered retries on transient errors (within the deadline),
+    a per-host circuit breaker, and optional hedging of slow requests.
+    429/5xx responses that survive all retries are raised as HTTPStatusError.
+    """
+    scheduler = get_scheduler()
+    timeout_cap = kwargs.pop("timeout", 15.0)
+
+    def attempt() -> httpx.Response:
+        timeout = deadline.timeout(timeout_cap) if deadline else timeout_cap
+        response = scheduler.request(method, url, deadline=deadline, timeout=timeout, **kwargs)
+        if response.status_code in TRANSIENT_STATUS_CODES:
+            response.raise_for_status()
+        return response
+
+    call = attempt
+    if hedge_after:
+        call = lambda: hedged_call(attempt, hedge_after, deadline)
+    return retry_call(call, deadline, attempts=retries,
+                      breaker=get_breaker(urlsplit(url).netloc.lower()),
+                      what=f"{method} {url}")
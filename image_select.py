@@ -0,0 +1,193 @@
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from fetcher import fetch
+from media_store import mirror_url
+from resilience import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Images sent to the vision model per product
+VISION_IMAGE_COUNT = 3
+
+# Header probes: a ranged GET of the first bytes gives the file size and dimensions
+# (AUTOMATCH_IMAGE_PROBE=0 ranks on URL heuristics alone)
+IMAGE_PROBE_ENABLED = os.environ.get("AUTOMATCH_IMAGE_PROBE", "1") != "0"
+PROBE_BYTES = 16 * 1024
+PROBE_TIMEOUT = 8.0
+PROBE_WORKERS = 4
+MAX_PROBED_IMAGES = 12
+
+# Site chrome rather than product shots
+CHROME_PATTERN = re.compile(
+    r'(?<![a-z])(logo|banner|icon|sprite|button|btn|qrcode|watermark|placeholder|loading|spacer|blank)', re.I
+)
+CHROME_DIRS = ("/images/", "/skin/", "/template/", "/static/")
+PRODUCT_DIRS = ("/upfile/product/",)
+
+# Probed images smaller than this are thumbnails or decorations
+MIN_IMAGE_SIDE = 200
+MIN_IMAGE_BYTES = 8 * 1024
+# Wider (or taller) than this ratio is a banner strip, not a product shot
+MAX_ASPECT_RATIO = 3.0
+# Sizes at which the size bonus saturates
+TARGET_IMAGE_SIDE = 800
+TARGET_IMAGE_BYTES = 200 * 1024
+
+# Shots named after the product itself (".../_655730.png") beat those of neighbouring
+# products (".../_655726.png") that the page links from the same upload directory
+OWN_ID_BONUS = 2.0
+
+# Candidates scoring below this are never sent unless nothing else is usable
+MIN_USEFUL_SCORE = 0.0
+# pHash bits (of 64) within which two shots count as near-duplicates
+DUPLICATE_HASH_BITS = 6
+# Full downloads per selection, bounding the cost of skipping duplicates
+MAX_DOWNLOADS_PER_IMAGE = 2
+
+
+@dataclass
+class ImageCandidate:
+    url: str
+    position: int
+    score: float = 0.0
+    content_length: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    content: Optional[bytes] = None
+
+
+def url_score(url: str, product_id: Optional[str] = None) -> float:
+    """
+    Cheap prior from the URL alone: product upload paths and files named after
+    `product_id` up, logos/banners/site chrome down.
+    """
+    path = unquote(urlsplit(url).path).lower()
+    filename = path.rsplit("/", 1)[-1]
+    score = 0.0
+    if product_id and re.search(rf'(?<![0-9a-z]){re.escape(str(product_id).lower())}(?![0-9a-z])', filename):
+        score += OWN_ID_BONUS
+    if CHROME_PATTERN.search(filename):
+        score -= 3.0
+    if any(d in path for d in PRODUCT_DIRS):
+        score += 1.0
+    elif any(d in path for d in CHROME_DIRS):
+        score -= 1.0
+    if path.endswith((".svg", ".ico")):
+        score -= 3.0
+    elif path.endswith(".gif"):
+        score -= 0.5
+    return score
+
+
+def _probe_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    from PIL import ImageFile
+
+    parser = ImageFile.Parser()
+    try:
+        parser.feed(data)
+    except Exception:
+        return None
+    # The parser knows the size as soon as the header is in, without decoding pixels
+    return parser.image.size if parser.image is not None else None
+
+
+def probe_image(url: str, deadline: Optional[Deadline] = None) -> Tuple[Optional[int], Optional[Tuple[int, int]]]:
+    """
+    (content_length, (width, height)) from a ranged GET of the first PROBE_BYTES. Servers
+    that ignore Range send the whole file, which still answers both. Unknowns are None.
+    """
+    try:
+        response = fetch(mirror_url(url), timeout=PROBE_TIMEOUT, follow_redirects=True, deadline=deadline,
+                         retries=1, hedge_after=None, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"})
+    except Exception as e:
+        logger.debug(f"Probe failed for {url}: {e}")
+        return None, None
+    if response.status_code not in (200, 206):
+        return None, None
+    total = None
+    content_range = response.headers.get("content-range", "")
+    if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+        total = int(content_range.rsplit("/", 1)[1])
+    elif response.status_code == 200:
+        total = len(response.content)
+    return total, _probe_dimensions(response.content)
+
+
+def _size_score(candidate: ImageCandidate) -> float:
+    score = 0.0
+    if candidate.width and candidate.height:
+        short, long = sorted((candidate.width, candidate.height))
+        if short < MIN_IMAGE_SIDE or long / short > MAX_ASPECT_RATIO:
+            score -= 2.0
+        else:
+            score += min(1.0, short / TARGET_IMAGE_SIDE)
+    if candidate.content_length is not None:
+        if candidate.content_length < MIN_IMAGE_BYTES:
+            score -= 1.0
+        else:
+            score += 0.5 * min(1.0, candidate.content_length / TARGET_IMAGE_BYTES)
+    return score
+
+
+def rank_images(urls: List[str], deadline: Optional[Deadline] = None,
+                probe: bool = IMAGE_PROBE_ENABLED,
+                product_id: Optional[str] = None) -> List[ImageCandidate]:
+    """
+    Orders image URLs most informative first: URL heuristics, then (for the top
+    MAX_PROBED_IMAGES) file size and dimensions from header probes. Ties keep page order.
+    Nothing is dropped; unlikely product shots just sort last.
+    """
+    candidates = [ImageCandidate(url, i, url_score(url, product_id)) for i, url in enumerate(dict.fromkeys(urls))]
+    if probe and candidates:
+        to_probe = sorted(candidates, key=lambda c: (-c.score, c.position))[:MAX_PROBED_IMAGES]
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(to_probe))) as pool:
+            results = list(pool.map(lambda c: probe_image(c.url, deadline), to_probe))
+        for candidate, (length, size) in zip(to_probe, results):
+            candidate.content_length = length
+            if size:
+                candidate.width, candidate.height = size
+            candidate.score += _size_score(candidate)
+    return sorted(candidates, key=lambda c: (-c.score, c.position))
+
+
+def select_images(urls: List[str], k: int = VISION_IMAGE_COUNT,
+                  deadline: Optional[Deadline] = None,
+                  probe: bool = IMAGE_PROBE_ENABLED,
+                  product_id: Optional[str] = None) -> List[ImageCandidate]:
+    """
+    The k most informative, mutually distinct images, with their downloaded bytes in
+    `content`. Near-duplicate shots (pHash within DUPLICATE_HASH_BITS) are skipped;
+    low-scoring candidates are only used when nothing better loads. Pass probe=False
+    for URLs already ranked at scrape time, so their stored order breaks ties.
+    """
+    import numpy as np
+    from image_verify import image_array, perceptual_hashes
+
+    ranked = rank_images(urls, deadline, probe=probe, product_id=product_id)
+    useful = [c for c in ranked if c.score >= MIN_USEFUL_SCORE] or ranked
+    chosen: List[ImageCandidate] = []
+    hashes = []
+    for candidate in useful[:k * MAX_DOWNLOADS_PER_IMAGE]:
+        if len(chosen) >= k:
+            break
+        try:
+            response = fetch(mirror_url(candidate.url), timeout=10.0, follow_redirects=True, deadline=deadline)
+            response.raise_for_status()
+            bits = perceptual_hashes(image_array(response.content)[None])[0]
+        except Exception as e:
+            logger.warning(f"Error fetching image {candidate.url}: {e}")
+            continue
+        if any(np.count_nonzero(bits != h) <= DUPLICATE_HASH_BITS for h in hashes):
+            logger.info(f"Skipping near-duplicate image {candidate.url}")
+            continue
+        candidate.content = response.content
+        chosen.append(candidate)
+        hashes.append(bits)
+    logger.info(f"Selected {len(chosen)} of {len(ranked)} images")
+    return chosen
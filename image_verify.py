@@ -0,0 +1,262 @@
+import io
+import logging
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from agent_d import REVIEW_CONFIDENCE_THRESHOLD
+from fetcher import fetch
+from media_store import mirror_url
+from resilience import Deadline
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Images are compared at this resolution (pHash uses a 32x32 grayscale DCT)
+IMAGE_SIZE = 64
+HASH_SIZE = 8
+COLOR_BINS = 4          # per channel -> 64-bin RGB histogram
+EDGE_BINS = 8           # gradient orientations over 0..pi
+EDGE_CELLS = 4          # per side -> 4x4 grid of orientation histograms
+# Product shots sit on a plain backdrop: pixels further than this (0..1 per
+# channel) from the border colour are the product, and images are cropped to them
+BACKGROUND_TOLERANCE = 0.1
+# Borders noisier than this are a photo background, which is left uncropped
+MAX_BORDER_STD = 0.05
+MAX_SUPPLIER_IMAGES = 4
+
+# Weights of the per-feature similarities in the combined image score. The spatial
+# edge layout survives rescaling and recompression best; pHash flips bits on small
+# crop differences and colour cannot tell same-coloured objects apart
+SIMILARITY_WEIGHTS = {"phash": 0.3, "color": 0.2, "edges": 0.5}
+
+# Decision thresholds on the combined image similarity (0..1). pHash and edges are
+# chance-corrected, so unrelated images score near 0 on both. Calibrated on
+# synthetic packshots (tests/test_image_verify.py): unrelated shapes and noise
+# pairs score 0.0-0.3; the same product smaller, shifted, recompressed or on a
+# grey backdrop scores 0.75-1.0; on a photo backdrop (left uncropped) about 0.65.
+ACCEPT_SIMILARITY = 0.7
+REJECT_SIMILARITY = 0.4
+# Image agreement alone never accepts a match the model was unsure about
+MIN_ACCEPT_CONFIDENCE = 0.5
+
+VERIFICATION_ACCEPTED = "accepted"
+VERIFICATION_REJECTED = "rejected"
+VERIFICATION_INCONCLUSIVE = "inconclusive"
+VERIFICATION_SKIPPED = "skipped"
+
+# Official fields cleared when a match is rejected, so the export falls back to supplier data
+OFFICIAL_FIELDS = [
+    "official_page_url",
+    "official_brand",
+    "official_product_name",
+    "official_sku",
+    "official_price",
+    "official_currency",
+    "official_main_image_url",
+]
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> "np.ndarray":
+    """Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T."""
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+def load_image(url: str, deadline: Optional[Deadline] = None) -> "Optional[np.ndarray]":
+    """Fetches an image and returns it as a (IMAGE_SIZE, IMAGE_SIZE, 3) float array in 0..1."""
+    url = mirror_url(url)
+    try:
+        response = fetch(url, timeout=15.0, follow_redirects=True, deadline=deadline)
+        response.raise_for_status()
+        return image_array(response.content)
+    except Exception as e:
+        logger.warning(f"Could not load image {url}: {e}")
+        return None
+
+
+def image_array(content: bytes) -> "np.ndarray":
+    """Decodes image bytes to a (IMAGE_SIZE, IMAGE_SIZE, 3) float array in 0..1."""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as img:
+        img = _crop_to_product(img.convert("RGB"))
+        img = img.resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def _crop_to_product(img: "Image.Image") -> "Image.Image":
+    """
+    Crops a product shot on a plain backdrop to a square around the product, so
+    the same item photographed smaller or off-centre lines up with its packshot.
+    """
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(img, dtype=np.float32) / 255.0
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    if border.std(axis=0).max() > MAX_BORDER_STD:
+        return img
+    background = np.median(border, axis=0)
+    rows, cols = np.nonzero(np.abs(pixels - background).max(axis=2) > BACKGROUND_TOLERANCE)
+    if rows.size == 0:
+        return img
+    top, bottom, left, right = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+    side = max(bottom - top, right - left)
+    square = Image.new("RGB", (side, side), tuple(int(round(c * 255)) for c in background))
+    square.paste(img.crop((left, top, right, bottom)), ((side - (right - left)) // 2, (side - (bottom - top)) // 2))
+    return square
+
+
+def _grayscale(images: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+    return images @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def perceptual_hashes(images: "np.ndarray") -> "np.ndarray":
+    """pHash for a batch of (n, H, W, 3) images: (n, HASH_SIZE**2) bool bits."""
+    import numpy as np
+
+    gray = _grayscale(images)
+    n, h, w = gray.shape
+    # Box-downsample to 32x32, then 2-D DCT of every image at once
+    small = gray.reshape(n, 32, h // 32, 32, w // 32).mean(axis=(2, 4))
+    dct32 = _dct_matrix(32)
+    dct = dct32 @ small @ dct32.T
+    low = dct[:, :HASH_SIZE, :HASH_SIZE].reshape(n, -1)
+    # The DC term only encodes overall brightness; exclude it from the median
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return low > median
+
+
+def color_histograms(images: "np.ndarray") -> "np.ndarray":
+    """Normalized joint RGB histograms, (n, COLOR_BINS**3)."""
+    import numpy as np
+
+    n = images.shape[0]
+    q = np.minimum((images * COLOR_BINS).astype(np.int64), COLOR_BINS - 1)
+    bins = (q[..., 0] * COLOR_BINS + q[..., 1]) * COLOR_BINS + q[..., 2]
+    offsets = (np.arange(n) * COLOR_BINS ** 3)[:, None]
+    counts = np.bincount((bins.reshape(n, -1) + offsets).ravel(), minlength=n * COLOR_BINS ** 3)
+    hist = counts.reshape(n, -1).astype(np.float64)
+    return hist / hist.sum(axis=1, keepdims=True)
+
+
+def edge_histograms(images: "np.ndarray") -> "np.ndarray":
+    """
+    Magnitude-weighted gradient-orientation histograms per cell of an EDGE_CELLS
+    grid, (n, EDGE_CELLS**2 * EDGE_BINS), mean-centred and L2-normalized so that
+    unrelated images (and texture like noise) score around zero.
+    """
+    import numpy as np
+
+    gray = _grayscale(images)
+    n, h, w = gray.shape
+    gy, gx = np.gradient(gray, axis=(1, 2))
+    magnitude = np.hypot(gx, gy)
+    # Orientation modulo pi: an edge and its reversed contrast count the same
+    angle = np.mod(np.arctan2(gy, gx), np.pi)
+    bins = np.minimum((angle / np.pi * EDGE_BINS).astype(np.int64), EDGE_BINS - 1)
+    cell_row = (np.arange(h) * EDGE_CELLS // h)[:, None]
+    cell_col = (np.arange(w) * EDGE_CELLS // w)[None, :]
+    bins = bins + ((cell_row * EDGE_CELLS + cell_col) * EDGE_BINS)[None]
+    size = EDGE_CELLS ** 2 * EDGE_BINS
+    offsets = (np.arange(n) * size)[:, None, None]
+    hist = np.bincount((bins + offsets).ravel(), weights=magnitude.ravel(), minlength=n * size)
+    hist = hist.reshape(n, size)
+    hist -= hist.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(hist, axis=1, keepdims=True)
+    return hist / np.where(norm > 0, norm, 1.0)
+
+
+def similarity_scores(reference: "np.ndarray", candidates: "np.ndarray") -> "Dict[str, np.ndarray]":
+    """
+    Compares one reference image (H, W, 3) against a batch of candidates (n, H, W, 3).
+    Returns per-feature similarities (each shape (n,), 0..1) plus the weighted "combined".
+    """
+    import numpy as np
+
+    batch = np.concatenate([reference[None], candidates])
+    hashes = perceptual_hashes(batch)
+    colors = color_histograms(batch)
+    edges = edge_histograms(batch)
+
+    scores = {
+        # Unrelated hashes agree on half their bits by chance; rescale so that is 0
+        "phash": np.clip(1.0 - 2.0 * (hashes[1:] != hashes[0]).mean(axis=1), 0.0, 1.0),
+        "color": np.minimum(colors[1:], colors[0]).sum(axis=1),  # histogram intersection
+        "edges": np.clip(edges[1:] @ edges[0], 0.0, 1.0),        # cosine
+    }
+    scores["combined"] = sum(SIMILARITY_WEIGHTS[k] * scores[k] for k in SIMILARITY_WEIGHTS)
+    return scores
+
+
+def supplier_image_urls(raw: Dict[str, Any], limit: int = MAX_SUPPLIER_IMAGES) -> List[str]:
+    """Supplier images to compare, skipping logos like the export's main-image choice."""
+    images = [img for img in raw.get("image_urls") or [] if "logo" not in img.lower()]
+    return images[:limit]
+
+
+def decide(similarity: Optional[float], match_found: bool, confidence: float) -> str:
+    """Combines the image similarity with the model's match confidence."""
+    if similarity is None or not match_found:
+        return VERIFICATION_SKIPPED
+    if similarity >= ACCEPT_SIMILARITY and confidence >= MIN_ACCEPT_CONFIDENCE:
+        return VERIFICATION_ACCEPTED
+    if similarity <= REJECT_SIMILARITY and confidence < REVIEW_CONFIDENCE_THRESHOLD:
+        return VERIFICATION_REJECTED
+    return VERIFICATION_INCONCLUSIVE
+
+
+def verify_match(raw: Dict[str, Any], match: Dict[str, Any],
+                 deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Compares the official main image with the supplier images and returns a copy of
+    `match` with `image_similarity` (best combined score over supplier images) and
+    `verification`. Rejected matches are turned into "no match" with the official
+    fields cleared; accepted ones skip human review in the export.
+    """
+    import numpy as np
+
+    result = dict(match)
+    result["image_similarity"] = None
+    result["verification"] = VERIFICATION_SKIPPED
+
+    official_url = match.get("official_main_image_url")
+    supplier_urls = supplier_image_urls(raw)
+    if not match.get("match_found") or not official_url or not supplier_urls:
+        return result
+
+    reference = load_image(official_url, deadline)
+    if reference is None:
+        return result
+    candidates = [img for img in (load_image(url, deadline) for url in supplier_urls) if img is not None]
+    if not candidates:
+        return result
+
+    scores = similarity_scores(reference, np.stack(candidates))
+    best = int(np.argmax(scores["combined"]))
+    similarity = round(float(scores["combined"][best]), 4)
+    verification = decide(similarity, True, float(match.get("match_confidence") or 0.0))
+    result["image_similarity"] = similarity
+    result["verification"] = verification
+
+    logger.info(f"Image check for {raw.get('product_internal_id')}: similarity {similarity} "
+                f"(phash {scores['phash'][best]:.2f}, color {scores['color'][best]:.2f}, "
+                f"edges {scores['edges'][best]:.2f}) -> {verification}")
+
+    if verification == VERIFICATION_REJECTED:
+        note = f"Image verification rejected {match.get('official_page_url')} (similarity {similarity})"
+        result["notes"] = f"{match.get('notes', '')} {note}".strip()
+        result["match_found"] = False
+        for key in OFFICIAL_FIELDS:
+            result[key] = None
+    return result
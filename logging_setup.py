@@ -0,0 +1,11 @@
+import logging
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """
+    Configures root logging once. Called only from entry points (`__main__`),
+    never at import time, so library modules stay side-effect free.
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
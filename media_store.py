@@ -0,0 +1,172 @@
+import hashlib
+import io
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Optional
+from fetcher import fetch
+from resilience import Deadline
+
+logger = logging.getLogger(__name__)
+
+MEDIA_ROOT = Path("media")
+# Stable URL prefix written into exports; the dashboard serves it from MEDIA_ROOT
+MEDIA_URL_PREFIX = "/media/"
+THUMBNAIL_SIZES = (128, 256, 512)
+
+# Dead supplier CDN hosts and their working mirrors (same paths on both)
+HOST_REWRITES = {
+    "https://pic.qiqi2000.com/": "https://bags.qiqiyg.com/",
+}
+
+
+def mirror_url(url: str) -> str:
+    """Rewrites a URL on a dead supplier host to its working mirror."""
+    for dead, mirror in HOST_REWRITES.items():
+        if url.startswith(dead):
+            return mirror + url[len(dead):]
+    return url
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+
+MAGIC_EXTENSIONS = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF8", ".gif"),
+    (b"RIFF", ".webp"),
+]
+
+
+def url_key(url: str) -> str:
+    """Key of a source URL in the store (the dashboard computes the same SHA-1)."""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def guess_extension(content: bytes, content_type: Optional[str]) -> str:
+    for magic, ext in MAGIC_EXTENSIONS:
+        if content.startswith(magic):
+            return ext
+    if content_type:
+        return CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower(), ".bin")
+    return ".bin"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+class MediaStore:
+    """
+    Content-addressed mirror of product images:
+
+        media/objects/ab/<sha256>.<ext>        original bytes, stored once
+        media/thumbs/<size>/ab/<sha256>.jpg    fixed-size thumbnails
+        media/urls/<sha1(source url)>.json     source URL -> object reference
+
+    Reference files are written independently per URL, so several workers can
+    mirror into the same store without a shared index.
+    """
+
+    def __init__(self, root: Path = MEDIA_ROOT, thumbnail_sizes: Iterable[int] = THUMBNAIL_SIZES):
+        self.root = Path(root)
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.stats = {"mirrored": 0, "cached": 0, "deduplicated": 0, "failed": 0}
+
+    def object_path(self, name: str) -> Path:
+        return self.root / "objects" / name[:2] / name
+
+    def thumbnail_path(self, name: str, size: int) -> Path:
+        return self.root / "thumbs" / str(size) / name[:2] / f"{Path(name).stem}.jpg"
+
+    def local_url(self, name: str) -> str:
+        return f"{MEDIA_URL_PREFIX}objects/{name[:2]}/{name}"
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Local URL for an already mirrored source URL, or None."""
+        ref_path = self.root / "urls" / f"{url_key(url)}.json"
+        if not ref_path.exists():
+            return None
+        try:
+            name = json.loads(ref_path.read_text(encoding="utf-8"))["object"]
+        except (ValueError, KeyError):
+            return None
+        return self.local_url(name) if self.object_path(name).exists() else None
+
+    def _link(self, url: str, name: str, content_type: Optional[str]) -> None:
+        ref = {
+            "url": url,
+            "object": name,
+            "content_type": content_type,
+            "mirrored_at": datetime.now(timezone.utc).isoformat(),
+        }
+        _write_atomic(self.root / "urls" / f"{url_key(url)}.json", json.dumps(ref).encode("utf-8"))
+
+    def _make_thumbnails(self, name: str, content: bytes) -> None:
+        try:
+            from PIL import Image
+        except ImportError:
+            logger.warning("Pillow not installed; skipping thumbnails")
+            return
+        try:
+            with Image.open(io.BytesIO(content)) as img:
+                img = img.convert("RGB")
+                for size in self.thumbnail_sizes:
+                    path = self.thumbnail_path(name, size)
+                    if path.exists():
+                        continue
+                    thumb = img.copy()
+                    thumb.thumbnail((size, size))
+                    buf = io.BytesIO()
+                    thumb.save(buf, format="JPEG", quality=85, optimize=True)
+                    _write_atomic(path, buf.getvalue())
+        except Exception as e:
+            logger.warning(f"Could not create thumbnails for {name}: {e}")
+
+    def mirror(self, url: str, aliases: Iterable[str] = (), deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        Downloads `url` into the store (once per distinct content) and returns its
+        stable local URL. `aliases` are extra keys (e.g. the official page URL)
+        that resolve to the same object. Returns None if the image can't be fetched.
+        """
+        if not url:
+            return None
+        cached = self.lookup(url)
+        if cached:
+            self.stats["cached"] += 1
+            for alias in aliases:
+                self._link(alias, Path(cached).name, None)
+            return cached
+
+        try:
+            response = fetch(mirror_url(url), timeout=15.0, follow_redirects=True, deadline=deadline)
+            response.raise_for_status()
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Could not mirror {url}: {e}")
+            return None
+
+        content = response.content
+        content_type = response.headers.get("content-type")
+        name = hashlib.sha256(content).hexdigest() + guess_extension(content, content_type)
+        path = self.object_path(name)
+        if path.exists():
+            self.stats["deduplicated"] += 1
+        else:
+            _write_atomic(path, content)
+            self.stats["mirrored"] += 1
+            self._make_thumbnails(name, content)
+
+        for key in (url, *aliases):
+            self._link(key, name, content_type)
+        return self.local_url(name)
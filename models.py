@@ -1,8 +1,27 @@
-from dataclasses import dataclass, field, asdict
-from typing import List, Optional
+import sys
+import typing
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Iterable, Optional, Tuple
 from datetime import datetime
+from urllib.parse import urlsplit
 
-@dataclass
+# Records are slotted (no per-instance __dict__) and frozen so millions of them stay
+# small and can be shared safely. Low-cardinality strings are interned so equal
+# values share one object.
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def url_host(url: Optional[str]) -> Optional[str]:
+    """Interned lowercase host of a URL."""
+    if not url:
+        return None
+    return sys.intern(urlsplit(url).netloc.lower())
+
+
+@dataclass(slots=True, frozen=True)
 class RawProductRecord:
     product_url: str
     category_id: Optional[str] = None
@@ -10,25 +29,142 @@ class RawProductRecord:
     title: Optional[str] = None
     description: Optional[str] = None
     price: Optional[str] = None
-    image_urls: List[str] = field(default_factory=list)
+    image_urls: Tuple[str, ...] = field(default_factory=tuple)
     scraped_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
 
-    def to_json(self):
-        return asdict(self)
+    def __post_init__(self):
+        object.__setattr__(self, "category_id", _intern(self.category_id))
+        if not isinstance(self.image_urls, tuple):
+            object.__setattr__(self, "image_urls", tuple(self.image_urls))
+
+    @property
+    def host(self) -> Optional[str]:
+        return url_host(self.product_url)
+
+    def to_json(self) -> Dict[str, Any]:
+        # Same layout as dataclasses.asdict, without its recursive deep copy
+        return {
+            "product_url": self.product_url,
+            "category_id": self.category_id,
+            "internal_id": self.internal_id,
+            "title": self.title,
+            "description": self.description,
+            "price": self.price,
+            "image_urls": list(self.image_urls),
+            "scraped_at": self.scraped_at,
+        }
 
-@dataclass
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "RawProductRecord":
+        """Builds a record from to_json() output or a checkpoint "raw" block (extra keys ignored)."""
+        return cls(**{k: data[k] for k in _RAW_FIELDS if k in data})
+
+
+@dataclass(slots=True, frozen=True)
 class OfficialMatchResult:
     product_internal_id: str
-    match_found: bool
-    match_confidence: float
-    official_page_url: Optional[str] = None
-    official_brand: Optional[str] = None
-    official_product_name: Optional[str] = None
-    official_sku: Optional[str] = None
-    official_price: Optional[str] = None
-    official_currency: Optional[str] = None
-    official_main_image_url: Optional[str] = None
+    # Facts only a search-grounded call may produce, never a text-only repair: a broken
+    # verdict fails the product, a broken official_* field is left null
+    match_found: bool = field(metadata={"grounded": True})
+    match_confidence: float = field(metadata={"minimum": 0.0, "maximum": 1.0, "grounded": True})
+    official_page_url: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_brand: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_product_name: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_sku: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_price: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_currency: Optional[str] = field(default=None, metadata={"grounded": True})
+    official_main_image_url: Optional[str] = field(default=None, metadata={"grounded": True})
     notes: str = ""
+    # Set by image_verify.py: combined image similarity and accepted/rejected/inconclusive/skipped
+    image_similarity: Optional[float] = field(default=None, metadata={"model_output": False})
+    verification: Optional[str] = field(default=None, metadata={"model_output": False})
+
+    def __post_init__(self):
+        object.__setattr__(self, "official_brand", _intern(self.official_brand))
+        object.__setattr__(self, "official_currency", _intern(self.official_currency))
+        object.__setattr__(self, "verification", _intern(self.verification))
+
+    @property
+    def host(self) -> Optional[str]:
+        return url_host(self.official_page_url)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in _MATCH_FIELDS}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "OfficialMatchResult":
+        return cls(**{k: data[k] for k in _MATCH_FIELDS if k in data})
+
+
+@dataclass(slots=True, frozen=True)
+class InferenceResult:
+    """Agent B output."""
+    product_internal_id: str
+    inferred_brand: Optional[str] = None
+    inferred_category: Optional[str] = None
+    inferred_product_name: Optional[str] = None
+    search_queries: Tuple[str, ...] = field(default_factory=tuple, metadata={"min_items": 1})
+    notes: str = ""
+
+    def __post_init__(self):
+        object.__setattr__(self, "inferred_brand", _intern(self.inferred_brand))
+        if not isinstance(self.search_queries, tuple):
+            object.__setattr__(self, "search_queries", tuple(self.search_queries))
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in _INFERENCE_FIELDS}
+        data["search_queries"] = list(self.search_queries)
+        return data
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "InferenceResult":
+        return cls(**{k: data[k] for k in _INFERENCE_FIELDS if k in data})
+
+
+_RAW_FIELDS = tuple(f.name for f in fields(RawProductRecord))
+_MATCH_FIELDS = tuple(f.name for f in fields(OfficialMatchResult))
+_INFERENCE_FIELDS = tuple(f.name for f in fields(InferenceResult))
+
+_SCHEMA_TYPES = {str: "STRING", float: "NUMBER", int: "INTEGER", bool: "BOOLEAN"}
+
+
+def field_schema(annotation: Any, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Model-API (OpenAPI subset) schema for one dataclass field annotation."""
+    metadata = metadata or {}
+    args = typing.get_args(annotation)
+    if typing.get_origin(annotation) is typing.Union and type(None) in args:
+        inner = [a for a in args if a is not type(None)][0]
+        return {**field_schema(inner, metadata), "nullable": True}
+    if typing.get_origin(annotation) in (tuple, list):
+        schema = {"type": "ARRAY", "items": field_schema(args[0])}
+        if "min_items" in metadata:
+            schema["min_items"] = metadata["min_items"]
+        return schema
+    schema = {"type": _SCHEMA_TYPES[annotation]}
+    for key in ("minimum", "maximum"):
+        if key in metadata:
+            schema[key] = metadata[key]
+    return schema
+
+
+def output_fields(cls: type, only: Optional[Iterable[str]] = None) -> Tuple[Any, ...]:
+    """Dataclass fields the model is asked to produce (optionally restricted to `only`)."""
+    only = set(only) if only is not None else None
+    return tuple(
+        f for f in fields(cls)
+        if f.metadata.get("model_output", True) and (only is None or f.name in only)
+    )
+
 
-    def to_json(self):
-        return asdict(self)
+def json_schema(cls: type, only: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Response schema for structured model output, derived from a model dataclass.
+    Every field is required (nullable ones may be null) so nothing is silently dropped.
+    """
+    selected = output_fields(cls, only)
+    return {
+        "type": "OBJECT",
+        "properties": {f.name: field_schema(f.type, f.metadata) for f in selected},
+        "required": [f.name for f in selected],
+        "property_ordering": [f.name for f in selected],
+    }
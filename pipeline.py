@@ -8,45 +8,73 @@ from scraper import extract_product_detail
 from agent_b import AgentB
 from agent_c import AgentC
 from agent_d import append_product_row
+from fetcher import fetch
+import codec
+from resilience import CircuitOpenError, product_deadline
+from priority import PriorityConfig, RunBudget, candidate_from_url, log_schedule, rank
+import profiling
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def get_targeted_urls(listing_url, limit=3):
+    """Product links on a listing page, in page order (all of them when limit is None)."""
     logger.info(f"Fetching listing: {listing_url}")
-    response = httpx.get(listing_url, timeout=15)
+    response = fetch(listing_url, timeout=15)
     soup = BeautifulSoup(response.text, 'html.parser')
     info_pattern = re.compile(r'productinfoen_\d+\.html\?path=0_\d+')
     urls = []
     for a in soup.find_all('a', href=True):
         if info_pattern.search(a['href']):
             full_url = str(httpx.URL(listing_url).join(a['href']))
-            urls.append(full_url)
-            if len(urls) >= limit:
+            if full_url not in urls:
+                urls.append(full_url)
+            if limit is not None and len(urls) >= limit:
                 break
     return urls
 
-def run_pipeline(listing_url, limit=3):
+def run_pipeline(listing_url, limit=3, budget: RunBudget = None, priority_config: PriorityConfig = None):
     logger.info(f"Starting pipeline for {limit} items from {listing_url}...")
     
-    product_urls = get_targeted_urls(listing_url, limit)
+    # Rank every product on the listing and take the highest-priority ones
+    with profiling.stage("discover"):
+        ranked = rank((candidate_from_url(u) for u in get_targeted_urls(listing_url, limit=None)),
+                      priority_config or PriorityConfig.load())
+    log_schedule(ranked)
+    product_urls = [c.key for c in ranked[:limit]]
+    budget = budget or RunBudget()
     
     agent_b = AgentB()
     agent_c = AgentC()
     
     for i, url in enumerate(product_urls):
+        stop_reason = budget.exhausted(agent_b.usage.calls)
+        if stop_reason:
+            logger.info(f"Stopping: {stop_reason}; {len(product_urls) - i} products left for the next run")
+            break
         logger.info(f"--- Processing Product {i+1}/{len(product_urls)}: {url} ---")
         
+        # Per-product time budget shared by the scrape and inference stages
+        deadline = budget.cap(product_deadline(["scrape", "infer"]))
+
         # Agent A: Scrape
-        raw_record = extract_product_detail(url)
+        with profiling.stage("scrape"):
+            raw_record = extract_product_detail(url, deadline=deadline.for_stage("scrape", ["scrape", "infer"]))
         if not raw_record:
             continue
         raw_json = raw_record.to_json()
         
         # Agent B: Inference
         raw_json["product_internal_id"] = raw_json.get("internal_id")
-        inference_record = agent_b.process_product(raw_json)
+        try:
+            with profiling.stage("infer"):
+                inference_record = agent_b.process_product(raw_json, deadline=deadline)
+        except CircuitOpenError as e:
+            logger.error(f"Stopping: {e}; {len(product_urls) - i} products left for the next run")
+            break
+        except Exception as e:
+            # No checkpoint, so the product is picked up again by the next run
+            logger.error(f"Agent B failed for {url}: {e}")
+            continue
         
         # Agent C Search & Match
         # I will perform the search using the first query from Agent B
@@ -67,12 +95,32 @@ def run_pipeline(listing_url, limit=3):
         }
         
         checkpoint_file = f"checkpoint_{raw_json['product_internal_id']}.json"
-        with open(checkpoint_file, "w") as f:
-            json.dump(checkpoint, f, indent=2)
+        with profiling.stage("checkpoint"):
+            codec.dump_file(checkpoint_file, checkpoint)
             
         logger.info(f"Saved checkpoint for Agent C: {checkpoint_file}")
 
+    agent_b.close()
+    agent_c.close()
+    logger.info(f"Agent B token usage: {agent_b.usage.as_dict()}")
+
 if __name__ == "__main__":
-    # Targeted Marc Jacobs listing
-    target_listing = "https://bags.qiqiyg.com/producten_44188_0.html?path=0_37771_44188"
-    run_pipeline(target_listing, limit=3)
+    import argparse
+    from datetime import datetime, timezone
+    from logging_setup import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Scrape and infer products from a listing into checkpoints")
+    parser.add_argument("--profile", action="store_true", help="Write cProfile, allocation and sampled-stack reports to profiles/<run_id>/")
+    # Targeted Marc Jacobs listing by default
+    parser.add_argument("--listing", default="https://bags.qiqiyg.com/producten_44188_0.html?path=0_37771_44188")
+    parser.add_argument("--limit", type=int, default=3, help="Highest-priority products to process")
+    parser.add_argument("--time-budget", type=float, help="Stop starting new products after this many seconds")
+    parser.add_argument("--call-budget", type=int, help="Stop starting new products after this many model calls")
+    parser.add_argument("--priority-config", help="JSON file of scheduling weights (default: priority.json if present)")
+    args = parser.parse_args()
+
+    run_id = datetime.now(timezone.utc).strftime("pipeline-%Y%m%dT%H%M%S")
+    with profiling.maybe_profile(args.profile, run_id):
+        run_pipeline(args.listing, limit=args.limit,
+                     budget=RunBudget(args.time_budget, args.call_budget),
+                     priority_config=PriorityConfig.load(args.priority_config))
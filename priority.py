@@ -0,0 +1,172 @@
+import json
+import logging
+import math
+import re
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import codec
+from agent_d import normalize_price_text
+from resilience import Deadline
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CONFIG_PATH = Path("priority.json")
+
+PRODUCT_ID_PATTERN = re.compile(r'productinfoen_(\d+)')
+CATEGORY_PATH_PATTERN = re.compile(r'path=0_([\d_]+)')
+# Notes of the error records older runs stored in place of a failed match
+ERROR_NOTE_PREFIX = "Error during"
+
+
+@dataclass
+class PriorityConfig:
+    """
+    Weights of the scheduling signals, optionally loaded from priority.json:
+
+        {"category_weights": {"44188": 2.0, "37771": 0.5}, "matched_penalty": 2.0}
+
+    Category weights scale a product's score; price and freshness (newer, higher IDs
+    first) are normalized to 0..1 within the batch; products matched in an earlier
+    run are pushed back by `matched_penalty`.
+    """
+    category_weights: Dict[str, float] = field(default_factory=dict)
+    default_category_weight: float = 1.0
+    price_weight: float = 1.0
+    freshness_weight: float = 1.0
+    matched_penalty: float = 1.5
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "PriorityConfig":
+        path = Path(path or PRIORITY_CONFIG_PATH)
+        if not path.exists():
+            return cls()
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: expected a JSON object of priority weights")
+        known = [f.name for f in fields(cls)]
+        unknown = sorted(set(data) - set(known))
+        if unknown:
+            raise ValueError(f"{path}: unknown priority setting(s) {', '.join(unknown)}; "
+                             f"expected any of {', '.join(known)}")
+        config = cls(**data)
+        config.category_weights = {str(k): float(v) for k, v in config.category_weights.items()}
+        return config
+
+
+@dataclass
+class Candidate:
+    """One unit of work (a checkpoint file or product URL) and its scheduling signals."""
+    key: str
+    product_id: Optional[int] = None
+    category_id: Optional[str] = None
+    price: Optional[float] = None
+    matched_before: bool = False
+    score: float = 0.0
+
+
+def parse_price(price_text: Optional[str]) -> Optional[float]:
+    try:
+        return float(normalize_price_text(price_text))
+    except ValueError:
+        return None
+
+
+def _int_id(value: Optional[str]) -> Optional[int]:
+    return int(value) if value and str(value).isdigit() else None
+
+
+def matched_before(product_id: Optional[str]) -> bool:
+    """True if an earlier run stored a successful match (not an error record or a no-match)."""
+    if not product_id:
+        return False
+    match_file = Path(f"match_{product_id}.json")
+    if not match_file.exists():
+        return False
+    try:
+        match = codec.load_file(match_file)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable {match_file}: {e}")
+        return False
+    return bool(match.get("match_found")) and not str(match.get("notes") or "").startswith(ERROR_NOTE_PREFIX)
+
+
+def candidate_from_checkpoint(cp_file: str, raw: Dict) -> Candidate:
+    product_id = raw.get("product_internal_id")
+    return Candidate(
+        key=cp_file,
+        product_id=_int_id(product_id),
+        category_id=raw.get("category_id"),
+        price=parse_price(raw.get("raw_price_text")),
+        matched_before=matched_before(product_id),
+    )
+
+
+def candidate_from_url(url: str) -> Candidate:
+    """Signals available before scraping: ID, category (last path segment) and prior runs."""
+    id_match = PRODUCT_ID_PATTERN.search(url)
+    path_match = CATEGORY_PATH_PATTERN.search(url)
+    product_id = id_match.group(1) if id_match else None
+    return Candidate(
+        key=url,
+        product_id=_int_id(product_id),
+        category_id=path_match.group(1).split("_")[-1] if path_match else None,
+        matched_before=matched_before(product_id),
+    )
+
+
+def rank(candidates: Iterable[Candidate], config: Optional[PriorityConfig] = None) -> List[Candidate]:
+    """Scores candidates and returns them highest priority first (ties: newer ID first)."""
+    config = config or PriorityConfig()
+    candidates = list(candidates)
+    ids = [c.product_id for c in candidates if c.product_id is not None]
+    prices = [c.price for c in candidates if c.price is not None and c.price > 0]
+    min_id, max_id = (min(ids), max(ids)) if ids else (0, 0)
+    max_log_price = math.log1p(max(prices)) if prices else 0.0
+
+    for c in candidates:
+        # Unknown signals score neutrally rather than first or last
+        freshness = 0.5
+        if c.product_id is not None and max_id > min_id:
+            freshness = (c.product_id - min_id) / (max_id - min_id)
+        price = 0.5
+        if c.price is not None and max_log_price > 0:
+            price = math.log1p(max(c.price, 0.0)) / max_log_price
+        weight = config.category_weights.get(str(c.category_id), config.default_category_weight)
+        c.score = weight * (config.price_weight * price + config.freshness_weight * freshness)
+        if c.matched_before:
+            c.score -= config.matched_penalty
+
+    return sorted(candidates, key=lambda c: (-c.score, -(c.product_id or 0)))
+
+
+class RunBudget:
+    """
+    Wall-clock and/or model-call budget for a whole run. Checked between products, so
+    a run stops cleanly after the product in flight instead of being cut off mid-write.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, max_model_calls: Optional[int] = None):
+        self.deadline = Deadline(seconds) if seconds else None
+        self.max_model_calls = max_model_calls
+
+    def exhausted(self, model_calls: int = 0) -> Optional[str]:
+        """Why the run must stop, or None while budget remains."""
+        if self.deadline is not None and self.deadline.expired():
+            return f"time budget of {self.deadline.budget:g}s reached"
+        if self.max_model_calls is not None and model_calls >= self.max_model_calls:
+            return f"model-call budget of {self.max_model_calls} reached"
+        return None
+
+    def cap(self, deadline: Deadline) -> Deadline:
+        """A product deadline that doesn't outlive the run's time budget."""
+        if self.deadline is None or deadline.remaining() <= self.deadline.remaining():
+            return deadline
+        return Deadline(self.deadline.remaining())
+
+
+def log_schedule(ranked: List[Candidate], top: int = 5) -> None:
+    for c in ranked[:top]:
+        logger.info(f"Priority {c.score:.3f}: {c.key} (category {c.category_id}, price {c.price}, "
+                    f"matched before: {c.matched_before})")
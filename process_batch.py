@@ -7,10 +7,12 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from agent_c import AgentC
-from agent_d import append_product_row
+from agent_d import DeltaExport, append_product_row
+from resilience import CircuitOpenError, product_deadline
+from priority import PriorityConfig, RunBudget, candidate_from_checkpoint, log_schedule, rank
+import codec
+import profiling
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 RUNS_LOG_PATH = Path("runs_log.csv")
@@ -27,14 +29,33 @@ RUNS_HEADERS = [
     "avg_match_confidence",
     "min_match_confidence",
     "max_match_confidence",
-    "discover_limit"
+    "discover_limit",
+    "model_calls",
+    "prompt_tokens",
+    "cached_prompt_tokens"
 ]
 
-def ensure_runs_log_headers() -> None:
-    if not RUNS_LOG_PATH.exists() or RUNS_LOG_PATH.stat().st_size == 0:
-        with RUNS_LOG_PATH.open("w", newline="", encoding="utf-8") as f:
+def ensure_runs_log_headers(path: Path = RUNS_LOG_PATH) -> None:
+    if not path.exists() or path.stat().st_size == 0:
+        with path.open("w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(RUNS_HEADERS)
+        return
+
+    # Migrate logs written before columns were added: new header, old rows padded
+    with path.open("r", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    if rows[0] == RUNS_HEADERS:
+        return
+    if rows[0] != RUNS_HEADERS[:len(rows[0])]:
+        raise ValueError(f"Unrecognized header in {path}: {rows[0]}")
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(RUNS_HEADERS)
+        writer.writerows(row + [""] * (len(RUNS_HEADERS) - len(row)) for row in rows[1:])
+    tmp.replace(path)
+    logger.info(f"Migrated {path} to {len(RUNS_HEADERS)} columns")
 
 def write_run_stats(
     run_id: str,
@@ -42,9 +63,11 @@ def write_run_stats(
     finished_at: datetime,
     supplier_name: str,
     results: List[Dict[str, Any]],
-    discover_limit: Optional[int] = None
+    discover_limit: Optional[int] = None,
+    token_usage: Optional[Dict[str, int]] = None,
+    runs_log_path: Path = RUNS_LOG_PATH
 ) -> None:
-    ensure_runs_log_headers()
+    ensure_runs_log_headers(runs_log_path)
 
     total_products = len(results)
     matched_products = sum(1 for r in results if r.get("match_found"))
@@ -66,6 +89,8 @@ def write_run_stats(
         min_conf = 0.0
         max_conf = 0.0
 
+    token_usage = token_usage or {}
+
     row = [
         run_id,
         started_at.astimezone(timezone.utc).isoformat(),
@@ -78,58 +103,121 @@ def write_run_stats(
         f"{avg_conf:.4f}",
         f"{min_conf:.4f}",
         f"{max_conf:.4f}",
-        discover_limit or ""
+        discover_limit or "",
+        token_usage.get("model_calls", ""),
+        token_usage.get("prompt_tokens", ""),
+        token_usage.get("cached_prompt_tokens", "")
     ]
 
-    with RUNS_LOG_PATH.open("a", newline="", encoding="utf-8") as f:
+    with runs_log_path.open("a", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(row)
-    logger.info(f"Run {run_id} logged to {RUNS_LOG_PATH}")
+    if token_usage.get("prompt_tokens"):
+        share = token_usage.get("cached_prompt_tokens", 0) / token_usage["prompt_tokens"]
+        logger.info(f"Prompt tokens: {token_usage['prompt_tokens']} ({share:.0%} served from cache)")
+    logger.info(f"Run {run_id} logged to {runs_log_path}")
 
-def process_checkpoints(discover_limit: Optional[int] = None):
-    started_at = datetime.now(timezone.utc)
+def make_run_id(started_at: datetime, discover_limit: Optional[int] = None) -> str:
     limit_suffix = f"-limit{discover_limit}" if discover_limit else ""
-    run_id = started_at.strftime(f"qiqiyg-%Y%m%dT%H%M%S{limit_suffix}")
+    return started_at.strftime(f"qiqiyg-%Y%m%dT%H%M%S{limit_suffix}")
+
+def process_checkpoints(discover_limit: Optional[int] = None, mirror_media: bool = False,
+                        verify_images: bool = False, run_id: Optional[str] = None,
+                        budget: Optional[RunBudget] = None,
+                        priority_config: Optional[PriorityConfig] = None):
+    started_at = datetime.now(timezone.utc)
+    run_id = run_id or make_run_id(started_at, discover_limit)
     
     agent_c = AgentC()
+    media_store = None
+    if mirror_media:
+        from media_store import MediaStore
+        media_store = MediaStore()
+    verify_match = None
+    if verify_images:
+        from image_verify import verify_match
     checkpoints = glob.glob("checkpoint_*.json")
     
     if not checkpoints:
         logger.info("No checkpoints found.")
         return
 
+    delta = DeltaExport(run_id)
+    budget = budget or RunBudget()
+
+    # Highest-value products first, so a budget-limited run spends it where it matters
+    with profiling.stage("schedule"):
+        schedule = []
+        for cp_file in checkpoints:
+            try:
+                schedule.append(candidate_from_checkpoint(cp_file, codec.load_file(cp_file)["raw"]))
+            except Exception as e:
+                logger.error(f"Error reading {cp_file}: {e}")
+        schedule = rank(schedule, priority_config or PriorityConfig.load())
+    log_schedule(schedule)
+
     results = []
-    for cp_file in checkpoints:
-        logger.info(f"Processing {cp_file}...")
+    for position, candidate in enumerate(schedule):
+        stop_reason = budget.exhausted(agent_c.usage.calls)
+        if stop_reason:
+            logger.info(f"Stopping: {stop_reason}; {len(schedule) - position} products left for the next run")
+            break
+        cp_file = candidate.key
+        logger.info(f"Processing {cp_file} (priority {candidate.score:.3f})...")
         try:
-            with open(cp_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with profiling.stage("load"):
+                data = codec.load_file(cp_file)
             
             raw = data["raw"]
             inference = data["inference"]
             
             # Agent C: Search & Match using Gemini with Google Search grounding
             # Agent C now handles web searching internally via google_search tool
-            match_result = agent_c.find_match(raw, inference)
+            deadline = budget.cap(product_deadline(["match"]))
+            with profiling.stage("match"):
+                match_result = agent_c.find_match(raw, inference, deadline=deadline)
             logger.info(f"Match result for {raw['product_internal_id']}: {match_result.get('match_found')}")
-            
-            match_file = f"match_{raw['product_internal_id']}.json"
-            with open(match_file, "w", encoding="utf-8") as f:
-                json.dump(match_result, f, indent=2)
+
+            # Optional local image check: auto-accept or auto-reject before review
+            if verify_match is not None:
+                with profiling.stage("verify"):
+                    match_result = verify_match(raw, match_result, deadline=deadline)
             
             # Agent D: Append to CSV and get review signal
-            review_flag = append_product_row(raw, match_result, inference)
+            with profiling.stage("export"):
+                match_file = f"match_{raw['product_internal_id']}.json"
+                codec.dump_file(match_file, match_result)
+                review_flag = append_product_row(raw, match_result, inference, media_store=media_store, delta=delta)
             
             # Record result for run stats
             results.append({
                 "match_found": match_result.get("match_found", False),
                 "match_confidence": match_result.get("match_confidence"),
-                "needs_review": review_flag
+                "needs_review": review_flag,
+                "verification": match_result.get("verification")
             })
             
+        except CircuitOpenError as e:
+            # Every remaining product would fail the same way; leave them for the next run
+            logger.error(f"Stopping: {e}; {len(schedule) - position} products left for the next run")
+            break
         except Exception as e:
+            # No match file or export row: the product is retried by the next run
             logger.error(f"Error processing {cp_file}: {e}")
 
+    if media_store is not None:
+        logger.info(f"Media store: {media_store.stats}")
+    if verify_match is not None:
+        accepted = sum(1 for r in results if r["verification"] == "accepted")
+        rejected = sum(1 for r in results if r["verification"] == "rejected")
+        logger.info(f"Image verification: {accepted} auto-accepted, {rejected} auto-rejected of {len(results)}")
+
+    agent_c.close()
+
+    # Products whose checkpoint is gone are reported as removed in this run's delta;
+    # ones skipped by the budget are still in the catalog, so they aren't
+    delta.finish(catalog_ids=[Path(cp).stem[len("checkpoint_"):] for cp in checkpoints])
+
     finished_at = datetime.now(timezone.utc)
     write_run_stats(
         run_id=run_id,
@@ -137,13 +225,37 @@ def process_checkpoints(discover_limit: Optional[int] = None):
         finished_at=finished_at,
         supplier_name="QiQiYG",
         results=results,
-        discover_limit=discover_limit
+        discover_limit=discover_limit,
+        token_usage=agent_c.usage.as_dict()
     )
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit", type=int, help="Processing limit used for the run")
+    parser.add_argument("--mirror-media", action="store_true", help="Mirror images into the local media store and export local URLs")
+    parser.add_argument("--verify-images", action="store_true", help="Compare official and supplier images to auto-accept/reject matches")
+    parser.add_argument("--profile", action="store_true", help="Write cProfile, allocation and sampled-stack reports to profiles/<run_id>/")
+    parser.add_argument("--time-budget", type=float, help="Stop starting new products after this many seconds")
+    parser.add_argument("--call-budget", type=int, help="Stop starting new products after this many model calls")
+    parser.add_argument("--priority-config", help="JSON file of scheduling weights (default: priority.json if present)")
+    parser.add_argument("--batch", action="store_true", help="Submit an offline batch job instead (--call-budget caps its size); collect with batch_jobs.py")
     args = parser.parse_args()
-    
-    process_checkpoints(discover_limit=args.limit)
+
+    if args.batch:
+        from batch_jobs import prepare_match_job, submit
+        job = prepare_match_job(max_requests=args.call_budget,
+                                priority_config=PriorityConfig.load(args.priority_config),
+                                discover_limit=args.limit)
+        if job is not None:
+            job = submit(job)
+            print(f"Batch job {job.job_id}: {job.state}; collect with: python batch_jobs.py collect {job.job_id} --wait")
+    else:
+        run_id = make_run_id(datetime.now(timezone.utc), args.limit)
+        with profiling.maybe_profile(args.profile, run_id):
+            process_checkpoints(discover_limit=args.limit, mirror_media=args.mirror_media,
+                                verify_images=args.verify_images, run_id=run_id,
+                                budget=RunBudget(args.time_budget, args.call_budget),
+                                priority_config=PriorityConfig.load(args.priority_config))
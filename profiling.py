@@ -0,0 +1,200 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = Path("profiles")
+
+# Wall-clock stack sampling period
+SAMPLE_INTERVAL = 0.01
+# Frames recorded per allocation
+TRACEMALLOC_FRAMES = 1
+# tracemalloc slows allocation-heavy code several times over, so it only runs during the
+# first occurrence(s) of each stage; the overhead stays fixed however many products a run has
+TRACED_OCCURRENCES_PER_STAGE = 1
+TOP_N = 25
+
+_active: Optional["RunProfiler"] = None
+
+
+class StackSampler(threading.Thread):
+    """Samples every thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[Any, str] = {}
+        self._stop_event = threading.Event()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{Path(code.co_filename).stem}:{code.co_name}"
+        return label
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def write_collapsed(self, path: Path) -> None:
+        """Brendan Gregg collapsed format (`frame;frame;frame count`), for flamegraph.pl / speedscope."""
+        with path.open("w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfiler:
+    """
+    Profiles one run and writes its artifacts to profiles/<run_id>/:
+
+        cprofile.pstats     cProfile stats of the main thread (python -m pstats, snakeviz)
+        stacks.collapsed    sampled wall-clock stacks of all threads, for flamegraphs
+        allocations.txt     top-N allocations made (and still live) by each stage's first run
+        summary.json        per-stage wall time and traced peak, process peak RSS, sampler stats
+
+    Mark stages with profiling.stage("name") in the orchestrator loops.
+    """
+
+    def __init__(self, run_id: str, output_dir: Path = PROFILES_DIR,
+                 sample_interval: float = SAMPLE_INTERVAL, top_n: int = TOP_N):
+        self.run_id = run_id
+        self.output_dir = Path(output_dir) / run_id
+        self.top_n = top_n
+        self.sampler = StackSampler(sample_interval)
+        self.stage_times: Dict[str, List[float]] = {}
+        self.stage_peaks: Dict[str, int] = {}
+        self.stage_allocations: Dict[str, List[List[Any]]] = {}
+        self._traced: Counter = Counter()
+        self._lock = threading.Lock()
+        self._cprofile = None
+        self._started = 0.0
+
+    def start(self) -> "RunProfiler":
+        global _active
+        import cProfile
+
+        self._cprofile = cProfile.Profile()
+        self._started = time.perf_counter()
+        self.sampler.start()
+        self._cprofile.enable()
+        _active = self
+        logger.info(f"Profiling run {self.run_id} -> {self.output_dir}")
+        return self
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        import tracemalloc
+
+        with self._lock:
+            trace = self._traced[name] < TRACED_OCCURRENCES_PER_STAGE and not tracemalloc.is_tracing()
+            if trace:
+                self._traced[name] += 1
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            top = None
+            if trace:
+                # Only this stage's allocations were traced, so the snapshot is its growth
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                top = snapshot.statistics("lineno")[:self.top_n]
+            with self._lock:
+                self.stage_times.setdefault(name, []).append(elapsed)
+                if top is not None:
+                    self.stage_peaks[name] = max(self.stage_peaks.get(name, 0), peak)
+                    self.stage_allocations.setdefault(name, []).append(top)
+
+    def stop(self) -> Path:
+        global _active
+        _active = None
+        self._cprofile.disable()
+        self.sampler.stop()
+        elapsed = time.perf_counter() - self._started
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._cprofile.dump_stats(str(self.output_dir / "cprofile.pstats"))
+        self.sampler.write_collapsed(self.output_dir / "stacks.collapsed")
+        self._write_allocations()
+
+        summary = {
+            "run_id": self.run_id,
+            "wall_seconds": round(elapsed, 3),
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "stack_samples": self.sampler.samples,
+            "sample_interval": self.sampler.interval,
+            "stages": {
+                name: {
+                    "count": len(times),
+                    "total_seconds": round(sum(times), 3),
+                    "max_seconds": round(max(times), 3),
+                    "peak_traced_bytes": self.stage_peaks.get(name, 0),
+                }
+                for name, times in self.stage_times.items()
+            },
+        }
+        (self.output_dir / "summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        logger.info(f"Profile for {self.run_id} written to {self.output_dir}")
+        return self.output_dir
+
+    def _write_allocations(self) -> None:
+        with (self.output_dir / "allocations.txt").open("w", encoding="utf-8") as f:
+            for name, tops in self.stage_allocations.items():
+                for i, top in enumerate(tops, 1):
+                    f.write(f"== stage {name} (occurrence {i}): top {len(top)} allocation sites ==\n")
+                    for stat in top:
+                        f.write(f"{stat}\n")
+                    f.write("\n")
+
+    def __enter__(self) -> "RunProfiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def stage(name: str):
+    """Marks a pipeline stage for the active profiler; a no-op when not profiling."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+def maybe_profile(enabled: bool, run_id: str):
+    """RunProfiler context for `--profile` runs, otherwise a no-op context."""
+    return RunProfiler(run_id) if enabled else nullcontext()
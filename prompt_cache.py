@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Explicit context caching of the static prompt prefixes (AUTOMATCH_PROMPT_CACHE=0 disables)
+PROMPT_CACHE_ENABLED = os.environ.get("AUTOMATCH_PROMPT_CACHE", "1") != "0"
+PROMPT_CACHE_TTL = int(os.environ.get("AUTOMATCH_PROMPT_CACHE_TTL", "3600"))
+# Extend the TTL when less than this much of it is left
+REFRESH_MARGIN = 300
+# After a failed create, send prompts inline and try again after this long
+CREATE_RETRY_AFTER = 900
+# Smallest prefix the model accepts as cached content (gemini-2.5-flash: 1024 tokens).
+# Shorter prefixes are sent inline, where Gemini's implicit caching may still reuse
+# them; hits show up as cached_prompt_tokens either way
+MIN_CACHE_TOKENS = int(os.environ.get("AUTOMATCH_PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+
+def is_cache_error(exc: BaseException) -> bool:
+    """True if a model call failed because its cached content is gone or expired."""
+    message = str(exc).lower()
+    return ("cache" in message or "cachedcontent" in message) and any(
+        s in message for s in ("not found", "expired", "404", "permission")
+    )
+
+
+class CachedPrefix:
+    """
+    A server-side cached prompt prefix with a TTL. `create_fn(ttl)` creates it and
+    returns a handle (name or SDK object); `refresh_fn(handle, ttl)` extends it and
+    `delete_fn(handle)` removes it. `count_fn()` measures the prefix in tokens before
+    the first create; below `min_tokens` explicit caching is skipped for good. get()
+    returns a live handle, refreshing or recreating as needed, or None when callers
+    should send the prefix inline.
+    """
+
+    def __init__(self, name: str,
+                 create_fn: Callable[[int], Any],
+                 refresh_fn: Optional[Callable[[Any, int], None]] = None,
+                 delete_fn: Optional[Callable[[Any], None]] = None,
+                 count_fn: Optional[Callable[[], int]] = None,
+                 ttl: int = PROMPT_CACHE_TTL,
+                 enabled: bool = PROMPT_CACHE_ENABLED,
+                 min_tokens: int = MIN_CACHE_TOKENS):
+        self.name = name
+        self.create_fn = create_fn
+        self.refresh_fn = refresh_fn
+        self.delete_fn = delete_fn
+        self.count_fn = count_fn
+        self.ttl = ttl
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.tokens: Optional[int] = None
+        self.handle: Any = None
+        self.expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            if self.handle is not None and now < self.expires_at - REFRESH_MARGIN:
+                return self.handle
+            if self.handle is not None and now < self.expires_at and self.refresh_fn:
+                try:
+                    self.refresh_fn(self.handle, self.ttl)
+                    self.expires_at = now + self.ttl
+                    logger.info(f"Extended cached prefix {self.name} by {self.ttl}s")
+                    return self.handle
+                except Exception as e:
+                    logger.warning(f"Could not extend cached prefix {self.name}: {e}; recreating")
+            if now < self._retry_at or not self._large_enough():
+                return None
+            try:
+                self.handle = self.create_fn(self.ttl)
+                self.expires_at = now + self.ttl
+                logger.info(f"Created cached prefix {self.name} (ttl {self.ttl}s)")
+            except Exception as e:
+                self.handle = None
+                self._retry_at = now + CREATE_RETRY_AFTER
+                logger.warning(f"Could not create cached prefix {self.name}: {e}; sending prompts inline")
+            return self.handle
+
+    def _large_enough(self) -> bool:
+        """Measures the prefix once; disables explicit caching if it is below the minimum."""
+        if self.count_fn is None or self.tokens is not None:
+            return self.enabled
+        try:
+            self.tokens = self.count_fn()
+        except Exception as e:
+            logger.warning(f"Could not count tokens of cached prefix {self.name}: {e}; trying to create it anyway")
+            return True
+        if self.tokens < self.min_tokens:
+            self.enabled = False
+            logger.info(f"Prefix {self.name} is {self.tokens} tokens, below the {self.min_tokens}-token "
+                        f"minimum for cached content; sending it inline (implicit caching only)")
+        return self.enabled
+
+    def invalidate(self) -> None:
+        """Drops a handle the server no longer recognizes; the next get() recreates it."""
+        with self._lock:
+            self.handle = None
+            self.expires_at = 0.0
+
+    def release(self) -> None:
+        """Deletes the cache at the end of a run instead of paying storage until the TTL."""
+        with self._lock:
+            handle, self.handle = self.handle, None
+        if handle is not None and self.delete_fn:
+            try:
+                self.delete_fn(handle)
+                logger.info(f"Deleted cached prefix {self.name}")
+            except Exception as e:
+                logger.warning(f"Could not delete cached prefix {self.name}: {e}")
+
+
+class TokenUsage:
+    """Thread-safe prompt-token counters from model responses' usage metadata."""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, response: Any) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            self.calls += 1
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+                self.cached_tokens += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def record_json(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Counts one call from JSON usage metadata (batch result files use camelCase keys)."""
+        usage = usage or {}
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.get("promptTokenCount", usage.get("prompt_token_count")) or 0
+            self.cached_tokens += usage.get("cachedContentTokenCount", usage.get("cached_content_token_count")) or 0
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "model_calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_tokens,
+            }
+
+
+def merge_usage(*usages: Optional[TokenUsage]) -> Dict[str, int]:
+    total = {"model_calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+    for usage in usages:
+        if usage is not None:
+            for key, value in usage.as_dict().items():
+                total[key] += value
+    return total
@@ -0,0 +1,242 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# End-to-end budget per product (seconds) and how it splits across stages
+PRODUCT_BUDGET = float(os.environ.get("AUTOMATCH_PRODUCT_BUDGET", "120"))
+STAGE_SHARES = {
+    "scrape": 0.15,
+    "infer": 0.35,
+    "match": 0.50,
+}
+
+# Jittered exponential backoff
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Circuit breaker: open after N consecutive failures, probe again after the cool-down
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+# Seconds before a duplicate (hedged) request is sent for slow fetches; unset disables hedging
+HEDGE_AFTER = float(os.environ["AUTOMATCH_HEDGE_AFTER"]) if os.environ.get("AUTOMATCH_HEDGE_AFTER") else None
+
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Deadline:
+    """An absolute point in time that work must finish by, passed down through the stages."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, what: str = "operation") -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {what}")
+
+    def timeout(self, cap: float) -> float:
+        """A per-call timeout: the smaller of `cap` and the remaining budget."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("No time budget left")
+        return min(cap, remaining)
+
+    def child(self, share: float) -> "Deadline":
+        """A sub-deadline using `share` of the remaining budget (never outliving the parent)."""
+        return Deadline(self.remaining() * share)
+
+    def for_stage(self, stage: str, stages_left: Optional[List[str]] = None) -> "Deadline":
+        """
+        Sub-deadline for a stage. Its share is relative to the stages still ahead, so
+        time saved by a fast earlier stage carries over to later ones.
+        """
+        stages_left = stages_left or [stage]
+        total = sum(STAGE_SHARES[s] for s in stages_left)
+        return self.child(STAGE_SHARES[stage] / total if total else 1.0)
+
+
+def product_deadline(stages: Optional[List[str]] = None, budget: Optional[float] = None) -> Deadline:
+    """
+    Deadline for one product. A process that runs only some of the stages gets
+    only their share of the end-to-end budget.
+    """
+    budget = budget or PRODUCT_BUDGET
+    if stages:
+        budget *= sum(STAGE_SHARES[s] for s in stages)
+    return Deadline(budget)
+
+
+class CircuitBreaker:
+    """Fails fast while a dependency (a host or the model API) keeps failing."""
+
+    def __init__(self, name: str,
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._half_open_probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._half_open_probe:
+                # Let exactly one probe request through
+                self._half_open_probe = True
+                return
+        raise CircuitOpenError(f"Circuit open for {self.name}")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._half_open_probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._half_open_probe or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._half_open_probe:
+                    logger.warning(f"Circuit breaker opened for {self.name} after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self._half_open_probe = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Timeouts, connection errors, 429 and 5xx are worth retrying; everything else is not."""
+    if isinstance(exc, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in TRANSIENT_STATUS_CODES
+        if isinstance(exc, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    # google-genai / google-api-core errors carry the HTTP status as `code`
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS_CODES
+    return "deadline" in type(exc).__name__.lower() or "unavailable" in type(exc).__name__.lower()
+
+
+def retry_call(fn: Callable[[], Any],
+               deadline: Optional[Deadline] = None,
+               attempts: int = RETRY_ATTEMPTS,
+               breaker: Optional[CircuitBreaker] = None,
+               is_transient: Callable[[BaseException], bool] = is_transient_error,
+               what: str = "call") -> Any:
+    """
+    Calls fn() with full-jitter exponential backoff on transient errors, never
+    sleeping past the deadline. The breaker (if any) is consulted before each try.
+    """
+    for attempt in range(1, attempts + 1):
+        if deadline:
+            deadline.check(what)
+        if breaker:
+            breaker.allow()
+        try:
+            result = fn()
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker:
+                # A non-transient error (e.g. a 400) still proves the dependency is up
+                if transient:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not transient or attempt == attempts:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            if deadline and delay >= deadline.remaining():
+                raise
+            logger.info(f"Retrying {what} in {delay:.2f}s after {type(e).__name__}: {e} (attempt {attempt}/{attempts})")
+            time.sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_lock = threading.Lock()
+
+
+def hedged_call(fn: Callable[[], Any], hedge_after: float,
+                deadline: Optional[Deadline] = None) -> Any:
+    """
+    Runs fn(); if it has not finished after `hedge_after` seconds, starts a
+    duplicate and returns whichever succeeds first.
+    """
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+    primary = _hedge_pool.submit(fn)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    logger.debug(f"Hedging slow call after {hedge_after}s")
+    pending = {primary, _hedge_pool.submit(fn)}
+    last_error: Optional[BaseException] = None
+    while pending:
+        timeout = deadline.remaining() if deadline else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded("Deadline exceeded waiting for hedged call")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+    raise last_error
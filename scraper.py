@@ -4,23 +4,33 @@ import re
 import logging
 import json
 import argparse
+from datetime import datetime, timezone
 from typing import List, Optional
 from models import RawProductRecord
+import codec
+import profiling
 from discover import fetch_soup
+from image_select import IMAGE_PROBE_ENABLED, rank_images
+from resilience import Deadline
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_product_detail(url: str) -> Optional[RawProductRecord]:
+def extract_product_detail(url: str, deadline: Optional[Deadline] = None) -> Optional[RawProductRecord]:
     """
     Extracts product information from a product info page.
     """
     logger.info(f"Scraping product detail: {url}")
-    soup = fetch_soup(url)
+    soup = fetch_soup(url, deadline=deadline)
     if not soup:
         return None
+    return parse_product_detail(soup, url, deadline)
 
+def parse_product_detail(soup: BeautifulSoup, url: str, deadline: Optional[Deadline] = None,
+                         probe_images: bool = IMAGE_PROBE_ENABLED) -> RawProductRecord:
+    """
+    Parses an already fetched product info page. Pages without a product come back
+    with internal_id None. probe_images=False ranks images on their URLs alone.
+    """
     # Extract ID, Name, Describe from labels
     internal_id = None
     title = None
@@ -76,8 +86,8 @@ def extract_product_detail(url: str) -> Optional[RawProductRecord]:
                 full_src = str(httpx.URL(url).join(src))
                 image_urls.append(full_src)
 
-    # Deduplicate images
-    image_urls = sorted(list(set(image_urls)))
+    # Deduplicate, most informative first (product shots before logos/banners/thumbnails)
+    image_urls = [c.url for c in rank_images(image_urls, deadline, probe=probe_images, product_id=internal_id)]
 
     # Parse category_id from URL path param
     # Example: path=0_37771_44188 -> 37771 or 44188
@@ -96,13 +106,23 @@ def extract_product_detail(url: str) -> Optional[RawProductRecord]:
     )
 
 def main():
+    from logging_setup import setup_logging
+    setup_logging()
     parser = argparse.ArgumentParser(description="QiQiYG Product Scraper")
     parser.add_argument("url", nargs="?", help="Product info URL to scrape")
     parser.add_argument("--discover", action="store_true", help="Run discovery first")
     parser.add_argument("--limit", type=int, default=5, help="Limit number of products to scrape")
     parser.add_argument("--agent-b", action="store_true", help="Process results through Agent B")
+    parser.add_argument("--output", default="products_results.json", help="Output file (.jsonl streams one record per line)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent product fetches (per-host limits still apply)")
+    parser.add_argument("--profile", action="store_true", help="Write cProfile, allocation and sampled-stack reports to profiles/<run_id>/")
     args = parser.parse_args()
 
+    run_id = datetime.now(timezone.utc).strftime("scraper-%Y%m%dT%H%M%S")
+    with profiling.maybe_profile(args.profile, run_id):
+        run_scraper(args)
+
+def run_scraper(args: argparse.Namespace) -> None:
     if args.url:
         record = extract_product_detail(args.url)
         if record:
@@ -114,30 +134,44 @@ def main():
             else:
                 print(json.dumps(record.to_json(), indent=2))
     elif args.discover:
-        from discover import discover_product_urls
-        urls = discover_product_urls(limit_categories=1)
+        from itertools import islice
+        from discover import iter_product_urls
+        # Stop crawling as soon as enough products are found
+        with profiling.stage("discover"):
+            urls = list(islice(iter_product_urls(limit_categories=1), args.limit))
         
-        results = []
         agent = None
         if args.agent_b:
             from agent_b import AgentB
             agent = AgentB()
 
-        for i, url in enumerate(urls):
-            if i >= args.limit:
-                break
-            record = extract_product_detail(url)
-            if record:
-                if agent:
-                    agent_result = agent.process_product(record.to_json())
-                    results.append(agent_result)
-                else:
-                    results.append(record.to_json())
-        
-        output_file = "products_results.json"
-        with open(output_file, "w") as f:
-            json.dump(results, f, indent=2)
-        print(f"Processed {len(results)} products. Saved to {output_file}")
+        # Fetch concurrently; the host scheduler in fetcher.py keeps each host within its safe window
+        from concurrent.futures import ThreadPoolExecutor
+        with profiling.stage("scrape"), ThreadPoolExecutor(max_workers=args.workers) as pool:
+            records = list(pool.map(extract_product_detail, urls))
+
+        def infer(record):
+            try:
+                return agent.process_product(record.to_json())
+            except Exception as e:
+                logger.error(f"Agent B failed for {record.product_url}: {e}")
+                return None
+
+        results = (
+            r for r in (infer(record) if agent else record for record in records if record)
+            if r is not None
+        )
+
+        # Agent B runs lazily while the results are written
+        output_file = args.output
+        with profiling.stage("infer" if agent else "write"):
+            if output_file.endswith(".jsonl"):
+                count = codec.write_jsonl(output_file, results)
+            else:
+                results = list(results)
+                codec.dump_file(output_file, results)
+                count = len(results)
+        print(f"Processed {count} products. Saved to {output_file}")
     else:
         # Default smoke test
         test_url = "https://bags.qiqiyg.com/productinfoen_655730.html?path=0_37771_44188"
@@ -0,0 +1,313 @@
+import dataclasses
+import json
+import logging
+import typing
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from models import json_schema, output_fields
+
+logger = logging.getLogger(__name__)
+
+# Schema keywords the older google.generativeai SDK can't express
+LEGACY_UNSUPPORTED_KEYS = ("minimum", "maximum", "property_ordering")
+
+REPAIR_PROMPT = """The JSON object below was produced for this request but some fields are missing or invalid.
+
+Request:
+{payload}
+
+Original response:
+{response}
+
+Partial JSON object:
+{partial}
+
+Problems:
+{problems}
+
+Return ONLY a JSON object containing exactly these fields, corrected: {field_names}
+"""
+
+
+class IncrementalJsonParser:
+    """
+    Incremental parser for a single top-level JSON object arriving in chunks. feed()
+    returns the (key, value) pairs whose values completed in that chunk, so fields can
+    be checked before the response ends. Text before the first "{" (markdown fences,
+    preambles) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key: Optional[str] = None
+        self.key_start: Optional[int] = None
+        self.value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk
+        completed = []
+        while self.pos < len(self.buffer) and not self.finished:
+            i, ch = self.pos, self.buffer[self.pos]
+            self.pos += 1
+            if not self.started:
+                if ch == "{":
+                    self.started, self.depth = True, 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.key_start is not None and self.value_start is None:
+                        self.key = json.loads(self.buffer[self.key_start:i + 1])
+                        self.key_start = None
+                continue
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.key_start = i
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    completed += self._complete_value(i)
+                    self.finished = True
+            elif ch == ":" and self.depth == 1 and self.key is not None and self.value_start is None:
+                self.value_start = i + 1
+            elif ch == "," and self.depth == 1:
+                completed += self._complete_value(i)
+        return completed
+
+    def close(self) -> List[Tuple[str, Any]]:
+        """Salvages a scalar value left open by a response that ended mid-object."""
+        if self.finished or self.depth != 1 or self.in_string:
+            return []
+        completed = self._complete_value(len(self.buffer))
+        return [(k, v) for k, v in completed if not isinstance(v, _Unparsable)]
+
+    def _complete_value(self, end: int) -> List[Tuple[str, Any]]:
+        key, start = self.key, self.value_start
+        self.key, self.value_start = None, None
+        if key is None or start is None:
+            return []
+        text = self.buffer[start:end].strip()
+        try:
+            return [(key, json.loads(text))]
+        except ValueError:
+            return [(key, _Unparsable(text))]
+
+
+class _Unparsable:
+    """Marker for a field whose raw value text isn't valid JSON."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"<unparsable {self.text[:40]!r}>"
+
+
+def validate_value(annotation: Any, metadata: Dict[str, Any], value: Any) -> Optional[str]:
+    """Checks a parsed value against a dataclass field annotation. Returns an error or None."""
+    if isinstance(value, _Unparsable):
+        return f"not valid JSON: {value.text[:60]!r}"
+    args = typing.get_args(annotation)
+    if typing.get_origin(annotation) is typing.Union and type(None) in args:
+        if value is None:
+            return None
+        annotation = [a for a in args if a is not type(None)][0]
+    if typing.get_origin(annotation) in (tuple, list):
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            return "must be a list of strings"
+        if len(value) < metadata.get("min_items", 0):
+            return f"must have at least {metadata['min_items']} items"
+        return None
+    if annotation is bool:
+        return None if isinstance(value, bool) else "must be true or false"
+    if annotation is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return "must be a number"
+        if not metadata.get("minimum", value) <= value <= metadata.get("maximum", value):
+            return f"must be between {metadata.get('minimum')} and {metadata.get('maximum')}"
+        return None
+    if annotation is str:
+        return None if isinstance(value, str) else "must be a string"
+    return None
+
+
+_EMPTY_VALUES = {str: "", float: 0.0, int: 0, bool: False}
+
+
+def _needs_value(spec: dataclasses.Field) -> bool:
+    has_default = spec.default is not dataclasses.MISSING or spec.default_factory is not dataclasses.MISSING
+    return not has_default or spec.metadata.get("min_items", 0) > 0
+
+
+class StructuredResult:
+    """Fields parsed from a model response for a model dataclass, validated as they arrive."""
+
+    def __init__(self, cls: type):
+        self.cls = cls
+        self.specs = {f.name: f for f in output_fields(cls)}
+        self.values: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+        self.text = ""
+        # False when the response held no complete JSON object (e.g. it was truncated)
+        self.complete = True
+
+    def add(self, key: str, value: Any) -> None:
+        spec = self.specs.get(key)
+        if spec is None:
+            return  # extra keys are ignored, like from_json()
+        error = validate_value(spec.type, spec.metadata, value)
+        if error:
+            self.errors[key] = error
+            self.values.pop(key, None)
+            logger.warning(f"{self.cls.__name__}.{key} {error}")
+        else:
+            self.values[key] = value
+            self.errors.pop(key, None)
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in self.specs if name not in self.values and name not in self.errors]
+
+    @property
+    def broken(self) -> List[str]:
+        """
+        Fields worth a repair call: invalid ones, and missing ones without a usable
+        default. In an incomplete response every missing field is broken, since a
+        default can't be told apart from a value that was cut off.
+        """
+        return list(self.errors) + [name for name in self.missing
+                                    if not self.complete or _needs_value(self.specs[name])]
+
+    @property
+    def ungrounded(self) -> List[str]:
+        """Broken fields that only a grounded call may fill (see check_grounded)."""
+        return [name for name in self.broken if self.specs[name].metadata.get("grounded")]
+
+    @property
+    def repairable(self) -> List[str]:
+        """Broken fields a text-only repair may fill."""
+        ungrounded = self.ungrounded
+        return [name for name in self.broken if name not in ungrounded]
+
+    def record(self) -> Dict[str, Any]:
+        """
+        Parsed values as a dict in field order; fields still broken fall back to their
+        dataclass default (or an empty value of their type) instead of failing the product.
+        """
+        data = {}
+        for name, spec in self.specs.items():
+            if name in self.values:
+                data[name] = self.values[name]
+            elif spec.default is not dataclasses.MISSING:
+                data[name] = spec.default
+            elif spec.default_factory is not dataclasses.MISSING:
+                data[name] = spec.default_factory()
+            else:
+                data[name] = _EMPTY_VALUES.get(spec.type)
+            if isinstance(data[name], tuple):
+                data[name] = list(data[name])
+        return data
+
+    def problems(self) -> str:
+        lines = [f"- {name}: {error}" for name, error in self.errors.items()]
+        lines += [f"- {name}: missing" for name in self.broken if name not in self.errors]
+        return "\n".join(lines)
+
+
+def parse_stream(chunks: Iterable[str], cls: type, known: Optional[Dict[str, Any]] = None) -> StructuredResult:
+    """
+    Consumes streamed response text, validating each top-level field as soon as it
+    completes. `known` values (e.g. the product ID) fill fields the model got wrong.
+    """
+    result = StructuredResult(cls)
+    parser = IncrementalJsonParser()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        result.text += chunk
+        for key, value in parser.feed(chunk):
+            result.add(key, value)
+    for key, value in parser.close():
+        result.add(key, value)
+    for key, value in (known or {}).items():
+        if key not in result.values:
+            result.add(key, value)
+    result.complete = parser.finished
+    if not parser.started:
+        logger.warning(f"No JSON object in {cls.__name__} response ({len(result.text)} chars)")
+    elif not parser.finished:
+        logger.warning(f"{cls.__name__} response ended mid-object; {len(result.broken)} fields to repair")
+    return result
+
+
+def parse_text(text: str, cls: type) -> StructuredResult:
+    return parse_stream([text], cls)
+
+
+def check_grounded(result: StructuredResult) -> None:
+    """
+    Raises ValueError if a required field marked `grounded` (e.g. the match verdict)
+    is broken. A text-only repair would invent it, so the call has to be retried
+    instead. Broken grounded fields with a default are left at it (see record()).
+    """
+    ungrounded = [name for name in result.ungrounded if _needs_value(result.specs[name])]
+    if ungrounded:
+        raise ValueError(f"{result.cls.__name__} response lacks grounded fields "
+                         f"({', '.join(ungrounded)}); retry the call instead of repairing them")
+
+
+def repair(result: StructuredResult, payload: str,
+           call_fn: Callable[[str, Dict[str, Any]], str]) -> StructuredResult:
+    """
+    Asks the model for just the broken or missing fields, showing it the original
+    response text. `call_fn(prompt, schema)` makes one schema-constrained call and
+    returns its text. Grounded fields are never repaired: check_grounded raises
+    ValueError for required ones, and optional ones keep their default.
+    """
+    check_grounded(result)
+    broken = result.repairable
+    if not broken:
+        return result
+    logger.info(f"Repairing {result.cls.__name__} fields: {', '.join(broken)}")
+    prompt = REPAIR_PROMPT.format(
+        payload=payload,
+        response=result.text.strip() or "(empty)",
+        partial=json.dumps(result.values, indent=2),
+        problems=result.problems(),
+        field_names=", ".join(broken),
+    )
+    try:
+        fixed = parse_text(call_fn(prompt, json_schema(result.cls, only=broken)), result.cls)
+    except Exception as e:
+        logger.warning(f"Repair call failed: {e}")
+        return result
+    for key in broken:
+        if key in fixed.values:
+            result.add(key, fixed.values[key])
+    return result
+
+
+def strip_schema_keys(schema: Dict[str, Any], keys: Iterable[str] = LEGACY_UNSUPPORTED_KEYS) -> Dict[str, Any]:
+    keys = tuple(keys)
+    cleaned = {}
+    for key, value in schema.items():
+        if key in keys:
+            continue
+        if isinstance(value, dict):
+            value = {k: strip_schema_keys(v, keys) if isinstance(v, dict) else v for k, v in value.items()} \
+                if key == "properties" else strip_schema_keys(value, keys)
+        cleaned[key] = value
+    return cleaned
@@ -0,0 +1,230 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+from discover import BASE_URL
+from fetcher import fetch
+from models import RawProductRecord
+from scraper import parse_product_detail
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_URL_TEMPLATE = BASE_URL + "productinfoen_{id}.html"
+SWEEP_STATE_PATH = Path("sweep_state.json")
+
+# IDs are grouped into regions of this size to learn where products are dense
+REGION_SIZE = 1000
+# Consecutive misses before we treat the area as a gap and start skipping
+MAX_CONSECUTIVE_MISSES = 50
+# Largest jump while skipping through a gap
+MAX_STRIDE = 256
+# Regions whose past hit rate is below this are entered in skip mode
+SPARSE_HIT_RATE = 0.02
+
+
+class SweepState:
+    """
+    High-water mark, per-region hit statistics and the ID ranges skipped over
+    (never probed), persisted between runs.
+    """
+
+    def __init__(self, path: Path = SWEEP_STATE_PATH):
+        self.path = Path(path)
+        self.high_water_mark = 0
+        self.regions: Dict[int, List[int]] = {}  # region -> [probes, hits]
+        self.skipped: List[List[int]] = []  # [first, last] ID ranges
+        if self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.high_water_mark = data.get("high_water_mark", 0)
+            self.regions = {int(k): v for k, v in data.get("regions", {}).items()}
+            self.skipped = data.get("skipped", [])
+
+    def skip(self, first: int, last: int) -> None:
+        """Records unprobed IDs; ranges separated by a single probed ID are merged."""
+        if self.skipped and self.skipped[-1][1] + 2 >= first >= self.skipped[-1][0]:
+            self.skipped[-1][1] = max(self.skipped[-1][1], last)
+        else:
+            self.skipped.append([first, last])
+
+    def observe(self, product_id: int, hit: bool) -> None:
+        stats = self.regions.setdefault(product_id // REGION_SIZE, [0, 0])
+        stats[0] += 1
+        if hit:
+            stats[1] += 1
+            self.high_water_mark = max(self.high_water_mark, product_id)
+
+    def is_sparse(self, product_id: int) -> bool:
+        probes, hits = self.regions.get(product_id // REGION_SIZE, [0, 0])
+        return probes >= 20 and hits / probes < SPARSE_HIT_RATE
+
+    def save(self) -> None:
+        data = {
+            "high_water_mark": self.high_water_mark,
+            "regions": {str(k): v for k, v in sorted(self.regions.items())},
+            "skipped": sorted(self.skipped),
+            "updated_at": time.time(),
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+def probe(product_id: int) -> Tuple[int, Optional[RawProductRecord]]:
+    """
+    Fetches one product ID. Only a 404 or a page without a product is a miss;
+    anything else (exhausted retries, an open circuit) raises, because counting
+    an outage as misses would mark live regions as gaps.
+    """
+    url = PRODUCT_URL_TEMPLATE.format(id=product_id)
+    response = fetch(url, timeout=15.0, follow_redirects=True)
+    if response.status_code == 404:
+        logger.debug(f"No product at {product_id}")
+        return product_id, None
+    response.raise_for_status()
+    # No image probes: a sweep fetches thousands of pages, so URL heuristics order the images
+    record = parse_product_detail(BeautifulSoup(response.text, "html.parser"), url, probe_images=False)
+    if record.internal_id:
+        return product_id, record
+    return product_id, None
+
+
+def sweep_ids(start: int, end: Optional[int] = None,
+              state: Optional[SweepState] = None,
+              workers: int = 16,
+              max_misses: int = MAX_CONSECUTIVE_MISSES,
+              probe_fn: Callable[[int], Tuple[int, Optional[RawProductRecord]]] = probe,
+              skip_gaps: bool = True
+              ) -> Iterator[RawProductRecord]:
+    """
+    Probes product IDs from `start` upward and yields the records found.
+
+    IDs are probed in concurrent waves. Every `max_misses` consecutive misses the
+    sweep doubles its stride and skips ahead; a hit while skipping backfills the
+    skipped IDs. IDs skipped for good are recorded in `state.skipped` (see
+    rescan_skipped). With skip_gaps=False every ID is probed. Without `end`
+    (tail mode) the sweep stops at the first gap. A probe error aborts the sweep
+    after saving the state of completed waves.
+    """
+    state = state or SweepState()
+    next_id = start
+    stride = 2 if skip_gaps and state.is_sparse(start) else 1
+    misses = 0
+    last_probed = start - 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while end is None or next_id <= end:
+            wave = []
+            while len(wave) < workers and (end is None or next_id <= end):
+                wave.append(next_id)
+                next_id += stride
+
+            try:
+                results = list(pool.map(probe_fn, wave))
+                if stride > 1 and any(record for _, record in results):
+                    # Landed in a dense area while skipping: backfill every skipped ID in the wave
+                    probed = set(wave)
+                    skipped = [i for i in range(last_probed + 1, wave[-1]) if i not in probed]
+                    logger.info(f"Hit while skipping near {wave[0]}; backfilling {len(skipped)} IDs")
+                    results += pool.map(probe_fn, skipped)
+                    results.sort(key=lambda r: r[0])
+                    stride = 1
+            except Exception as e:
+                logger.error(f"Probe failed in wave {wave[0]}-{wave[-1]}: {e}; "
+                             f"stopping (resume with --start {last_probed + 1})")
+                state.save()
+                raise
+
+            for product_id, record in results:
+                state.observe(product_id, record is not None)
+                if product_id > last_probed + 1:
+                    state.skip(last_probed + 1, product_id - 1)
+                last_probed = product_id
+                if record is None:
+                    misses += 1
+                    continue
+                misses = 0
+                yield record
+
+            if misses >= max_misses:
+                if end is None:
+                    logger.info(f"{misses} consecutive misses after {last_probed}; tail sweep complete")
+                    break
+                if skip_gaps:
+                    # Double once per full run of misses, so narrow clusters are still landed on
+                    stride = min(MAX_STRIDE, stride * 2)
+                    misses = 0
+                    logger.info(f"Gap after {last_probed}; skipping with stride {stride}")
+            elif skip_gaps and stride == 1 and state.is_sparse(next_id):
+                stride = 2
+
+            state.save()
+    if end is not None and last_probed < end:
+        # The last stride jumped past `end`
+        state.skip(last_probed + 1, end)
+    state.save()
+
+
+def rescan_skipped(state: SweepState, workers: int = 16,
+                   probe_fn: Callable[[int], Tuple[int, Optional[RawProductRecord]]] = probe
+                   ) -> Iterator[RawProductRecord]:
+    """Probes every ID in the ranges earlier sweeps skipped, dropping each range once done."""
+    for first, last in sorted(state.skipped):
+        logger.info(f"Rescanning skipped IDs {first}-{last}")
+        yield from sweep_ids(first, last, state, workers, probe_fn=probe_fn, skip_gaps=False)
+        state.skipped.remove([first, last])
+        state.save()
+
+
+def main():
+    from logging_setup import setup_logging
+    setup_logging()
+
+    import codec
+    parser = argparse.ArgumentParser(description="Discover products by sweeping numeric product IDs")
+    parser.add_argument("--start", type=int, help="First ID to probe (default: high-water mark + 1)")
+    parser.add_argument("--end", type=int, help="Last ID to probe (default: sweep the new tail until a gap)")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent probes (per-host limits still apply)")
+    parser.add_argument("--max-misses", type=int, default=MAX_CONSECUTIVE_MISSES, help="Consecutive misses that mark a gap")
+    parser.add_argument("--output", default="sweep_results.jsonl", help="JSON-lines file for discovered records")
+    parser.add_argument("--rescan-skipped", action="store_true", help="Probe every ID that earlier sweeps skipped over")
+    args = parser.parse_args()
+
+    state = SweepState()
+    if args.rescan_skipped:
+        total = sum(last - first + 1 for first, last in state.skipped)
+        logger.info(f"Rescanning {len(state.skipped)} skipped ranges ({total} IDs)")
+        with codec.JsonlWriter(args.output, append=True) as writer:
+            try:
+                writer.write_many(rescan_skipped(state, args.workers))
+            except Exception:
+                print(f"Rescan aborted after {writer.count} products (see log). Saved to {args.output}")
+                sys.exit(1)
+        print(f"Found {writer.count} products in skipped ranges. Saved to {args.output}")
+        return
+
+    if args.start is None and state.high_water_mark == 0:
+        parser.error("No high-water mark yet; pass --start")
+    start = args.start if args.start is not None else state.high_water_mark + 1
+    if start < 1:
+        parser.error("--start must be a positive ID")
+
+    logger.info(f"Sweeping from {start} to {args.end or 'end of tail'} (high-water mark {state.high_water_mark})")
+    with codec.JsonlWriter(args.output, append=True) as writer:
+        try:
+            writer.write_many(sweep_ids(start, args.end, state, args.workers, args.max_misses))
+        except Exception:
+            print(f"Sweep aborted after {writer.count} products (see log). Saved to {args.output}")
+            sys.exit(1)
+        found = writer.count
+    print(f"Found {found} products. High-water mark: {state.high_water_mark}. Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import csv
+import json
+import threading
+
+import pytest
+
+import agent_d
+from agent_d import HEADERS, DeltaExport, compact_deltas, ensure_csv_headers, row_hash
+
+ID = HEADERS.index("product_internal_id")
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def row(product_id, price="100"):
+    values = [""] * len(HEADERS)
+    values[ID] = product_id
+    values[HEADERS.index("product_cost_price")] = price
+    values[-1] = "NO"
+    return values
+
+
+def read_csv(path):
+    with path.open(newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def run(run_id, rows, catalog_ids=None):
+    delta = DeltaExport(run_id)
+    changes = [delta.record(r) for r in rows]
+    path = delta.finish(catalog_ids)
+    return delta, changes, {r["product_internal_id"]: r["change_type"] for r in read_csv(path)}
+
+
+def test_delta_classifies_added_changed_and_unchanged():
+    _, changes, delta = run("r1", [row("1"), row("2")])
+    assert changes == ["added", "added"] and delta == {"1": "added", "2": "added"}
+
+    _, changes, delta = run("r2", [row("1"), row("2", price="90"), row("3")])
+    assert changes == ["unchanged", "changed", "added"]
+    assert delta == {"2": "changed", "3": "added"}
+
+    state = json.loads((agent_d.EXPORTS_DIR / agent_d.EXPORT_STATE_FILE).read_text(encoding="utf-8"))
+    assert state == {"1": row_hash(row("1")), "2": row_hash(row("2", price="90")), "3": row_hash(row("3"))}
+    manifest = read_csv(agent_d.EXPORTS_DIR / agent_d.MANIFEST_FILE)
+    assert [(m["run_id"], m["added"], m["changed"], m["unchanged"]) for m in manifest] == [
+        ("r1", "2", "0", "0"), ("r2", "1", "1", "1")]
+
+
+def test_products_missing_from_the_catalog_are_removed():
+    run("r1", [row("1"), row("2"), row("3")])
+
+    # Without a catalog nothing is removed
+    _, _, delta = run("r2", [row("1")])
+    assert delta == {}
+
+    delta_export, _, delta = run("r3", [row("1")], catalog_ids=["1", "3"])
+    assert delta == {"2": "removed"}
+    assert delta_export.counts["removed"] == 1
+    # A removed product that comes back is added again
+    _, _, delta = run("r4", [row("2")])
+    assert delta == {"2": "added"}
+
+
+def test_compact_replays_deltas_into_a_snapshot():
+    run("r1", [row("1"), row("2"), row("3")])
+    run("r2", [row("2", price="90")], catalog_ids=["1", "2"])
+    run("r3", [row("4")])
+
+    assert compact_deltas() == 3
+    snapshot = read_csv(agent_d.EXPORTS_DIR / agent_d.SNAPSHOT_FILE)
+    assert [(r["product_internal_id"], r["product_cost_price"]) for r in snapshot] == [
+        ("1", "100"), ("2", "90"), ("4", "100")]
+
+
+def test_concurrent_runs_merge_their_state_and_manifest_lines():
+    exports = [DeltaExport(f"w{i}") for i in range(8)]
+    for i, delta in enumerate(exports):
+        delta.record(row(str(i)))
+    threads = [threading.Thread(target=delta.finish) for delta in exports]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    state = json.loads((agent_d.EXPORTS_DIR / agent_d.EXPORT_STATE_FILE).read_text(encoding="utf-8"))
+    assert sorted(state) == [str(i) for i in range(8)]
+    manifest = read_csv(agent_d.EXPORTS_DIR / agent_d.MANIFEST_FILE)
+    assert sorted(m["run_id"] for m in manifest) == [f"w{i}" for i in range(8)]
+
+
+def test_concurrent_header_checks_write_one_header(workdir):
+    path = workdir / "export.csv"
+
+    def append(i):
+        ensure_csv_headers(path)
+        with path.open("a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(row(str(i)))
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with path.open(newline="", encoding="utf-8") as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == HEADERS
+    assert sorted(line[ID] for line in lines[1:]) == [str(i) for i in range(8)]
@@ -0,0 +1,166 @@
+import csv
+import json
+from pathlib import Path
+
+import pytest
+
+import agent_d
+import batch_jobs
+import codec
+from batch_jobs import BatchJob, FakeBatchBackend, collect, poll, prepare_infer_job, prepare_match_job, submit
+
+RECORDS = [
+    {"internal_id": str(pid), "product_url": f"https://bags.qiqiyg.com/productinfoen_{pid}.html",
+     "title": f"Bag {pid}", "image_urls": []}
+    for pid in (655728, 655729, 655730)
+]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Every test runs in an empty working directory, like a fresh checkout."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def matched(request):
+    """A grounded Agent C answer: a confident match without URLs (nothing to fetch)."""
+    answer = {"match_found": True, "match_confidence": 0.9,
+              "official_brand": "Acme", "official_product_name": "Acme Tote"}
+    return {"candidates": [{"content": {"parts": [{"text": "Found it.\n" + json.dumps(answer)}]}}],
+            "usageMetadata": {"promptTokenCount": 100, "cachedContentTokenCount": 40}}
+
+
+def write_checkpoints():
+    for record in RECORDS:
+        raw = {**record, "product_internal_id": record["internal_id"], "raw_title": record["title"]}
+        codec.dump_file(f"checkpoint_{record['internal_id']}.json",
+                        {"raw": raw, "inference": {"inferred_brand": "Acme", "search_queries": ["acme tote"]}})
+
+
+def finished(job: BatchJob, backend: FakeBatchBackend) -> BatchJob:
+    job = submit(job, backend)
+    while job.state not in batch_jobs.TERMINAL_STATES:
+        job = poll(job, backend)
+    return job
+
+
+def export_ids(path: Path):
+    with path.open(newline="", encoding="utf-8") as f:
+        return [row["product_internal_id"] for row in csv.DictReader(f)]
+
+
+def test_prepare_writes_requests_and_sources():
+    job = prepare_infer_job(RECORDS, backend="fake")
+
+    assert job.state == "prepared" and job.request_count == 3
+    requests = list(codec.iter_jsonl(job.requests_path))
+    assert [r["key"] for r in requests] == ["655728", "655729", "655730"]
+    assert requests[0]["request"]["generation_config"]["response_schema"]
+    assert [s["raw"]["product_internal_id"] for s in codec.iter_jsonl(job.sources_path)] == ["655728", "655729", "655730"]
+    assert BatchJob.load(job.job_id) == job
+
+
+def test_prepare_skips_products_with_checkpoints():
+    codec.dump_file("checkpoint_655729.json", {"raw": {}, "inference": {}})
+    assert prepare_infer_job(RECORDS, backend="fake").request_count == 2
+
+
+def test_submit_and_poll_until_finished():
+    backend = FakeBatchBackend(polls_to_complete=2)
+    job = submit(prepare_infer_job(RECORDS, backend="fake"), backend)
+    assert job.state == "submitted" and job.provider_name
+
+    assert poll(job, backend).state == "running"
+    # Nothing to collect until the provider reports success
+    assert collect(job, backend, repair_fields=False).state == "running"
+    assert poll(job, backend).state == "succeeded"
+    assert BatchJob.load(job.job_id).state == "succeeded"
+
+
+def test_collect_infer_writes_checkpoints_in_job_output(workdir):
+    job = finished(prepare_infer_job(RECORDS, backend="fake"), FakeBatchBackend())
+    job = collect(job, FakeBatchBackend(), repair_fields=False)
+
+    assert job.state == "collected"
+    assert not list(workdir.glob("checkpoint_*.json"))
+    checkpoint = codec.load_file(job.output_dir / "checkpoint_655730.json")
+    assert checkpoint["raw"]["product_internal_id"] == "655730"
+    assert checkpoint["inference"]["product_internal_id"] == "655730"
+
+
+def test_collect_match_never_touches_working_files(workdir):
+    write_checkpoints()
+    backend = FakeBatchBackend(respond=matched)
+    job = finished(prepare_match_job(backend="fake"), backend)
+    job = collect(job, backend, repair_fields=False)
+
+    assert job.state == "collected"
+    for name in ("match_655730.json", agent_d.CSV_PATH.name, "runs_log.csv", "exports"):
+        assert not (workdir / name).exists()
+    out = job.output_dir
+    assert codec.load_file(out / "match_655730.json")["official_brand"] == "Acme"
+    assert sorted(export_ids(out / agent_d.CSV_PATH)) == ["655728", "655729", "655730"]
+    assert (out / "exports" / f"delta_{job.run_id}.csv").exists()
+    with (out / "runs_log.csv").open(newline="", encoding="utf-8") as f:
+        run = list(csv.DictReader(f))[-1]
+    assert run["run_id"] == job.run_id and run["matched_products"] == "3"
+    assert run["prompt_tokens"] == "300" and run["cached_prompt_tokens"] == "120"
+
+
+def test_collect_resumes_after_interruption(monkeypatch):
+    write_checkpoints()
+    backend = FakeBatchBackend(respond=matched)
+    job = finished(prepare_match_job(backend="fake"), backend)
+
+    write_product_row = agent_d.write_product_row
+    calls = []
+
+    def interrupted(row, *args, **kwargs):
+        calls.append(row[agent_d.HEADERS.index("product_internal_id")])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return write_product_row(row, *args, **kwargs)
+
+    monkeypatch.setattr(agent_d, "write_product_row", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        collect(job, backend, repair_fields=False)
+    monkeypatch.setattr(agent_d, "write_product_row", write_product_row)
+
+    job = BatchJob.load(job.job_id)
+    assert job.state == "succeeded"
+    assert job.collected_path.read_text(encoding="utf-8").split() == [calls[0]]
+
+    job = collect(job, backend, repair_fields=False)
+
+    assert job.state == "collected"
+    assert sorted(job.collected_path.read_text(encoding="utf-8").split()) == ["655728", "655729", "655730"]
+    # The product written before the interruption is not exported twice
+    assert sorted(export_ids(job.output_dir / agent_d.CSV_PATH)) == ["655728", "655729", "655730"]
+    # ...but it is still part of the run's delta and stats
+    delta_path = job.output_dir / "exports" / f"delta_{job.run_id}.csv"
+    with delta_path.open(newline="", encoding="utf-8") as f:
+        delta = list(csv.DictReader(f))
+    assert sorted(row["product_internal_id"] for row in delta) == ["655728", "655729", "655730"]
+    assert {row["change_type"] for row in delta} == {"added"}
+    with (job.output_dir / "runs_log.csv").open(newline="", encoding="utf-8") as f:
+        run = list(csv.DictReader(f))[-1]
+    assert run["run_id"] == job.run_id and run["matched_products"] == "3"
+    # A collected job is left alone
+    assert collect(job, backend, repair_fields=False).state == "collected"
+
+
+def test_failed_results_are_not_collected():
+    def flaky(request):
+        return {} if "655729" in json.dumps(request) else matched(request)
+
+    write_checkpoints()
+    backend = FakeBatchBackend(respond=flaky)
+    job = collect(finished(prepare_match_job(backend="fake"), backend), backend, repair_fields=False)
+
+    assert sorted(job.collected_path.read_text(encoding="utf-8").split()) == ["655728", "655730"]
+    assert not (job.output_dir / "match_655729.json").exists()
+
+
+def test_live_jobs_write_to_working_directory():
+    assert BatchJob(job_id="x", stage="match", backend="gemini").output_dir == Path(".")
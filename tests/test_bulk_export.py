@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from agent_d import build_product_row, needs_review_flag
+from bulk_export import build_rows
+from media_store import MediaStore
+
+RAW = {
+    "product_internal_id": "655728",
+    "category_id": "44188",
+    "product_page_url": "https://bags.qiqiyg.com/productinfoen_655728.html",
+    "raw_title": "Tote",
+    "raw_price_text": "¥1,200",
+    "image_urls": ["https://bags.qiqiyg.com/logo.png", "https://bags.qiqiyg.com/a.jpg",
+                   "https://bags.qiqiyg.com/b.jpg"],
+}
+MATCH = {"match_found": True, "match_confidence": 0.9, "official_brand": "Acme", "official_price": "$1,500"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store where a.jpg was mirrored by an earlier --mirror-media run."""
+    store = MediaStore(root=tmp_path / "media")
+    name = "0f" * 32 + ".jpg"
+    path = store.object_path(name)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"\xff\xd8\xff")
+    store._link("https://bags.qiqiyg.com/a.jpg", name, "image/jpeg")
+    return store
+
+
+def test_rows_match_the_per_product_export():
+    records = [(RAW, {"inferred_brand": "Other"}, MATCH), ({**RAW, "image_urls": []}, {}, {"match_found": False})]
+    rows = build_rows(records)
+    assert [list(row) for row in rows] == [build_product_row(raw, match, inference)
+                                           for raw, inference, match in records]
+
+
+def test_mirrored_images_keep_their_local_urls(store):
+    row = list(build_rows([(RAW, {}, MATCH)], media_store=store)[0])
+    expected = build_product_row(RAW, MATCH, {})
+    local = store.lookup("https://bags.qiqiyg.com/a.jpg")
+    assert local.startswith("/media/")
+    # Same row as a run with --mirror-media; the never-mirrored b.jpg keeps its remote URL
+    assert row == [local if value == "https://bags.qiqiyg.com/a.jpg" else value for value in expected]
+    assert "https://bags.qiqiyg.com/b.jpg" in row
+
+
+def test_missing_confidence_needs_review():
+    match = {"match_found": True, "match_confidence": None}
+    assert needs_review_flag(match) == "YES"
+    assert build_rows([(RAW, {}, match)])[0][-1] == "YES"
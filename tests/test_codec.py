@@ -0,0 +1,82 @@
+import importlib.util
+import json
+
+import pytest
+
+import codec
+from models import RawProductRecord
+
+BACKENDS = [name for name in ("orjson", "msgspec") if importlib.util.find_spec(name)] + ["json"]
+
+DOC = {
+    "product_internal_id": "655730",
+    "title": "Sac à main – 手提包 👜",
+    "image_urls": ["https://bags.qiqiyg.com/upfile/product/_655730.png"],
+    "match_found": True,
+    "notes": None,
+    "nested": {"count": 3, "empty": [], "quote": "say \"hi\"\n"},
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    """Forces codec onto one backend by hiding the faster ones."""
+    name = request.param
+    if name != "orjson":
+        monkeypatch.setattr(codec, "orjson", None)
+    if name == "json":
+        monkeypatch.setattr(codec, "msgspec", None)
+    return name
+
+
+def test_indented_output_matches_json_dump(backend):
+    assert codec.dumps(DOC, indent=True) == json.dumps(DOC, indent=2).encode("ascii")
+
+
+def test_compact_output_matches_compact_json(backend):
+    assert codec.dumps(DOC) == json.dumps(DOC, separators=(",", ":")).encode("ascii")
+
+
+def test_non_ascii_is_escaped(backend):
+    data = codec.dumps({"s": "é👜"})
+    assert data.isascii()
+    assert b"\\u00e9\\ud83d\\udc5c" in data
+    assert codec.loads(data) == {"s": "é👜"}
+
+
+def test_floats_round_trip(backend):
+    values = {"big": 1e16, "small": 1.5e-7, "confidence": 0.85}
+    assert codec.loads(codec.dumps(values, indent=True)) == values
+
+
+def test_records_and_collections_are_serialized(backend):
+    record = RawProductRecord(product_url="https://x/productinfoen_1.html", internal_id="1", image_urls=["a"])
+    data = codec.loads(codec.dumps({"record": record, "tags": ("a", "b")}))
+    assert data["record"]["internal_id"] == "1"
+    assert data["record"]["image_urls"] == ["a"]
+    assert data["tags"] == ["a", "b"]
+
+
+def test_unserializable_object_raises(backend):
+    with pytest.raises(TypeError):
+        codec.dumps({"x": object()})
+
+
+def test_files_round_trip(backend, tmp_path):
+    path = tmp_path / "match_655730.json"
+    codec.dump_file(path, DOC)
+    assert codec.load_file(path) == DOC
+
+
+def test_jsonl_streaming_skips_malformed_lines(backend, tmp_path):
+    path = tmp_path / "records.jsonl"
+    assert codec.write_jsonl(path, [{"n": 1}, {"n": 2}]) == 2
+    with path.open("ab") as f:
+        f.write(b"\n{not json\n")
+    with codec.JsonlWriter(path, append=True) as writer:
+        writer.write({"n": 3})
+    assert list(codec.iter_jsonl(path)) == [{"n": 1}, {"n": 2}, {"n": 3}]
+
+
+def test_binary_round_trip(backend):
+    assert codec.loads_binary(codec.dumps_binary(DOC)) == DOC
@@ -0,0 +1,101 @@
+import math
+
+import pytest
+
+import crawl_state
+from crawl_state import BloomFilter, CrawlFrontier, ProductIdSet, SQLiteVisitedSet, canonical_url
+
+
+def test_canonical_url_dedupes_equivalent_links():
+    assert canonical_url("HTTPS://Bags.QiQiYG.com:443/producten_1.html?path=0_2&b=1#top") == \
+        "https://bags.qiqiyg.com/producten_1.html?b=1&path=0_2"
+    assert canonical_url("http://example.com") == "http://example.com/"
+    assert canonical_url("http://example.com:8080/a") == "http://example.com:8080/a"
+
+
+def test_frontier_spills_to_disk_in_fifo_order():
+    frontier = CrawlFrontier(memory_items=3)
+    for i in range(10):
+        frontier.push(f"u{i}", i)
+    assert len(frontier) == 10 and frontier._spilled == 7
+
+    popped = [frontier.pop() for _ in range(5)]
+    # Pushed while entries are on disk: queued behind them
+    frontier.push("late", 99)
+    popped += [frontier.pop() for _ in range(len(frontier))]
+    assert popped == [(f"u{i}", i) for i in range(10)] + [("late", 99)]
+    assert len(frontier) == 0
+    frontier.close()
+
+
+def test_drained_spill_file_is_reused():
+    frontier = CrawlFrontier(memory_items=2)
+    for round_ in range(3):
+        for i in range(5):
+            frontier.push(f"r{round_}-{i}", round_)
+        assert [frontier.pop()[0] for _ in range(5)] == [f"r{round_}-{i}" for i in range(5)]
+        assert frontier._read_offset == 0
+    with pytest.raises(IndexError):
+        frontier.pop()
+    frontier.close()
+
+
+def test_bloom_filter_sizing():
+    bloom = BloomFilter(capacity=1_000_000, error_rate=0.001)
+    # m = -n ln p / (ln 2)^2 bits, k = m/n ln 2 hashes: ~1.8 MB and 10 hashes
+    assert bloom.num_bits == int(-1_000_000 * math.log(0.001) / math.log(2) ** 2)
+    assert 1.7e6 < len(bloom.bits) < 1.9e6
+    assert bloom.num_hashes == 10
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(capacity=20_000, error_rate=0.01)
+    keys = [f"https://example.com/p/{i}" for i in range(20_000)]
+    assert all(bloom.add(k) for k in keys[:100])
+    for k in keys[100:]:
+        bloom.add(k)
+    assert all(k in bloom for k in keys)
+    assert not bloom.add(keys[0])
+
+    false_positives = sum(f"https://example.com/q/{i}" in bloom for i in range(20_000))
+    assert false_positives / 20_000 < 0.02
+
+
+def test_bloom_filter_warns_past_capacity(caplog):
+    bloom = BloomFilter(capacity=10, error_rate=0.01)
+    for i in range(20):
+        bloom.add(f"k{i}")
+    assert "exceeded its capacity" in caplog.text
+
+
+def test_sqlite_visited_set_is_exact(tmp_path, monkeypatch):
+    monkeypatch.setattr(crawl_state, "SQLITE_COMMIT_EVERY", 10)
+    visited = SQLiteVisitedSet(tmp_path / "visited.db")
+    assert all(visited.add(f"u{i}") for i in range(25))
+    assert not visited.add("u3")
+    assert "u24" in visited and "u25" not in visited
+    visited.close()
+
+    reopened = SQLiteVisitedSet(tmp_path / "visited.db")
+    assert "u0" in reopened and not reopened.add("u24")
+    reopened.close()
+    assert (tmp_path / "visited.db").exists()
+
+
+def test_temporary_sqlite_visited_set_is_removed():
+    visited = SQLiteVisitedSet()
+    visited.add("u")
+    path = visited.path
+    assert path.exists()
+    visited.close()
+    assert not path.exists()
+
+
+def test_product_id_set():
+    ids = ProductIdSet()
+    assert ids.add(655728) and ids.add(7) and ids.add(0)
+    assert not ids.add(655728)
+    assert 655728 in ids and 7 in ids and 0 in ids
+    assert 655729 not in ids and 10_000_000 not in ids
+    assert ids.count == 3
+    assert len(ids.bits) >= 655728 // 8 + 1
@@ -0,0 +1,178 @@
+import json
+
+import httpx
+import pytest
+
+import fetcher
+from fetcher import HostScheduler, parse_crawl_delay, parse_retry_after
+from resilience import Deadline, DeadlineExceeded
+
+HOST = "bags.qiqiyg.com"
+URL = f"https://{HOST}/productinfoen_1.html"
+
+
+class FakeClock:
+    """Stands in for the time module inside fetcher; responses advance it to simulate latency."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeSite:
+    """MockTransport handler: queued (status, headers, latency) answers, robots.txt on request."""
+
+    def __init__(self, clock, robots=None):
+        self.clock = clock
+        self.robots = robots
+        self.answers = []
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request.url.path)
+        if request.url.path == "/robots.txt":
+            return httpx.Response(200 if self.robots else 404, text=self.robots or "")
+        status, headers, latency = self.answers.pop(0) if self.answers else (200, {}, 0.1)
+        self.clock.now += latency
+        return httpx.Response(status, headers=headers, text="ok")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(fetcher, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def site(clock):
+    return FakeSite(clock)
+
+
+@pytest.fixture
+def scheduler(tmp_path, site):
+    sched = HostScheduler(state_path=tmp_path / "host_state.json", respect_robots=False)
+    sched.client.close()
+    sched.client = httpx.Client(transport=httpx.MockTransport(site))
+    yield sched
+    sched.client.close()
+
+
+def test_window_grows_additively_on_fast_responses(scheduler):
+    for _ in range(4):
+        scheduler.get(URL)
+    state = scheduler.hosts[HOST]
+    assert fetcher.INITIAL_WINDOW + 1.0 < state.window < fetcher.INITIAL_WINDOW + 2.0
+    assert state.requests == 4 and state.throttled == 0 and state.in_flight == 0
+
+    for _ in range(500):
+        scheduler.get(URL)
+    assert state.window == fetcher.MAX_WINDOW
+
+
+def test_window_halves_on_throttling_and_errors(scheduler, site):
+    scheduler.get(URL)
+    window = scheduler.hosts[HOST].window
+    site.answers = [(429, {}, 0.1), (500, {}, 0.1)]
+
+    assert scheduler.get(URL).status_code == 429
+    assert scheduler.hosts[HOST].window == window * fetcher.BACKOFF_FACTOR
+    scheduler.get(URL)
+    assert scheduler.hosts[HOST].window == fetcher.MIN_WINDOW
+    assert scheduler.hosts[HOST].throttled == 2
+
+
+def test_window_halves_on_a_latency_spike(scheduler, site):
+    for _ in range(5):
+        scheduler.get(URL)
+    window = scheduler.hosts[HOST].window
+    site.answers = [(200, {}, 5.0)]
+
+    scheduler.get(URL)
+    assert scheduler.hosts[HOST].window == window * fetcher.BACKOFF_FACTOR
+
+
+def test_window_limits_concurrent_requests(scheduler):
+    state = scheduler._acquire(HOST)
+    scheduler._acquire(HOST)
+    with pytest.raises(DeadlineExceeded):
+        scheduler._acquire(HOST, Deadline(0.05))
+    scheduler._release(HOST, state, 0.1, None)
+    assert scheduler.hosts[HOST].in_flight == 1
+
+
+def test_retry_after_blocks_the_host(scheduler, site, clock):
+    site.answers = [(503, {"Retry-After": "30"}, 0.0)]
+    scheduler.get(URL)
+    assert scheduler.hosts[HOST].blocked_until == clock.now + 30
+
+    with pytest.raises(DeadlineExceeded):
+        scheduler.get(URL, deadline=Deadline(5.0))
+    clock.now += 30
+    assert scheduler.get(URL, deadline=Deadline(5.0)).status_code == 200
+
+
+def test_retry_after_is_capped(scheduler, site, clock):
+    site.answers = [(429, {"Retry-After": "86400"}, 0.0)]
+    scheduler.get(URL)
+    assert scheduler.hosts[HOST].blocked_until == clock.now + fetcher.MAX_RETRY_AFTER
+
+
+def test_parse_retry_after_forms(clock):
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("Tue, 14 Nov 2023 22:14:20 GMT") == pytest.approx(60.0)  # clock: 22:13:20 GMT
+    assert parse_retry_after("soon") is None and parse_retry_after(None) is None
+
+
+def test_parse_crawl_delay_reads_the_wildcard_group():
+    robots = "User-agent: Googlebot\nCrawl-delay: 10\n\nUser-agent: *\nDisallow: /cart\nCrawl-delay: 1.5 # be nice\n"
+    assert parse_crawl_delay(robots) == 1.5
+    assert parse_crawl_delay("User-agent: Googlebot\nCrawl-delay: 10\n") is None
+
+
+def test_crawl_delay_spaces_requests(scheduler, site, clock):
+    site.robots = "User-agent: *\nCrawl-delay: 2.5\n"
+    scheduler.respect_robots = True
+
+    scheduler.get(URL)
+    assert scheduler.hosts[HOST].crawl_delay == 2.5
+    with pytest.raises(DeadlineExceeded):
+        scheduler.get(URL, deadline=Deadline(1.0))
+    clock.now += 2.5
+    scheduler.get(URL)
+    # robots.txt is read once per TTL
+    assert site.requests.count("/robots.txt") == 1
+
+
+def test_host_state_persists_across_runs(scheduler, site, tmp_path):
+    site.answers = [(429, {"Retry-After": "60"}, 0.1)]
+    scheduler.get(URL)
+    scheduler.hosts[HOST].crawl_delay = 2.0
+    scheduler.save()
+
+    saved = json.loads((tmp_path / "host_state.json").read_text(encoding="utf-8"))[HOST]
+    assert "in_flight" not in saved and "last_start" not in saved
+
+    reloaded = HostScheduler(state_path=tmp_path / "host_state.json", max_window=4.0)
+    reloaded.client.close()
+    state = reloaded.hosts[HOST]
+    assert state.window == scheduler.hosts[HOST].window
+    assert state.crawl_delay == 2.0 and state.throttled == 1
+    assert state.blocked_until == scheduler.hosts[HOST].blocked_until
+    assert state.in_flight == 0
+
+
+def test_reloaded_window_is_clamped(tmp_path):
+    (tmp_path / "host_state.json").write_text(json.dumps({HOST: {"window": 99.0, "unknown": 1}}), encoding="utf-8")
+    sched = HostScheduler(state_path=tmp_path / "host_state.json", max_window=4.0)
+    sched.client.close()
+    assert sched.hosts[HOST].window == 4.0
+
+
+def test_unreadable_state_is_ignored(tmp_path):
+    (tmp_path / "host_state.json").write_text("{not json", encoding="utf-8")
+    sched = HostScheduler(state_path=tmp_path / "host_state.json")
+    sched.client.close()
+    assert sched.hosts == {}
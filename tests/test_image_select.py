@@ -0,0 +1,23 @@
+from image_select import rank_images, url_score
+
+UPLOADS = "https://bags.qiqiyg.com/upfile/product/2024"
+
+
+def names(candidates):
+    return [c.url.rsplit("/", 1)[-1] for c in candidates]
+
+
+def test_own_product_shot_ranks_before_neighbours():
+    urls = [f"{UPLOADS}/_6557{n}.png" for n in (26, 27, 28, 29, 30)] + ["https://bags.qiqiyg.com/images/logo.png"]
+    ranked = rank_images(urls, probe=False, product_id="655730")
+    assert names(ranked) == ["_655730.png", "_655726.png", "_655727.png", "_655728.png", "_655729.png", "logo.png"]
+
+
+def test_product_id_must_match_a_whole_number():
+    assert url_score(f"{UPLOADS}/_6557301.png", "655730") == url_score(f"{UPLOADS}/_655729.png", "655730")
+    assert url_score(f"{UPLOADS}/655730_2.jpg", "655730") > url_score(f"{UPLOADS}/a.jpg", "655730")
+
+
+def test_without_probes_ties_keep_stored_order():
+    urls = [f"{UPLOADS}/b.jpg", f"{UPLOADS}/a.jpg", f"{UPLOADS}/b.jpg"]
+    assert names(rank_images(urls, probe=False)) == ["b.jpg", "a.jpg"]
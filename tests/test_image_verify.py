@@ -0,0 +1,161 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import image_verify
+from image_verify import (ACCEPT_SIMILARITY, REJECT_SIMILARITY, VERIFICATION_ACCEPTED, VERIFICATION_INCONCLUSIVE,
+                          VERIFICATION_REJECTED, VERIFICATION_SKIPPED, decide, image_array, similarity_scores,
+                          verify_match)
+
+
+def packshot(kind: str = "bag", scale: float = 1.0, color=(200, 40, 40), offset=(0, 0),
+             background=(255, 255, 255), size: int = 400) -> Image.Image:
+    """A flat product drawing on a plain backdrop, like a catalogue packshot."""
+    img = Image.new("RGB", (size, size), background)
+    draw = ImageDraw.Draw(img)
+    cx, cy = size / 2 + offset[0], size / 2 + offset[1]
+    r = size * 0.35 * scale
+    if kind == "bag":
+        draw.rectangle([cx - r, cy - r * 0.6, cx + r, cy + r], fill=color)
+        draw.arc([cx - r * 0.5, cy - r * 1.3, cx + r * 0.5, cy - r * 0.2], 180, 360,
+                 fill=(40, 40, 40), width=max(2, int(r * 0.08)))
+        draw.rectangle([cx - r * 0.2, cy - r * 0.2, cx + r * 0.2, cy], fill=(230, 200, 60))
+    elif kind == "circle":
+        draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=color)
+    elif kind == "triangle":
+        draw.polygon([(cx, cy - r), (cx - r, cy + r), (cx + r, cy + r)], fill=color)
+    elif kind == "shoe":
+        draw.polygon([(cx - r, cy), (cx - r * 0.3, cy - r * 0.5), (cx, cy - r * 0.2), (cx + r, cy + r * 0.2),
+                      (cx + r, cy + r * 0.5), (cx - r, cy + r * 0.5)], fill=color)
+    return img
+
+
+def noise(seed: int, size: int = 400) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+
+
+def encode(img: Image.Image, fmt: str = "PNG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def combined(a: Image.Image, b: Image.Image) -> float:
+    scores = similarity_scores(image_array(encode(a)), image_array(encode(b))[None])
+    return float(scores["combined"][0])
+
+
+SAME_PRODUCT = {
+    "identical": (packshot(), packshot()),
+    "smaller": (packshot(), packshot(scale=0.55)),
+    "off-centre": (packshot(), packshot(offset=(40, 20))),
+    "grey backdrop": (packshot(), packshot(background=(235, 235, 235))),
+    "recompressed": (packshot(), Image.open(io.BytesIO(encode(packshot(scale=0.6), "JPEG", quality=40)))),
+    "other shape": (packshot("shoe"), packshot("shoe", scale=0.6)),
+}
+
+UNRELATED = {
+    "bag vs circle": (packshot(), packshot("circle")),
+    "bag vs triangle": (packshot(), packshot("triangle", color=(30, 120, 30))),
+    "bag vs shoe": (packshot(), packshot("shoe")),
+    "circle vs triangle": (packshot("circle"), packshot("triangle")),
+    "noise pair": (noise(1), noise(2)),
+    "bag vs noise": (packshot(), noise(3)),
+}
+
+
+@pytest.mark.parametrize("pair", SAME_PRODUCT.values(), ids=SAME_PRODUCT.keys())
+def test_same_product_scores_above_accept(pair):
+    assert combined(*pair) >= ACCEPT_SIMILARITY
+
+
+@pytest.mark.parametrize("pair", UNRELATED.values(), ids=UNRELATED.keys())
+def test_unrelated_images_score_below_reject(pair):
+    assert combined(*pair) <= REJECT_SIMILARITY
+
+
+def test_crop_ignores_plain_backdrop():
+    big, small = image_array(encode(packshot())), image_array(encode(packshot(scale=0.5, offset=(-60, 30))))
+    assert np.abs(big - small).mean() < 0.05
+
+
+def test_decide_paths():
+    assert decide(None, True, 0.9) == VERIFICATION_SKIPPED
+    assert decide(0.9, False, 0.9) == VERIFICATION_SKIPPED
+    assert decide(ACCEPT_SIMILARITY, True, 0.6) == VERIFICATION_ACCEPTED
+    # Image agreement alone never accepts a match the model was unsure about
+    assert decide(0.95, True, 0.3) == VERIFICATION_INCONCLUSIVE
+    assert decide(REJECT_SIMILARITY, True, 0.3) == VERIFICATION_REJECTED
+    # A confident match is never rejected on images alone
+    assert decide(0.1, True, 0.9) == VERIFICATION_INCONCLUSIVE
+    assert decide((ACCEPT_SIMILARITY + REJECT_SIMILARITY) / 2, True, 0.6) == VERIFICATION_INCONCLUSIVE
+
+
+@pytest.fixture
+def images(monkeypatch):
+    """Serves drawn images from memory in place of fetching URLs."""
+    served = {}
+    monkeypatch.setattr(image_verify, "load_image", lambda url, deadline=None: image_array(encode(served[url])))
+    return served
+
+
+def make_match(confidence: float) -> dict:
+    return {
+        "match_found": True,
+        "match_confidence": confidence,
+        "official_brand": "Acme",
+        "official_product_name": "Acme Tote",
+        "official_page_url": "https://acme.example/tote",
+        "official_main_image_url": "https://acme.example/tote.jpg",
+        "notes": "",
+    }
+
+
+RAW = {"product_internal_id": "655730", "image_urls": ["https://s.example/logo.png", "https://s.example/a.jpg",
+                                                       "https://s.example/b.jpg"]}
+
+
+def test_verify_match_accepts_same_product(images):
+    images["https://acme.example/tote.jpg"] = packshot()
+    images["https://s.example/a.jpg"] = packshot("circle")
+    images["https://s.example/b.jpg"] = packshot(scale=0.6, offset=(30, -20))
+
+    result = verify_match(RAW, make_match(0.7))
+
+    assert result["verification"] == VERIFICATION_ACCEPTED
+    assert result["image_similarity"] >= ACCEPT_SIMILARITY
+    assert result["match_found"] is True
+
+
+def test_verify_match_rejects_unrelated_uncertain_match(images):
+    images["https://acme.example/tote.jpg"] = packshot()
+    images["https://s.example/a.jpg"] = packshot("circle")
+    images["https://s.example/b.jpg"] = packshot("triangle", color=(30, 120, 30))
+
+    result = verify_match(RAW, make_match(0.5))
+
+    assert result["verification"] == VERIFICATION_REJECTED
+    assert result["match_found"] is False
+    assert result["official_brand"] is None and result["official_main_image_url"] is None
+    assert "Image verification rejected" in result["notes"]
+
+
+def test_verify_match_leaves_confident_mismatch_inconclusive(images):
+    images["https://acme.example/tote.jpg"] = packshot()
+    images["https://s.example/a.jpg"] = noise(4)
+    images["https://s.example/b.jpg"] = packshot("shoe")
+
+    result = verify_match(RAW, make_match(0.95))
+
+    assert result["verification"] == VERIFICATION_INCONCLUSIVE
+    assert result["match_found"] is True
+    assert result["official_brand"] == "Acme"
+
+
+def test_verify_match_skips_without_images(images):
+    result = verify_match({"image_urls": []}, make_match(0.9))
+    assert result["verification"] == VERIFICATION_SKIPPED
+    assert result["image_similarity"] is None
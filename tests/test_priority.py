@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import codec
+import resilience
+from priority import (Candidate, PriorityConfig, RunBudget, candidate_from_checkpoint, candidate_from_url,
+                      matched_before, rank)
+from resilience import Deadline
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 50.0
+
+    def monotonic(self):
+        return self.now
+
+
+def keys(candidates):
+    return [c.key for c in candidates]
+
+
+def test_newer_and_pricier_products_come_first():
+    candidates = [
+        Candidate("old-cheap", product_id=100, price=10.0),
+        Candidate("new-cheap", product_id=200, price=10.0),
+        Candidate("old-pricey", product_id=100, price=1000.0),
+        Candidate("new-pricey", product_id=200, price=1000.0),
+    ]
+    # Price is log-scaled, so freshness outweighs a 100x price gap
+    assert keys(rank(candidates)) == ["new-pricey", "new-cheap", "old-pricey", "old-cheap"]
+
+
+def test_unknown_signals_score_in_the_middle():
+    ranked = rank([Candidate("known-low", product_id=1, price=1.0),
+                   Candidate("unknown"),
+                   Candidate("known-high", product_id=3, price=1000.0)])
+    assert keys(ranked) == ["known-high", "unknown", "known-low"]
+
+
+def test_category_weights_scale_the_score():
+    config = PriorityConfig(category_weights={"44188": 4.0})
+    ranked = rank([Candidate("a", product_id=5, category_id="1"),
+                   Candidate("b", product_id=5, category_id="44188"),
+                   Candidate("c", product_id=6, category_id="1")], config)
+    assert keys(ranked) == ["b", "c", "a"]
+
+
+def test_matched_products_are_pushed_back():
+    ranked = rank([Candidate("matched", product_id=200, price=1000.0, matched_before=True),
+                   Candidate("new", product_id=190, price=1000.0)])
+    assert keys(ranked) == ["new", "matched"]
+    assert [c.score for c in ranked] == pytest.approx([1.0, 2.0 - 1.5])
+
+
+def test_only_successful_matches_count_as_matched():
+    codec.dump_file("match_1.json", {"match_found": True, "match_confidence": 0.9})
+    codec.dump_file("match_2.json", {"match_found": False, "match_confidence": 0.1})
+    codec.dump_file("match_3.json", {"match_found": True, "notes": "Error during matching: quota"})
+    with open("match_4.json", "w", encoding="utf-8") as f:
+        f.write("{broken")
+
+    assert matched_before("1")
+    assert not any(matched_before(pid) for pid in ("2", "3", "4", "5", None))
+
+
+def test_candidates_from_checkpoints_and_urls():
+    codec.dump_file("match_655728.json", {"match_found": True})
+    raw = {"product_internal_id": "655728", "category_id": "44188", "raw_price_text": "$1,250"}
+    c = candidate_from_checkpoint("checkpoint_655728.json", raw)
+    assert (c.product_id, c.category_id, c.price, c.matched_before) == (655728, "44188", 1250.0, True)
+
+    c = candidate_from_url("https://bags.qiqiyg.com/productinfoen_655729.html?path=0_37771_44188")
+    assert (c.product_id, c.category_id, c.price, c.matched_before) == (655729, "44188", None, False)
+
+
+def test_config_loads_weights_and_rejects_unknown_keys(workdir):
+    path = workdir / "priority.json"
+    path.write_text(json.dumps({"category_weights": {44188: 2}, "matched_penalty": 2.0}), encoding="utf-8")
+    config = PriorityConfig.load(path)
+    assert config.category_weights == {"44188": 2.0} and config.matched_penalty == 2.0
+
+    path.write_text(json.dumps({"matched_penalty": 2.0, "matchd_penalty": 3.0}), encoding="utf-8")
+    with pytest.raises(ValueError, match="matchd_penalty"):
+        PriorityConfig.load(path)
+
+    path.write_text("[1, 2]", encoding="utf-8")
+    with pytest.raises(ValueError):
+        PriorityConfig.load(path)
+
+    assert PriorityConfig.load(workdir / "missing.json") == PriorityConfig()
+
+
+def test_call_budget_is_exhausted():
+    budget = RunBudget(max_model_calls=2)
+    assert budget.exhausted(1) is None
+    assert budget.exhausted(2) == "model-call budget of 2 reached"
+    assert RunBudget().exhausted(10_000) is None
+
+
+def test_time_budget_is_exhausted_and_caps_product_deadlines(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, "time", clock)
+    budget = RunBudget(seconds=60)
+
+    assert budget.cap(Deadline(30)).remaining() == 30
+    clock.now += 45
+    assert budget.exhausted() is None
+    assert budget.cap(Deadline(30)).remaining() == 15
+    clock.now += 15
+    assert budget.exhausted() == "time budget of 60s reached"
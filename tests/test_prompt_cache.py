@@ -0,0 +1,109 @@
+import pytest
+
+import prompt_cache
+from prompt_cache import CachedPrefix
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(prompt_cache, "time", fake)
+    return fake
+
+
+class FakeServer:
+    """Records create/refresh/delete calls and counts tokens on demand."""
+
+    def __init__(self, tokens=2000, count_error=None):
+        self.tokens = tokens
+        self.count_error = count_error
+        self.calls = []
+
+    def count(self):
+        self.calls.append("count")
+        if self.count_error:
+            raise self.count_error
+        return self.tokens
+
+    def create(self, ttl):
+        self.calls.append(("create", ttl))
+        return f"cache-{len(self.calls)}"
+
+    def refresh(self, handle, ttl):
+        self.calls.append(("refresh", handle))
+
+    def delete(self, handle):
+        self.calls.append(("delete", handle))
+
+    def prefix(self, **kwargs):
+        return CachedPrefix("test", self.create, self.refresh, self.delete, count_fn=self.count,
+                            ttl=3600, enabled=True, min_tokens=1024, **kwargs)
+
+
+def test_prefix_below_the_minimum_is_sent_inline(clock):
+    server = FakeServer(tokens=400)
+    cache = server.prefix()
+
+    assert cache.get() is None
+    assert cache.get() is None
+    # Counted once, never created, and disabled for the rest of the run
+    assert server.calls == ["count"]
+    assert cache.tokens == 400 and not cache.enabled
+
+
+def test_prefix_above_the_minimum_is_created_once(clock):
+    server = FakeServer(tokens=2000)
+    cache = server.prefix()
+
+    handle = cache.get()
+    assert handle is not None and cache.get() == handle
+    assert server.calls == ["count", ("create", 3600)]
+
+
+def test_count_failure_still_tries_to_create(clock):
+    server = FakeServer(count_error=RuntimeError("quota"))
+    assert server.prefix().get() is not None
+    assert ("create", 3600) in server.calls
+
+
+def test_prefix_is_extended_near_expiry_and_recreated_after(clock):
+    server = FakeServer()
+    cache = server.prefix()
+    handle = cache.get()
+
+    clock.now += 3600 - 100
+    assert cache.get() == handle
+    assert server.calls[-1] == ("refresh", handle)
+
+    clock.now += 3600 + 1
+    assert cache.get() != handle
+
+
+def test_failed_create_backs_off(clock):
+    server = FakeServer()
+
+    def failing(ttl):
+        raise RuntimeError("unavailable")
+
+    cache = CachedPrefix("test", failing, count_fn=server.count, enabled=True, min_tokens=1024)
+    assert cache.get() is None
+    cache.create_fn = server.create
+    assert cache.get() is None
+    clock.now += prompt_cache.CREATE_RETRY_AFTER
+    assert cache.get() is not None
+
+
+def test_release_deletes_the_cache(clock):
+    server = FakeServer()
+    cache = server.prefix()
+    handle = cache.get()
+    cache.release()
+    assert server.calls[-1] == ("delete", handle) and cache.handle is None
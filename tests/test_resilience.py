@@ -0,0 +1,243 @@
+import threading
+
+import httpx
+import pytest
+
+import resilience
+from resilience import (CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, hedged_call,
+                        is_transient_error, product_deadline, retry_call)
+
+
+class FakeClock:
+    """Stands in for the time module inside resilience: sleep() just advances the clock."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience, "time", fake)
+    # Full jitter at its maximum, so the schedule is deterministic
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: high)
+    return fake
+
+
+class Flaky:
+    """Raises the queued errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def status_error(code):
+    request = httpx.Request("GET", "https://example.com/")
+    return httpx.HTTPStatusError(str(code), request=request, response=httpx.Response(code, request=request))
+
+
+def test_transient_errors_are_retried_with_exponential_backoff(clock):
+    fn = Flaky(ConnectionError("reset"), status_error(503), TimeoutError())
+    assert retry_call(fn, attempts=4) == "ok"
+    assert fn.calls == 4
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+
+
+def test_backoff_is_capped(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 5.0)
+    fn = Flaky(*[ConnectionError()] * 3)
+    retry_call(fn, attempts=4)
+    assert clock.sleeps == [5.0, resilience.RETRY_MAX_DELAY, resilience.RETRY_MAX_DELAY]
+
+
+def test_permanent_errors_and_exhausted_attempts_raise(clock):
+    fn = Flaky(status_error(404))
+    with pytest.raises(httpx.HTTPStatusError):
+        retry_call(fn)
+    assert fn.calls == 1
+
+    fn = Flaky(*[ConnectionError()] * 5)
+    with pytest.raises(ConnectionError):
+        retry_call(fn, attempts=3)
+    assert fn.calls == 3
+
+
+def test_retries_never_sleep_past_the_deadline(clock):
+    deadline = Deadline(2.0)
+    fn = Flaky(*[ConnectionError()] * 5)
+    with pytest.raises(ConnectionError):
+        retry_call(fn, deadline)
+    # 0.5s and 1.0s fit in the budget; the 2.0s backoff would not
+    assert clock.sleeps == [0.5, 1.0]
+    assert not deadline.expired()
+
+
+def test_expired_deadline_fails_before_calling(clock):
+    deadline = Deadline(1.0)
+    clock.now += 1.0
+    fn = Flaky()
+    with pytest.raises(DeadlineExceeded):
+        retry_call(fn, deadline, what="GET x")
+    assert fn.calls == 0
+
+
+def test_deadline_splits_across_stages(clock):
+    deadline = product_deadline(budget=100.0)
+    assert deadline.for_stage("scrape", ["scrape", "infer", "match"]).remaining() == pytest.approx(15.0)
+    # A fast scrape leaves more for the remaining stages
+    clock.now += 5.0
+    assert deadline.for_stage("infer", ["infer", "match"]).remaining() == pytest.approx(95.0 * 0.35 / 0.85)
+    assert product_deadline(["match"], budget=100.0).remaining() == pytest.approx(50.0)
+    assert deadline.timeout(15.0) == 15.0
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker("host", failure_threshold=3, reset_timeout=30.0)
+    for _ in range(3):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    clock.now += 30.0
+    assert breaker.state == "half-open"
+    breaker.allow()
+    # Only one probe goes through while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("host", failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30.0
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 29.0
+    assert breaker.state == "open"
+
+
+def test_retry_call_feeds_the_breaker(clock):
+    breaker = CircuitBreaker("api", failure_threshold=2)
+    with pytest.raises(ConnectionError):
+        retry_call(Flaky(*[ConnectionError()] * 2), attempts=2, breaker=breaker)
+    fn = Flaky()
+    with pytest.raises(CircuitOpenError):
+        retry_call(fn, breaker=breaker)
+    assert fn.calls == 0
+
+    # A permanent error still proves the dependency is up
+    breaker = CircuitBreaker("api", failure_threshold=2)
+    breaker.record_failure()
+    with pytest.raises(ValueError):
+        retry_call(Flaky(ValueError("bad request")), breaker=breaker)
+    assert breaker.failures == 0
+
+
+def test_transient_error_classification():
+    assert is_transient_error(ConnectionError())
+    assert is_transient_error(httpx.ConnectTimeout("slow"))
+    assert is_transient_error(status_error(429))
+    assert not is_transient_error(status_error(404))
+    assert not is_transient_error(DeadlineExceeded())
+    assert not is_transient_error(CircuitOpenError())
+    assert not is_transient_error(ValueError())
+
+
+class SlowOnce:
+    """The first call blocks until released; later calls return at once."""
+
+    def __init__(self, first_error=None):
+        self.release = threading.Event()
+        self.first_error = first_error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            self.release.wait(5.0)
+            if self.first_error:
+                raise self.first_error
+            return "primary"
+        return "hedge"
+
+
+def test_fast_call_is_not_hedged():
+    fn = Flaky()
+    assert hedged_call(fn, hedge_after=1.0) == "ok"
+    assert fn.calls == 1
+
+
+def test_slow_call_is_hedged():
+    fn = SlowOnce()
+    try:
+        assert hedged_call(fn, hedge_after=0.05) == "hedge"
+        assert fn.calls == 2
+    finally:
+        fn.release.set()
+
+
+def test_failed_hedge_waits_for_the_primary():
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5.0)
+            return "primary"
+        release.set()
+        raise ConnectionError("hedge failed")
+
+    assert hedged_call(fn, hedge_after=0.05) == "primary"
+
+
+def test_both_failures_raise():
+    fn = SlowOnce(first_error=ConnectionError("primary failed"))
+
+    def failing_hedge():
+        result = fn()
+        if result == "hedge":
+            fn.release.set()
+            raise TimeoutError("hedge failed")
+        return result
+
+    with pytest.raises((ConnectionError, TimeoutError)):
+        hedged_call(failing_hedge, hedge_after=0.05)
+
+
+def test_hedged_call_respects_the_deadline():
+    release = threading.Event()
+
+    def stuck():
+        release.wait(5.0)
+        return "late"
+
+    try:
+        with pytest.raises(DeadlineExceeded):
+            hedged_call(stuck, hedge_after=0.02, deadline=Deadline(0.1))
+    finally:
+        release.set()
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from models import InferenceResult, OfficialMatchResult
+from structured_output import IncrementalJsonParser, check_grounded, parse_stream, parse_text, repair
+
+MATCH = {
+    "product_internal_id": "655728",
+    "match_found": True,
+    "match_confidence": 0.85,
+    "official_page_url": "https://acme.example/tote",
+    "official_brand": "Acme",
+    "official_sku": "AC-1",
+    "official_price": "1,200",
+    "notes": "Same hardware, \"Acme\" stamp {and} [brackets]",
+}
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_parser_yields_each_field_as_it_completes():
+    parser = IncrementalJsonParser()
+    assert parser.feed('Here you go:\n```json\n{"match_found": tr') == []
+    assert parser.feed('ue, "match_confidence": 0.9') == [("match_found", True)]
+    assert parser.feed(', "tags": ["a", {"b": "}"}]}\n```') == [
+        ("match_confidence", 0.9), ("tags", ["a", {"b": "}"}])]
+    assert parser.finished
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_parser_is_independent_of_chunk_boundaries(size):
+    parser = IncrementalJsonParser()
+    pairs = []
+    for chunk in chunked(json.dumps(MATCH), size):
+        pairs += parser.feed(chunk)
+    assert dict(pairs) == MATCH and parser.finished
+
+
+def test_parser_salvages_a_trailing_scalar_on_close():
+    parser = IncrementalJsonParser()
+    assert parser.feed('{"match_found": true, "match_confidence": 0.7') == [("match_found", True)]
+    assert parser.close() == [("match_confidence", 0.7)]
+
+
+def test_parser_drops_a_value_cut_off_mid_string():
+    parser = IncrementalJsonParser()
+    parser.feed('{"match_found": true, "official_page_url": "https://acme.ex')
+    assert parser.close() == []
+
+
+def test_parse_stream_validates_fields_and_fills_known_values():
+    text = json.dumps({**MATCH, "match_confidence": 1.5, "official_sku": 42, "extra": 1})
+    result = parse_stream(chunked(text, 5), OfficialMatchResult, known={"product_internal_id": "655728"})
+
+    assert set(result.errors) == {"match_confidence", "official_sku"}
+    assert result.values["product_internal_id"] == "655728"
+    assert "extra" not in result.values
+    assert result.complete
+
+
+def test_no_json_object_breaks_required_fields():
+    result = parse_text("I could not find this product.", OfficialMatchResult)
+    assert not result.complete
+    with pytest.raises(ValueError, match="match_found, match_confidence"):
+        check_grounded(result)
+
+
+def test_invalid_verdict_is_not_repaired():
+    result = parse_text(json.dumps({**MATCH, "match_confidence": "high"}), OfficialMatchResult)
+
+    def call_fn(prompt, schema):
+        raise AssertionError("grounded fields must not be repaired")
+
+    with pytest.raises(ValueError, match="match_confidence"):
+        repair(result, "payload", call_fn)
+
+
+def test_truncated_match_leaves_official_fields_null_instead_of_repairing():
+    text = json.dumps(MATCH)
+    truncated = text[:text.index('"official_sku"') + 19]  # cut inside the SKU string
+    result = parse_stream([truncated], OfficialMatchResult)
+    assert not result.complete
+    check_grounded(result)
+
+    calls = []
+
+    def call_fn(prompt, schema):
+        calls.append(schema)
+        return json.dumps({"notes": "repaired", "official_sku": "INVENTED", "official_price": "1"})
+
+    repaired = repair(result, "payload", call_fn)
+    record = repaired.record()
+    assert set(calls[0]["properties"]) == {"notes"}
+    assert record["notes"] == "repaired"
+    assert record["official_sku"] is None and record["official_price"] is None
+    assert record["official_page_url"] == MATCH["official_page_url"] and record["match_found"] is True
+
+
+def test_repair_fills_only_broken_fields():
+    result = parse_text(json.dumps({"product_internal_id": "1", "inferred_brand": "Acme",
+                                    "search_queries": []}), InferenceResult)
+    assert result.broken == ["search_queries"]
+    prompts = []
+
+    def call_fn(prompt, schema):
+        prompts.append(prompt)
+        assert set(schema["properties"]) == {"search_queries"}
+        return json.dumps({"search_queries": ["acme tote"], "inferred_brand": "Other"})
+
+    record = repair(result, "payload", call_fn).record()
+    assert record["search_queries"] == ["acme tote"]
+    assert record["inferred_brand"] == "Acme"
+    assert '"search_queries": []' in prompts[0]
+    assert "- search_queries: must have at least 1 items" in prompts[0]
+
+
+def test_failed_repair_keeps_the_partial_result():
+    result = parse_text('{"product_internal_id": "1"}', InferenceResult)
+
+    def call_fn(prompt, schema):
+        raise RuntimeError("quota")
+
+    assert repair(result, "payload", call_fn).record()["search_queries"] == []
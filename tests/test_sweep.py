@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+import sweep
+from models import RawProductRecord
+from sweep import SweepState, rescan_skipped, sweep_ids
+
+
+class FakeSite:
+    """probe_fn stand-in: `live` IDs have products, everything else is a 404."""
+
+    def __init__(self, live, fail_at=None):
+        self.live = set(live)
+        self.fail_at = fail_at
+        self.probed = []
+        self._lock = threading.Lock()
+
+    def __call__(self, product_id):
+        with self._lock:
+            self.probed.append(product_id)
+        if product_id == self.fail_at:
+            raise RuntimeError("circuit open")
+        if product_id in self.live:
+            return product_id, RawProductRecord(product_url=f"https://x/{product_id}", internal_id=str(product_id))
+        return product_id, None
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SweepState(tmp_path / "sweep_state.json")
+
+
+def found(records):
+    return [int(r.internal_id) for r in records]
+
+
+def test_dense_range_is_probed_in_full(state):
+    site = FakeSite(range(100, 140))
+    assert found(sweep_ids(100, 139, state, workers=4, probe_fn=site)) == list(range(100, 140))
+    assert sorted(site.probed) == list(range(100, 140))
+    assert state.high_water_mark == 139 and state.skipped == []
+
+
+def test_stride_doubles_once_per_run_of_misses(state):
+    site = FakeSite([])
+    list(sweep_ids(1, 2000, state, workers=4, max_misses=20, probe_fn=site))
+    probed = sorted(site.probed)
+    strides = [b - a for a, b in zip(probed, probed[1:])]
+    # Each stride is used for a whole run of misses before it doubles
+    for stride in (1, 2, 4, 8):
+        assert strides.count(stride) >= 19
+
+
+def test_bounded_sweep_lands_on_narrow_clusters_and_records_skips(state):
+    site = FakeSite(list(range(400, 410)) + [2000])
+    assert found(sweep_ids(90, 2100, state, probe_fn=site)) == list(range(400, 410))
+
+    # Everything not probed is recorded, so nothing in the range is silently lost
+    probed = set(site.probed)
+    skipped = {i for first, last in state.skipped for i in range(first, last + 1)}
+    assert set(range(90, 2101)) - probed <= skipped
+    assert 2000 in skipped
+
+    assert found(rescan_skipped(state, probe_fn=site)) == [2000]
+    assert state.skipped == []
+    assert SweepState(state.path).skipped == []
+
+
+def test_tail_sweep_stops_at_the_first_gap(state):
+    site = FakeSite(range(10, 20))
+    assert found(sweep_ids(10, None, state, workers=4, max_misses=8, probe_fn=site)) == list(range(10, 20))
+    assert max(site.probed) < 40
+    assert state.high_water_mark == 19
+
+
+def test_probe_error_saves_state_and_raises(state):
+    site = FakeSite(range(1, 10), fail_at=20)
+    records = sweep_ids(1, 100, state, workers=4, probe_fn=site)
+    with pytest.raises(RuntimeError):
+        list(records)
+    saved = SweepState(state.path)
+    assert saved.high_water_mark == 9
+
+
+def test_skip_merges_ranges_split_by_a_single_probe(state):
+    state.skip(10, 11)
+    state.skip(13, 15)
+    state.skip(40, 40)
+    assert state.skipped == [[10, 15], [40, 40]]
+
+
+def test_sparse_region_starts_in_skip_mode(state):
+    state.regions[0] = [100, 0]
+    site = FakeSite([])
+    list(sweep_ids(1, 40, state, workers=4, max_misses=100, probe_fn=site))
+    assert sorted(site.probed) == list(range(1, 41, 2))
+    assert sweep.SweepState(state.path).skipped == [[2, 40]]
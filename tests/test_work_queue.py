@@ -0,0 +1,137 @@
+import time
+
+import pytest
+
+import work_queue
+from work_queue import SQLiteWorkQueue
+from worker import Heartbeat, Worker
+
+
+class FakeClock:
+    """Stands in for the time module inside work_queue so leases expire on demand."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(work_queue, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = SQLiteWorkQueue(str(tmp_path / "queue.db"), visibility_timeout=60, max_attempts=2)
+    yield q
+    q.close()
+
+
+def test_enqueue_is_idempotent(queue):
+    assert queue.enqueue("scrape", "1", {"url": "u1"})
+    assert not queue.enqueue("scrape", "1", {"url": "other"})
+    assert queue.stats()["scrape"]["pending"] == 1
+
+
+def test_claimed_item_is_invisible_until_the_lease_expires(queue, clock):
+    queue.enqueue("scrape", "1", {"url": "u1"})
+
+    lease = queue.claim("scrape", "a")
+    assert lease.item_id == "1" and lease.attempts == 1 and lease.payload == {"url": "u1"}
+    assert queue.claim("scrape", "b") is None
+    assert queue.active_workers() == {"a": 1}
+
+    clock.now += 61
+    reclaimed = queue.claim("scrape", "b")
+    assert reclaimed.item_id == "1" and reclaimed.attempts == 2
+    # The first worker's lease is gone: its late calls are rejected
+    assert not queue.renew(lease)
+    assert not queue.complete(lease)
+    assert queue.fail(lease, "late") == "lost"
+    assert queue.complete(reclaimed)
+    assert queue.stats()["scrape"]["done"] == 1
+
+
+def test_renew_keeps_the_lease(queue, clock):
+    queue.enqueue("scrape", "1")
+    lease = queue.claim("scrape", "a")
+
+    clock.now += 50
+    assert queue.renew(lease)
+    clock.now += 50
+    assert queue.claim("scrape", "b") is None
+    assert queue.complete(lease)
+
+
+def test_failures_retry_then_dead_letter(queue):
+    queue.enqueue("match", "1")
+
+    assert queue.fail(queue.claim("match", "a"), "ValueError: first") == "pending"
+    lease = queue.claim("match", "a")
+    assert lease.attempts == 2
+    assert queue.fail(lease, "ValueError: second") == "dead"
+    assert queue.claim("match", "a") is None
+    assert queue.dead_letters("match") == [{"item_id": "1", "attempts": 2, "last_error": "ValueError: second"}]
+
+    assert queue.requeue_dead("match") == 1
+    assert queue.claim("match", "a").attempts == 1
+
+
+def test_expired_lease_on_last_attempt_is_dead_lettered(queue, clock):
+    queue.enqueue("match", "1")
+    queue.fail(queue.claim("match", "a"), "boom")
+    queue.claim("match", "a")
+
+    clock.now += 61
+    assert queue.claim("match", "b") is None
+    assert queue.dead_letters("match") == [{"item_id": "1", "attempts": 2, "last_error": "boom"}]
+
+
+def test_heartbeat_renews_past_the_visibility_timeout(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"), visibility_timeout=0.3)
+    queue.enqueue("infer", "1")
+    lease = queue.claim("infer", "a")
+
+    with Heartbeat(queue, lease, interval=0.05) as hb:
+        time.sleep(0.6)
+        assert queue.claim("infer", "b") is None
+    assert not hb.lost
+    assert queue.complete(lease)
+    queue.close()
+
+
+def test_heartbeat_reports_a_lost_lease(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"), visibility_timeout=0.1)
+    queue.enqueue("infer", "1")
+    lease = queue.claim("infer", "a")
+    time.sleep(0.2)
+    queue.claim("infer", "b")
+
+    with Heartbeat(queue, lease, interval=0.05) as hb:
+        time.sleep(0.2)
+    assert hb.lost
+    queue.close()
+
+
+class FakeAgentB:
+    def process_product(self, raw, deadline=None):
+        return {"inferred_brand": "Acme", "search_queries": [raw["title"]]}
+
+
+def test_stages_hand_records_over_in_the_payload(queue, tmp_path, monkeypatch):
+    """A box without the raw_<id>.json file can still run inference from the queue."""
+    monkeypatch.chdir(tmp_path)
+    raw = {"internal_id": "1", "product_internal_id": "1", "title": "Acme Tote"}
+    queue.enqueue("infer", "1", {"raw": raw})
+    worker = Worker(queue, "box2")
+    worker._agent_b = FakeAgentB()
+
+    assert worker.process_one("infer")
+    lease = queue.claim("match", "box3")
+    assert lease.payload == {"checkpoint": {"raw": raw, "inference": {"inferred_brand": "Acme",
+                                                                      "search_queries": ["Acme Tote"]}}}
+    assert queue.stats()["infer"]["done"] == 1
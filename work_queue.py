@@ -0,0 +1,365 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed item stays invisible to other workers unless renewed
+VISIBILITY_TIMEOUT = 300
+# Attempts before an item is moved to the dead-letter state
+MAX_ATTEMPTS = 3
+
+DEFAULT_QUEUE_URL = "sqlite:///work_queue.db"
+
+STATES = ["pending", "leased", "done", "dead"]
+
+
+@dataclass
+class Lease:
+    stage: str
+    item_id: str
+    token: str
+    attempts: int
+    expires_at: float
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+class SQLiteWorkQueue:
+    """
+    Work queue backed by a single SQLite file. Safe for several processes on one
+    box (or a shared volume with working file locks).
+    """
+
+    def __init__(self, path: str = "work_queue.db",
+                 visibility_timeout: int = VISIBILITY_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                stage TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_token TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (stage, item_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_items_state ON items (stage, state)")
+
+    def clone(self) -> "SQLiteWorkQueue":
+        """Opens a second connection, e.g. for a heartbeat thread. close() it when done."""
+        return SQLiteWorkQueue(self.path, self.visibility_timeout, self.max_attempts)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue(self, stage: str, item_id: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+        """Adds an item. Returns False if the item already exists for this stage."""
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO items (stage, item_id, payload, updated_at) VALUES (?, ?, ?, ?)",
+            (stage, item_id, json.dumps(payload or {}), time.time())
+        )
+        return cur.rowcount == 1
+
+    def claim(self, stage: str, worker_id: str) -> Optional[Lease]:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that used up their attempts go to dead letters
+            self.conn.execute(
+                "UPDATE items SET state = 'dead', last_error = COALESCE(last_error, 'lease expired'), "
+                "lease_token = NULL, updated_at = ? "
+                "WHERE stage = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, stage, now, self.max_attempts)
+            )
+            row = self.conn.execute(
+                "SELECT item_id, payload, attempts FROM items "
+                "WHERE stage = ? AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                "ORDER BY updated_at LIMIT 1",
+                (stage, now)
+            ).fetchone()
+            if not row:
+                self.conn.execute("COMMIT")
+                return None
+
+            item_id, payload, attempts = row
+            token = uuid.uuid4().hex
+            expires_at = now + self.visibility_timeout
+            self.conn.execute(
+                "UPDATE items SET state = 'leased', attempts = attempts + 1, lease_token = ?, "
+                "lease_owner = ?, lease_expires = ?, updated_at = ? WHERE stage = ? AND item_id = ?",
+                (token, worker_id, expires_at, now, stage, item_id)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return Lease(stage=stage, item_id=item_id, token=token, attempts=attempts + 1,
+                     expires_at=expires_at, payload=json.loads(payload))
+
+    def renew(self, lease: Lease) -> bool:
+        """Heartbeat: extends the lease. Returns False if the lease was lost."""
+        expires_at = time.time() + self.visibility_timeout
+        cur = self.conn.execute(
+            "UPDATE items SET lease_expires = ? WHERE stage = ? AND item_id = ? "
+            "AND state = 'leased' AND lease_token = ?",
+            (expires_at, lease.stage, lease.item_id, lease.token)
+        )
+        if cur.rowcount == 1:
+            lease.expires_at = expires_at
+            return True
+        return False
+
+    def complete(self, lease: Lease) -> bool:
+        cur = self.conn.execute(
+            "UPDATE items SET state = 'done', lease_token = NULL, updated_at = ? "
+            "WHERE stage = ? AND item_id = ? AND lease_token = ?",
+            (time.time(), lease.stage, lease.item_id, lease.token)
+        )
+        return cur.rowcount == 1
+
+    def fail(self, lease: Lease, error: str) -> str:
+        """
+        Releases a failed item for retry, or dead-letters it. Returns the new state, or
+        "lost" if the lease had already expired and been reclaimed.
+        """
+        state = "dead" if lease.attempts >= self.max_attempts else "pending"
+        cur = self.conn.execute(
+            "UPDATE items SET state = ?, lease_token = NULL, last_error = ?, updated_at = ? "
+            "WHERE stage = ? AND item_id = ? AND lease_token = ?",
+            (state, error[:2000], time.time(), lease.stage, lease.item_id, lease.token)
+        )
+        return state if cur.rowcount == 1 else "lost"
+
+    def requeue_dead(self, stage: str) -> int:
+        cur = self.conn.execute(
+            "UPDATE items SET state = 'pending', attempts = 0, updated_at = ? "
+            "WHERE stage = ? AND state = 'dead'",
+            (time.time(), stage)
+        )
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        now = time.time()
+        result: Dict[str, Dict[str, int]] = {}
+        rows = self.conn.execute(
+            "SELECT stage, CASE WHEN state = 'leased' AND lease_expires < ? THEN 'pending' ELSE state END, "
+            "COUNT(*) FROM items GROUP BY 1, 2",
+            (now,)
+        ).fetchall()
+        for stage, state, count in rows:
+            result.setdefault(stage, {s: 0 for s in STATES})[state] += count
+        return result
+
+    def dead_letters(self, stage: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT item_id, attempts, last_error FROM items WHERE stage = ? AND state = 'dead' "
+            "ORDER BY updated_at",
+            (stage,)
+        ).fetchall()
+        return [{"item_id": r[0], "attempts": r[1], "last_error": r[2]} for r in rows]
+
+    def active_workers(self) -> Dict[str, int]:
+        rows = self.conn.execute(
+            "SELECT lease_owner, COUNT(*) FROM items WHERE state = 'leased' AND lease_expires >= ? "
+            "GROUP BY lease_owner",
+            (time.time(),)
+        ).fetchall()
+        return {owner: count for owner, count in rows}
+
+
+# Lease transitions on Redis run as Lua scripts so the token check and the write are
+# atomic: otherwise a lease reclaimed between them could be re-added while also pending.
+# KEYS: leases, tokens, attempts, dead, pending; ARGV: item_id, max_attempts
+_RECLAIM_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+redis.call('HDEL', KEYS[2], ARGV[1])
+if tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0') >= tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[4], ARGV[1], 'lease expired')
+else
+    redis.call('RPUSH', KEYS[5], ARGV[1])
+end
+return 1
+"""
+# Pop and lease in one step, so a worker dying in between cannot drop the item.
+# KEYS: pending, leases, tokens, owners, attempts, payload; ARGV: token, worker_id, expires_at
+_CLAIM_SCRIPT = """
+local item_id = redis.call('LPOP', KEYS[1])
+if not item_id then return nil end
+redis.call('ZADD', KEYS[2], ARGV[3], item_id)
+redis.call('HSET', KEYS[3], item_id, ARGV[1])
+redis.call('HSET', KEYS[4], item_id, ARGV[2])
+local attempts = redis.call('HINCRBY', KEYS[5], item_id, 1)
+return {item_id, attempts, redis.call('HGET', KEYS[6], item_id) or '{}'}
+"""
+# KEYS: tokens, leases; ARGV: item_id, token, expires_at
+_RENEW_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+# KEYS: tokens, leases, done; ARGV: item_id, token
+_COMPLETE_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1])
+return 1
+"""
+# KEYS: tokens, leases, errors, dead, pending; ARGV: item_id, token, error, state
+_FAIL_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+if ARGV[4] == 'dead' then
+    redis.call('HSET', KEYS[4], ARGV[1], ARGV[3])
+else
+    redis.call('RPUSH', KEYS[5], ARGV[1])
+end
+return 1
+"""
+
+
+class RedisWorkQueue:
+    """
+    Work queue on any Redis-compatible server (Redis, Valkey, KeyDB, or a local
+    stand-in such as fakeredis). Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0",
+                 visibility_timeout: int = VISIBILITY_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS,
+                 prefix: str = "automatch",
+                 client: Any = None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("RedisWorkQueue requires the 'redis' package: pip install redis") from e
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.r = client
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self._claim = self.r.register_script(_CLAIM_SCRIPT)
+        self._reclaim = self.r.register_script(_RECLAIM_SCRIPT)
+        self._renew = self.r.register_script(_RENEW_SCRIPT)
+        self._complete = self.r.register_script(_COMPLETE_SCRIPT)
+        self._fail = self.r.register_script(_FAIL_SCRIPT)
+
+    def close(self) -> None:
+        self.r.close()
+
+    def _key(self, stage: str, name: str) -> str:
+        return f"{self.prefix}:{stage}:{name}"
+
+    def _stages(self) -> List[str]:
+        return sorted(self.r.smembers(f"{self.prefix}:stages"))
+
+    def enqueue(self, stage: str, item_id: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+        self.r.sadd(f"{self.prefix}:stages", stage)
+        if not self.r.hsetnx(self._key(stage, "payload"), item_id, json.dumps(payload or {})):
+            return False
+        self.r.rpush(self._key(stage, "pending"), item_id)
+        return True
+
+    def _reclaim_expired(self, stage: str) -> None:
+        now = time.time()
+        keys = [self._key(stage, name) for name in ("leases", "tokens", "attempts", "dead", "pending")]
+        for item_id in self.r.zrangebyscore(self._key(stage, "leases"), 0, now):
+            # Only the worker whose ZREM succeeds gets to move the item
+            self._reclaim(keys=keys, args=[item_id, self.max_attempts])
+
+    def claim(self, stage: str, worker_id: str) -> Optional[Lease]:
+        self._reclaim_expired(stage)
+        token = uuid.uuid4().hex
+        expires_at = time.time() + self.visibility_timeout
+        keys = [self._key(stage, name) for name in ("pending", "leases", "tokens", "owners", "attempts", "payload")]
+        result = self._claim(keys=keys, args=[token, worker_id, expires_at])
+        if result is None:
+            return None
+        item_id, attempts, payload = result
+        return Lease(stage=stage, item_id=item_id, token=token, attempts=int(attempts),
+                     expires_at=expires_at, payload=json.loads(payload))
+
+    def renew(self, lease: Lease) -> bool:
+        expires_at = time.time() + self.visibility_timeout
+        keys = [self._key(lease.stage, "tokens"), self._key(lease.stage, "leases")]
+        if not self._renew(keys=keys, args=[lease.item_id, lease.token, expires_at]):
+            return False
+        lease.expires_at = expires_at
+        return True
+
+    def complete(self, lease: Lease) -> bool:
+        keys = [self._key(lease.stage, name) for name in ("tokens", "leases", "done")]
+        return bool(self._complete(keys=keys, args=[lease.item_id, lease.token]))
+
+    def fail(self, lease: Lease, error: str) -> str:
+        state = "dead" if lease.attempts >= self.max_attempts else "pending"
+        keys = [self._key(lease.stage, name) for name in ("tokens", "leases", "errors", "dead", "pending")]
+        if not self._fail(keys=keys, args=[lease.item_id, lease.token, error[:2000], state]):
+            return "lost"
+        return state
+
+    def requeue_dead(self, stage: str) -> int:
+        dead = self.r.hkeys(self._key(stage, "dead"))
+        for item_id in dead:
+            self.r.hdel(self._key(stage, "dead"), item_id)
+            self.r.hset(self._key(stage, "attempts"), item_id, 0)
+            self.r.rpush(self._key(stage, "pending"), item_id)
+        return len(dead)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        result: Dict[str, Dict[str, int]] = {}
+        for stage in self._stages():
+            result[stage] = {
+                "pending": self.r.llen(self._key(stage, "pending")),
+                "leased": self.r.zcard(self._key(stage, "leases")),
+                "done": self.r.scard(self._key(stage, "done")),
+                "dead": self.r.hlen(self._key(stage, "dead")),
+            }
+        return result
+
+    def dead_letters(self, stage: str) -> List[Dict[str, Any]]:
+        dead = self.r.hgetall(self._key(stage, "dead"))
+        attempts = self.r.hgetall(self._key(stage, "attempts"))
+        return [{"item_id": k, "attempts": int(attempts.get(k, 0)), "last_error": v} for k, v in dead.items()]
+
+    def active_workers(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        now = time.time()
+        for stage in self._stages():
+            owners = self.r.hgetall(self._key(stage, "owners"))
+            for item_id in self.r.zrangebyscore(self._key(stage, "leases"), now, "+inf"):
+                owner = owners.get(item_id, "unknown")
+                counts[owner] = counts.get(owner, 0) + 1
+        return counts
+
+
+def open_queue(url: Optional[str] = None, **kwargs):
+    """
+    Opens a queue from a URL: `sqlite:///path/to/queue.db` (default) or
+    `redis://host:port/db`. Falls back to the AUTOMATCH_QUEUE_URL env var.
+    """
+    url = url or os.environ.get("AUTOMATCH_QUEUE_URL") or DEFAULT_QUEUE_URL
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url, **kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteWorkQueue(url[len("sqlite:///"):], **kwargs)
+    return SQLiteWorkQueue(url, **kwargs)
@@ -0,0 +1,296 @@
+import argparse
+import glob
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import codec
+from resilience import product_deadline
+from work_queue import Lease, open_queue
+
+if TYPE_CHECKING:
+    from agent_d import DeltaExport
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["scrape", "infer", "match"]
+
+PRODUCT_ID_PATTERN = re.compile(r'productinfoen_(\d+)\.html')
+
+
+class Heartbeat:
+    """Renews a lease in the background while the stage handler runs."""
+
+    def __init__(self, queue, lease: Lease, interval: float):
+        self.queue = queue
+        self.lease = lease
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # SQLite connections are per-thread, so the heartbeat opens its own handle
+        queue = self.queue.clone() if hasattr(self.queue, "clone") else self.queue
+        try:
+            while not self._stop.wait(self.interval):
+                if not queue.renew(self.lease):
+                    logger.warning(f"Lost lease on {self.lease.stage}/{self.lease.item_id}")
+                    self.lost = True
+                    return
+        finally:
+            if queue is not self.queue:
+                queue.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Worker:
+    def __init__(self, queue, worker_id: Optional[str] = None, verify_images: bool = False,
+                 delta: Optional["DeltaExport"] = None):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.verify_images = verify_images
+        self.delta = delta
+        self._agent_b = None
+        self._agent_c = None
+        self.match_results: List[Dict[str, Any]] = []
+
+    @property
+    def agent_b(self):
+        if self._agent_b is None:
+            from agent_b import AgentB
+            self._agent_b = AgentB()
+        return self._agent_b
+
+    @property
+    def agent_c(self):
+        if self._agent_c is None:
+            from agent_c import AgentC
+            self._agent_c = AgentC()
+        return self._agent_c
+
+    def close(self) -> None:
+        """Releases the agents' cached prompt prefixes."""
+        for agent in (self._agent_b, self._agent_c):
+            if agent is not None:
+                agent.close()
+
+    def handle_scrape(self, lease: Lease) -> None:
+        from scraper import extract_product_detail
+        record = extract_product_detail(lease.payload["url"], deadline=product_deadline(["scrape"]))
+        if not record or not record.internal_id:
+            raise ValueError(f"No product record at {lease.payload['url']}")
+        raw_json = record.to_json()
+        raw_json["product_internal_id"] = raw_json.get("internal_id")
+        codec.dump_file(f"raw_{raw_json['product_internal_id']}.json", raw_json)
+        # The record travels in the payload so the next stage can run on another box
+        self.queue.enqueue("infer", raw_json["product_internal_id"], {"raw": raw_json})
+
+    def handle_infer(self, lease: Lease) -> None:
+        raw_json = lease.payload.get("raw") or codec.load_file(f"raw_{lease.item_id}.json")
+        inference_record = self.agent_b.process_product(raw_json, deadline=product_deadline(["infer"]))
+        checkpoint = {
+            "raw": raw_json,
+            "inference": inference_record
+        }
+        codec.dump_file(f"checkpoint_{lease.item_id}.json", checkpoint)
+        self.queue.enqueue("match", lease.item_id, {"checkpoint": checkpoint})
+
+    def handle_match(self, lease: Lease) -> None:
+        from agent_d import append_product_row
+        data = lease.payload.get("checkpoint") or codec.load_file(f"checkpoint_{lease.item_id}.json")
+        raw = data["raw"]
+        inference = data["inference"]
+        deadline = product_deadline(["match"])
+        match_result = self.agent_c.find_match(raw, inference, deadline=deadline)
+        if self.verify_images:
+            from image_verify import verify_match
+            match_result = verify_match(raw, match_result, deadline=deadline)
+        codec.dump_file(f"match_{lease.item_id}.json", match_result)
+        review_flag = append_product_row(raw, match_result, inference, delta=self.delta)
+        self.match_results.append({
+            "match_found": match_result.get("match_found", False),
+            "match_confidence": match_result.get("match_confidence"),
+            "needs_review": review_flag
+        })
+
+    def process_one(self, stage: str) -> bool:
+        """Claims and processes one item. Returns False if the stage queue is empty."""
+        lease = self.queue.claim(stage, self.worker_id)
+        if not lease:
+            return False
+
+        handler: Callable[[Lease], None] = getattr(self, f"handle_{stage}")
+        logger.info(f"[{self.worker_id}] {stage}/{lease.item_id} (attempt {lease.attempts})")
+        try:
+            with Heartbeat(self.queue, lease, interval=self.queue.visibility_timeout / 3) as hb:
+                handler(lease)
+            if hb.lost:
+                logger.warning(f"{stage}/{lease.item_id} finished after its lease expired; result kept")
+            self.queue.complete(lease)
+        except Exception as e:
+            state = self.queue.fail(lease, f"{type(e).__name__}: {e}")
+            logger.error(f"Error in {stage}/{lease.item_id}: {e} -> {state}")
+        return True
+
+    def run(self, stages: List[str], max_items: Optional[int] = None,
+            drain: bool = True, idle_sleep: float = 5.0) -> int:
+        """
+        Processes items, preferring later stages so products flow to export.
+        With drain=True the worker exits once every stage queue is empty.
+        """
+        processed = 0
+        ordered = [s for s in reversed(STAGES) if s in stages]
+        while max_items is None or processed < max_items:
+            if any(self.process_one(stage) for stage in ordered):
+                processed += 1
+                continue
+            if drain:
+                break
+            time.sleep(idle_sleep)
+        return processed
+
+
+def seed_from_listing(queue, listing_url: str, limit: int) -> int:
+    from pipeline import get_targeted_urls
+    added = 0
+    for url in get_targeted_urls(listing_url, limit):
+        id_match = PRODUCT_ID_PATTERN.search(url)
+        item_id = id_match.group(1) if id_match else url
+        added += queue.enqueue("scrape", item_id, {"url": url})
+    return added
+
+
+def seed_from_sweep(queue, path: str) -> int:
+    """
+    Enqueues products found by sweep.py for inference. The sweep already scraped
+    them, so each record is stored as raw_<id>.json and skips the scrape stage.
+    """
+    added = 0
+    for record in codec.iter_jsonl(path):
+        item_id = record.get("internal_id")
+        if not item_id:
+            continue
+        raw_json = {**record, "product_internal_id": item_id}
+        raw_path = f"raw_{item_id}.json"
+        if not os.path.exists(raw_path):
+            codec.dump_file(raw_path, raw_json)
+        added += queue.enqueue("infer", item_id, {"raw": raw_json})
+    return added
+
+
+def seed_from_checkpoints(queue) -> int:
+    added = 0
+    for cp_file in glob.glob("checkpoint_*.json"):
+        item_id = cp_file[len("checkpoint_"):-len(".json")]
+        added += queue.enqueue("match", item_id, {"checkpoint": codec.load_file(cp_file)})
+    return added
+
+
+def print_status(queue) -> None:
+    """Coordinator report: per-stage progress, live workers and dead letters."""
+    stats = queue.stats()
+    print(f"{'stage':<8} {'pending':>8} {'leased':>8} {'done':>8} {'dead':>8} {'progress':>9}")
+    for stage in STAGES:
+        s = stats.get(stage, {"pending": 0, "leased": 0, "done": 0, "dead": 0})
+        total = sum(s.values())
+        progress = f"{100.0 * (s['done'] + s['dead']) / total:.1f}%" if total else "-"
+        print(f"{stage:<8} {s['pending']:>8} {s['leased']:>8} {s['done']:>8} {s['dead']:>8} {progress:>9}")
+
+    workers = queue.active_workers()
+    print(f"\nActive workers: {len(workers)}")
+    for owner, count in sorted(workers.items()):
+        print(f"  {owner}: {count} leased")
+
+    for stage in STAGES:
+        dead = queue.dead_letters(stage)
+        if dead:
+            print(f"\nDead letters ({stage}):")
+            for d in dead:
+                print(f"  {d['item_id']} (attempts={d['attempts']}): {d['last_error']}")
+
+
+def main():
+    from logging_setup import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(description="AutoMatch distributed worker")
+    parser.add_argument("--queue", help="Queue URL (sqlite:///work_queue.db or redis://host:6379/0)")
+    parser.add_argument("--visibility-timeout", type=int, default=300, help="Lease duration in seconds")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Failures before dead-lettering")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    seed = sub.add_parser("seed", help="Enqueue work")
+    seed.add_argument("--listing", help="Listing URL to enqueue for scraping")
+    seed.add_argument("--limit", type=int, default=3, help="Number of products to take from the listing")
+    seed.add_argument("--checkpoints", action="store_true", help="Enqueue existing checkpoints for matching")
+    seed.add_argument("--sweep-results", help="Enqueue products from a sweep.py JSON-lines file for inference")
+
+    run = sub.add_parser("run", help="Claim and process work")
+    run.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    run.add_argument("--worker-id", help="Worker name shown in status reports")
+    run.add_argument("--max-items", type=int, help="Stop after processing this many items")
+    run.add_argument("--follow", action="store_true", help="Keep polling when queues are empty")
+    run.add_argument("--verify-images", action="store_true", help="Compare official and supplier images to auto-accept/reject matches")
+
+    sub.add_parser("status", help="Report queue progress")
+
+    requeue = sub.add_parser("requeue-dead", help="Move dead letters back to pending")
+    requeue.add_argument("--stage", choices=STAGES, required=True)
+
+    args = parser.parse_args()
+    queue = open_queue(args.queue, visibility_timeout=args.visibility_timeout, max_attempts=args.max_attempts)
+
+    if args.command == "seed":
+        added = 0
+        if args.listing:
+            added += seed_from_listing(queue, args.listing, args.limit)
+        if args.sweep_results:
+            added += seed_from_sweep(queue, args.sweep_results)
+        if args.checkpoints:
+            added += seed_from_checkpoints(queue)
+        print(f"Enqueued {added} items.")
+    elif args.command == "run":
+        from agent_d import DeltaExport
+        from process_batch import write_run_stats
+        from prompt_cache import merge_usage
+        started_at = datetime.now(timezone.utc)
+        worker = Worker(queue, args.worker_id, verify_images=args.verify_images)
+        run_id = started_at.strftime(f"qiqiyg-%Y%m%dT%H%M%S-{worker.worker_id}")
+        worker.delta = DeltaExport(run_id)
+        try:
+            processed = worker.run(args.stages, max_items=args.max_items, drain=not args.follow)
+        finally:
+            worker.close()
+        logger.info(f"[{worker.worker_id}] processed {processed} items")
+        if worker.match_results:
+            # Products whose checkpoint is gone are reported as removed in this run's delta
+            worker.delta.finish(catalog_ids=[Path(cp).stem[len("checkpoint_"):] for cp in glob.glob("checkpoint_*.json")])
+            write_run_stats(
+                run_id=run_id,
+                started_at=started_at,
+                finished_at=datetime.now(timezone.utc),
+                supplier_name="QiQiYG",
+                results=worker.match_results,
+                token_usage=merge_usage(*(a.usage for a in (worker._agent_b, worker._agent_c) if a))
+            )
+    elif args.command == "status":
+        print_status(queue)
+    elif args.command == "requeue-dead":
+        print(f"Requeued {queue.requeue_dead(args.stage)} items.")
+
+
+if __name__ == "__main__":
+    main()